@@ -0,0 +1,243 @@
+"""
+Virtual aggregation of the netCDF files of one dataset along the time axis.
+
+The aggregation is built from the file headers of the catalog, without
+opening the files: the files are taken in the given order, as with
+netCDF4.MFDataset and utils.get_time, and the offset of each file on the
+aggregated time axis is the sum of the lengths of the previous files.
+Reading a slice of a variable translates the indices of the aggregated time
+axis into reads of the files concerned only, so that large datasets are read
+lazily, in any netCDF format. The open files are kept in a bounded pool of
+handles.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+from netCDF4 import Dataset
+
+from flyingpigeon import calendars
+from flyingpigeon.catalog import get_headers
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# Maximum number of files kept open by an aggregation.
+POOL_SIZE = 8
+
+
+def _time_dimension(header):
+    for name, (size, unlimited) in header['dimensions'].items():
+        if unlimited:
+            return name
+    for name in ['time', 'time_counter']:
+        if name in header['dimensions']:
+            return name
+    return None
+
+
+def _convert_time(values, units, calendar, target_units):
+    """converts time values into other units of the same calendar"""
+    factor, _ = calendars.parse_units(target_units)
+    reference = calendars.decode(0, target_units, calendar)
+    return (calendars.decode(values, units, calendar) - reference) / float(factor)
+
+
+def _sorted_key(index):
+    """
+    index of a netCDF read covering sorted positions of a file
+
+    :return: index to read, positions of the values in the read array (None if the read is exact)
+    """
+    if len(index) == 1:
+        return slice(index[0], index[0] + 1), None
+    step = index[1] - index[0]
+    if step > 0 and np.all(np.diff(index) == step):
+        return slice(index[0], index[-1] + 1, step), None
+    unique, inverse = np.unique(index, return_inverse=True)
+    return slice(unique[0], unique[-1] + 1), unique[inverse] - unique[0]
+
+
+class AggregatedVariable(object):
+    """
+    variable of an aggregation, read lazily with the numpy slicing syntax
+    """
+
+    def __init__(self, aggregation, name, header):
+        self._aggregation = aggregation
+        self.name = name
+        self.dimensions = tuple(header['dimensions'])
+        try:
+            self.dtype = np.dtype(header['dtype'])
+        except TypeError:
+            # variable length strings
+            self.dtype = str
+        self._attributes = header['attributes']
+        self.aggregated = len(self.dimensions) > 0 and self.dimensions[0] == aggregation.time_dimension
+        self.shape = tuple(aggregation.dimensions[d] for d in self.dimensions)
+        self.ndim = len(self.dimensions)
+
+    def ncattrs(self):
+        return list(self._attributes.keys())
+
+    def getncattr(self, name):
+        return self._attributes[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._attributes:
+            raise AttributeError(name)
+        return self._attributes[name]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, *args):
+        return np.asarray(self[:], *args)
+
+    def _key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        return key + (slice(None),) * (self.ndim - len(key))
+
+    def _time_index(self, index):
+        """positions on the aggregated time axis, and whether the time dimension is dropped"""
+        size = self.shape[0]
+        if isinstance(index, slice):
+            return np.arange(*index.indices(size)), False
+        if np.ndim(index) == 0:
+            i = int(index)
+            if i < 0:
+                i += size
+            if not 0 <= i < size:
+                raise IndexError('index %s out of the time axis of size %s' % (index, size))
+            return np.array([i]), True
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        index = np.where(index < 0, index + size, index).astype(np.int64)
+        if len(index) and (index.min() < 0 or index.max() >= size):
+            raise IndexError('index out of the time axis of size %s' % size)
+        return index, False
+
+    def _read(self, i, key):
+        ds = self._aggregation._open(i)
+        values = ds.variables[self.name][key]
+        if self.name == self._aggregation.time_dimension:
+            units = getattr(ds.variables[self.name], 'units', None)
+            target = self._attributes.get('units')
+            if units is not None and target is not None and units != target:
+                values = _convert_time(values, units, self._attributes.get('calendar'), target)
+        return values
+
+    def __getitem__(self, key):
+        key = self._key(key)
+        if not self.aggregated:
+            return self._read(0, key)
+
+        index, drop = self._time_index(key[0])
+        rest = key[1:]
+        if len(index) == 0:
+            return self._read(0, (slice(0, 0),) + rest)
+
+        offsets = self._aggregation.offsets
+        files = np.searchsorted(offsets, index, side='right') - 1
+        # consecutive positions in the same file are read at once
+        breaks = np.flatnonzero(np.diff(files)) + 1
+        parts = []
+        for run in np.split(np.arange(len(index)), breaks):
+            i = files[run[0]]
+            read, take = _sorted_key(index[run] - offsets[i])
+            values = self._read(i, (read,) + rest)
+            if take is not None:
+                values = values[take]
+            parts.append(values)
+
+        values = parts[0] if len(parts) == 1 else np.ma.concatenate(parts)
+        if drop:
+            values = values[0]
+        return values
+
+
+class Aggregation(object):
+    """
+    netCDF files of one dataset aggregated along the time axis, see module documentation.
+    Variables without the time dimension are read from the first file.
+
+    :param resource: list of netCDF files of one dataset, sorted in time (see utils.sort_by_time)
+    :param pool_size: maximum number of files kept open
+    """
+
+    def __init__(self, resource, pool_size=POOL_SIZE):
+        if type(resource) != list:
+            resource = [resource]
+        if len(resource) == 0:
+            raise Exception('no files to aggregate')
+
+        headers = get_headers(resource)
+        first = headers[0]
+        self.files = resource
+        self.pool_size = pool_size
+        self.time_dimension = _time_dimension(first)
+        self._attributes = first['attributes']
+
+        if self.time_dimension is None and len(resource) > 1:
+            raise Exception('no time dimension to aggregate the files along')
+        sizes = []
+        for nc, header in zip(resource, headers):
+            if self.time_dimension is None:
+                sizes.append(0)
+                continue
+            if self.time_dimension not in header['dimensions']:
+                raise Exception('dimension %s not found in %s' % (self.time_dimension, nc))
+            sizes.append(header['dimensions'][self.time_dimension][0])
+        # position of the first time step of each file on the aggregated time axis
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+        self.dimensions = OrderedDict((name, size) for name, (size, _) in first['dimensions'].items())
+        if self.time_dimension is not None:
+            self.dimensions[self.time_dimension] = int(sum(sizes))
+        self.variables = OrderedDict((name, AggregatedVariable(self, name, var))
+                                     for name, var in first['variables'].items())
+        self._handles = OrderedDict()
+        LOGGER.debug('aggregation of %s files, %s time steps' % (len(resource), sum(sizes)))
+
+    def _open(self, i):
+        """returns the open handle of a file, opened if needed"""
+        nc = self.files[i]
+        if nc in self._handles:
+            ds = self._handles.pop(nc)
+        else:
+            ds = Dataset(nc)
+        self._handles[nc] = ds
+        while len(self._handles) > self.pool_size:
+            _, old = self._handles.popitem(last=False)
+            old.close()
+        return ds
+
+    def ncattrs(self):
+        return list(self._attributes.keys())
+
+    def getncattr(self, name):
+        return self._attributes[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name not in self._attributes:
+            raise AttributeError(name)
+        return self._attributes[name]
+
+    def close(self):
+        """
+        closes the open files
+        """
+        while self._handles:
+            _, ds = self._handles.popitem()
+            ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
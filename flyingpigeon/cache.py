@@ -0,0 +1,192 @@
+"""
+Cache for process results.
+
+Results are stored as files named after a key computed from the signatures
+(path, size and modification time) of the input files and the process
+parameters. The cache directory is
+bounded in size: when it grows beyond its limit, the least recently used
+entries are removed. A file lock in the cache directory serializes the
+creation and eviction of entries between concurrent processes.
+"""
+
+import fcntl
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+from tempfile import mkstemp
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def file_signature(filename):
+    """
+    returns a signature of a file from its path, size and modification time,
+    which changes when the file is rewritten, without reading its content
+
+    :param filename: path to file
+
+    :returns str: signature
+    """
+    stat = os.stat(filename)
+    return '%s:%d:%r' % (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+
+
+def make_key(resources={}, **params):
+    """
+    returns a key identifying sets of input files and parameters.
+    The input files are identified by their signature (see file_signature),
+    in their order within each named group, so that swapping the
+    files of two groups gives another key.
+
+    :param resources: dictionary of input file groups, e.g. {'candidate': [files], 'target': [files]}
+    :param params: parameters, converted to strings with repr
+
+    :returns str: hexadecimal key
+    """
+    sha = hashlib.sha1()
+    for role in sorted(resources):
+        files = resources[role]
+        if type(files) != list:
+            files = [files]
+        sha.update(('%s:' % role).encode('utf-8'))
+        for nc in files:
+            sha.update(('%s;' % file_signature(nc)).encode('utf-8'))
+        sha.update(b';')
+    for key in sorted(params):
+        sha.update(('%s=%r;' % (key, params[key])).encode('utf-8'))
+    return sha.hexdigest()
+
+
+@contextmanager
+def file_lock(path):
+    """
+    exclusive lock shared between processes, held for the duration of a with block
+
+    :param path: lock file, created if needed
+    """
+    with open(path, 'a') as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+class ResultCache(object):
+    """
+    Directory of result files with a least recently used eviction policy.
+
+    :param path: cache directory, created if needed
+    :param max_size: maximum size of the directory in bytes. None for no limit.
+    :param suffix: file name suffix of the entries
+    """
+
+    def __init__(self, path, max_size=None, suffix='.nc'):
+        self.path = path
+        self.max_size = max_size
+        self.suffix = suffix
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # created in the meantime by another process
+                if not os.path.isdir(path):
+                    raise
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def get(self, key):
+        """
+        returns the path of the cached file for the given key, or None.
+        The access time is recorded for the eviction policy.
+
+        :param key: entry key, see make_key
+        """
+        filename = self._entry(key)
+        try:
+            os.utime(filename, None)
+        except OSError:
+            return None
+        LOGGER.info('result found in cache: %s', os.path.basename(filename))
+        return filename
+
+    def copy(self, key, filename):
+        """
+        copies the cached file for the given key. The copy is made under the
+        cache lock, so that the entry is not evicted in the meantime.
+
+        :param key: entry key, see make_key
+        :param filename: destination file
+
+        :returns str: filename, or None if the entry is not found or cannot be copied
+        """
+        with file_lock(os.path.join(self.path, '.lock')):
+            cached = self.get(key)
+            if cached is None:
+                return None
+            try:
+                shutil.copyfile(cached, filename)
+            except (IOError, OSError):
+                LOGGER.exception('failed to copy the cached file %s', os.path.basename(cached))
+                if os.path.exists(filename):
+                    os.remove(filename)
+                return None
+        return filename
+
+    def put(self, key, filename):
+        """
+        stores a copy of a file in the cache and evicts old entries if the
+        size limit is exceeded.
+
+        :param key: entry key, see make_key
+        :param filename: file to store
+
+        :returns str: path of the cached file
+        """
+        # Copy under a temporary name and rename, so that concurrent
+        # processes never see a partial entry.
+        with file_lock(os.path.join(self.path, '.lock')):
+            fd, tmp = mkstemp(dir=self.path, suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(filename, tmp)
+                os.rename(tmp, self._entry(key))
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+            self.evict()
+        return self._entry(key)
+
+    def evict(self):
+        """
+        removes the least recently used entries until the cache fits
+        within its maximum size.
+        """
+        if self.max_size is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        for _, nbytes, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+                LOGGER.debug('removed from cache: %s', name)
+            except OSError:
+                # already removed by another process
+                pass
+            size -= nbytes
@@ -0,0 +1,183 @@
+"""
+Decoding of CF time coordinates.
+
+The time values are converted arithmetically into ordinals, the number of
+seconds since 0001-01-01 00:00:00 in the calendar of the file, from which the
+dates are computed without creating a datetime object per time step. The
+ordinals are a compact int64 representation, sortable and comparable within
+a calendar.
+"""
+
+import re
+
+import numpy as np
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# CF calendar names and their aliases.
+CALENDARS = {'standard': 'standard', 'gregorian': 'standard',
+             'proleptic_gregorian': 'proleptic_gregorian',
+             'noleap': 'noleap', '365_day': 'noleap',
+             'all_leap': 'all_leap', '366_day': 'all_leap',
+             '360_day': '360_day', 'julian': 'julian'}
+
+# Calendars in which the dates are the same as in numpy datetime64.
+REAL_CALENDARS = ['standard', 'proleptic_gregorian']
+
+UNITS = {'seconds': 1, 'second': 1, 'secs': 1, 'sec': 1, 's': 1,
+         'minutes': 60, 'minute': 60, 'mins': 60, 'min': 60,
+         'hours': 3600, 'hour': 3600, 'hrs': 3600, 'hr': 3600, 'h': 3600,
+         'days': 86400, 'day': 86400, 'd': 86400}
+
+_UNITS_PATTERN_ = re.compile(r'^\s*(\w+)\s+since\s+(-?\d+)-(\d+)-(\d+)'
+                             r'(?:[ T]+(\d+):(\d+)(?::(\d+(?:\.\d*)?))?)?')
+
+_MONTH_DAYS_ = {365: [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+                366: [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31],
+                360: [30] * 12}
+
+# Days before each month, for years of 360, 365 and 366 days.
+_DAYS_BEFORE_MONTH_ = dict((n, np.concatenate([[0], np.cumsum(days)]))
+                           for n, days in _MONTH_DAYS_.items())
+
+_FIXED_YEAR_ = {'noleap': 365, 'all_leap': 366, '360_day': 360}
+
+
+def get_calendar_name(calendar):
+    """
+    :param calendar: CF calendar attribute, None for the default calendar
+
+    :return str: canonical calendar name
+    """
+    if calendar is None:
+        return 'standard'
+    name = CALENDARS.get(str(calendar).lower())
+    if name is None:
+        raise Exception('unknown calendar %s' % calendar)
+    return name
+
+
+def parse_units(units):
+    """
+    :param units: CF time units, e.g. 'days since 1950-01-01 00:00:00'
+
+    :return: number of seconds per unit and reference date (year, month, day, hour, minute, second)
+    """
+    match = _UNITS_PATTERN_.match(units)
+    if match is None or match.group(1).lower() not in UNITS:
+        raise Exception('unsupported time units %s' % units)
+    unit, y, m, d, hh, mm, ss = match.groups()
+    return UNITS[unit.lower()], (int(y), int(m), int(d), int(hh or 0), int(mm or 0), float(ss or 0))
+
+
+def _is_leap(year, calendar):
+    if calendar == 'julian':
+        return year % 4 == 0
+    return (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+
+def _days_before_year(year, calendar):
+    y = year - 1
+    if calendar in _FIXED_YEAR_:
+        return _FIXED_YEAR_[calendar] * y
+    if calendar == 'julian':
+        return 365 * y + y // 4
+    return 365 * y + y // 4 - y // 100 + y // 400
+
+
+def date_to_ordinal(date, calendar):
+    """
+    :param date: (year, month, day, hour, minute, second)
+    :param calendar: canonical calendar name
+
+    :return int: seconds since 0001-01-01 00:00:00 in the calendar
+    """
+    year, month, day, hour, minute, second = date
+    if calendar in _FIXED_YEAR_:
+        length = _FIXED_YEAR_[calendar]
+    else:
+        length = 366 if _is_leap(year, calendar) else 365
+    days = _days_before_year(year, calendar) + _DAYS_BEFORE_MONTH_[length][month - 1] + day - 1
+    return int(days) * 86400 + hour * 3600 + minute * 60 + int(round(second))
+
+
+def decode(values, units, calendar=None):
+    """
+    converts time values into ordinals
+
+    :param values: time values
+    :param units: CF time units
+    :param calendar: CF calendar attribute
+
+    :return numpy.array: int64 seconds since 0001-01-01 00:00:00 in the calendar
+    """
+    calendar = get_calendar_name(calendar)
+    factor, reference = parse_units(units)
+    if calendar == 'standard' and reference[:3] < (1582, 10, 15):
+        # the standard calendar switches from julian to gregorian in 1582
+        raise Exception('dates before 1582-10-15 are not supported in the standard calendar')
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.round(values * factor).astype(np.int64)
+    return date_to_ordinal(reference, calendar) + offsets
+
+
+def components(ordinals, calendar=None):
+    """
+    computes the dates of ordinals
+
+    :param ordinals: seconds since 0001-01-01 00:00:00 in the calendar, see decode
+    :param calendar: CF calendar attribute
+
+    :return numpy.array: int array (time, 6) of year, month, day, hour, minute, second
+    """
+    calendar = get_calendar_name(calendar)
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    days, seconds = np.divmod(ordinals, 86400)
+
+    if calendar in REAL_CALENDARS:
+        dates = np.datetime64('0001-01-01', 'D') + days
+        years = dates.astype('M8[Y]')
+        months = dates.astype('M8[M]')
+        year = years.astype(np.int64) + 1970
+        month = (months - years).astype(np.int64) + 1
+        day = (dates - months).astype(np.int64) + 1
+    else:
+        if calendar in _FIXED_YEAR_:
+            length = _FIXED_YEAR_[calendar]
+            year, doy = np.divmod(days, length)
+            year = year + 1
+            leap = np.zeros(days.shape, dtype=bool) if length != 366 else np.ones(days.shape, dtype=bool)
+        else:
+            # julian: cycles of four years, the last one being a leap year
+            cycle, rest = np.divmod(days, 1461)
+            index = np.minimum(rest // 365, 3)
+            year = 4 * cycle + index + 1
+            doy = rest - 365 * index
+            leap = index == 3
+            length = None
+        month = np.empty(days.shape, dtype=np.int64)
+        day = np.empty(days.shape, dtype=np.int64)
+        for is_leap in [False, True]:
+            select = leap == is_leap
+            n = length if length is not None else (366 if is_leap else 365)
+            table = _DAYS_BEFORE_MONTH_[n]
+            m = np.searchsorted(table, doy[select], side='right')
+            month[select] = m
+            day[select] = doy[select] - table[m - 1] + 1
+
+    hour, rest = np.divmod(seconds, 3600)
+    minute, second = np.divmod(rest, 60)
+    return np.column_stack([year, month, day, hour, minute, second]).astype(np.int64)
+
+
+def to_datetime64(ordinals, calendar=None):
+    """
+    :param ordinals: seconds since 0001-01-01 00:00:00 in the calendar, see decode
+    :param calendar: CF calendar attribute, standard or proleptic_gregorian
+
+    :return numpy.array: datetime64[s]
+    """
+    if get_calendar_name(calendar) not in REAL_CALENDARS:
+        raise Exception('calendar %s dates can not be represented as datetime64' % calendar)
+    return np.datetime64('0001-01-01T00:00:00', 's') + np.asarray(ordinals, dtype=np.int64)
@@ -0,0 +1,271 @@
+"""
+Catalog of the netCDF file headers.
+
+The header of each file (dimensions, variables and their attributes, global
+attributes, time axis summary and grid fingerprint) is read once and stored
+in a SQLite database in the cache directory. Entries are keyed by the file
+path, size and modification time, so that a modified file is read again.
+The helpers of flyingpigeon.utils and flyingpigeon.metadata looking up
+metadata use the catalog instead of opening the files.
+"""
+
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+import six
+from netCDF4 import Dataset
+
+from flyingpigeon import config
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# Number of time steps used to estimate the time step.
+TIME_STEP_SAMPLE = 100
+
+# Maximum number of headers kept in memory.
+HEADERS_SIZE = 1000
+
+# Headers read in this process, by (path, size, mtime), the least recently used first.
+_HEADERS_ = OrderedDict()
+
+
+def _database():
+    return os.path.join(config.cache_path(), 'catalog.sqlite')
+
+
+def _connect():
+    filename = _database()
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            if not os.path.isdir(dirname):
+                raise
+    conn = sqlite3.connect(filename, timeout=60)
+    conn.execute('CREATE TABLE IF NOT EXISTS headers '
+                 '(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, header TEXT)')
+    return conn
+
+
+def _to_json(value):
+    """converts netCDF attribute values to JSON serializable values"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _from_json(value):
+    """converts the unicode strings of a header loaded from JSON to str on python 2"""
+    if isinstance(value, dict):
+        return dict((_from_json(k), _from_json(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_from_json(v) for v in value]
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def _attributes(obj):
+    return dict((name, _to_json(obj.getncattr(name))) for name in obj.ncattrs())
+
+
+def _date(date):
+    return [date.year, date.month, date.day, date.hour, date.minute, date.second]
+
+
+def _time_variable(ds):
+    """name of the time coordinate, found from the CF axis and standard_name attributes if not named time"""
+    if 'time' in ds.variables:
+        return 'time'
+    for name, var in ds.variables.items():
+        if var.ndim == 1 and (getattr(var, 'axis', None) == 'T' or
+                              getattr(var, 'standard_name', None) == 'time'):
+            return name
+    if 'time_counter' in ds.variables:
+        return 'time_counter'
+    return None
+
+
+def _read_time(ds):
+    """summary of the time axis"""
+    from netCDF4 import num2date
+
+    name = _time_variable(ds)
+    if name is None:
+        return None
+    time = ds.variables[name]
+    units = getattr(time, 'units', None)
+    calendar = getattr(time, 'calendar', None)
+    summary = dict(name=name, units=units, calendar=calendar, size=len(time),
+                   start=None, end=None, step=None)
+    if units is None or len(time) == 0:
+        return summary
+
+    cal = calendar if calendar is not None else 'standard'
+    s, e = num2date([time[0], time[-1]], units, cal)
+    summary['start'] = _date(s)
+    summary['end'] = _date(e)
+    if len(time) > 1:
+        dates = num2date(time[:TIME_STEP_SAMPLE], units, cal)
+        diffs = [(b - a).total_seconds() / 86400. for a, b in zip(dates[:-1], dates[1:])]
+        summary['step'] = sum(diffs) / len(diffs)
+    return summary
+
+
+def detect_variable(ds):
+    """
+    detects the data variable of a netCDF file from its header, skipping the coordinate,
+    bounds and grid mapping variables and preferring the variables with a time dimension
+
+    :param ds: netCDF4 Dataset
+
+    :return str: variable name, tuple of names if several data variables are found
+    """
+    from flyingpigeon.masks import _is_coordinate
+
+    skip = set(ds.dimensions)
+    for var in ds.variables.values():
+        for attr in ['bounds', 'climatology', 'grid_mapping']:
+            skip.add(getattr(var, attr, None))
+        skip.update(getattr(var, 'coordinates', '').split())
+
+    candidates = [name for name, var in ds.variables.items()
+                  if name not in skip and var.ndim > 0 and
+                  not _is_coordinate(var, 'lat') and not _is_coordinate(var, 'lon')]
+    with_time = [name for name in candidates
+                 if any(d in ['time', 'time_counter'] or ds.dimensions[d].isunlimited()
+                        for d in ds.variables[name].dimensions)]
+    if with_time:
+        candidates = with_time
+
+    if len(candidates) == 0:
+        raise Exception('no data variable found')
+    if len(candidates) == 1:
+        return candidates[0]
+    return tuple(candidates)
+
+
+def read_header(resource):
+    """
+    reads the header of a netCDF file
+
+    :param resource: netCDF file
+
+    :return dict: dimensions, variables, attributes, data variable, time axis summary and grid fingerprint
+    """
+    from flyingpigeon.masks import get_grid, grid_fingerprint
+
+    with Dataset(resource) as ds:
+        header = dict(
+            path=resource,
+            data_model=ds.data_model,
+            attributes=_attributes(ds),
+            dimensions=dict((name, [len(dim), dim.isunlimited()]) for name, dim in ds.dimensions.items()),
+            variables=dict((name, dict(dimensions=list(var.dimensions), dtype=str(var.dtype),
+                                       attributes=_attributes(var)))
+                           for name, var in ds.variables.items()),
+        )
+        try:
+            header['time'] = _read_time(ds)
+        except Exception:
+            LOGGER.exception('failed to read the time axis of %s' % resource)
+            header['time'] = None
+
+        try:
+            header['variable'] = detect_variable(ds)
+        except Exception:
+            LOGGER.exception('failed to detect the variable of %s' % resource)
+            header['variable'] = None
+
+        header['grid'] = None
+        if isinstance(header['variable'], six.string_types):
+            try:
+                lats, lons, _ = get_grid(ds, header['variable'])
+                header['grid'] = grid_fingerprint(lats, lons)
+            except Exception:
+                LOGGER.debug('no grid fingerprint for %s' % resource)
+    return header
+
+
+def get_headers(resource):
+    """
+    returns the headers of netCDF files, read from the files only if not found in the catalog
+
+    :param resource: netCDF file or list of files
+
+    :return list: headers, see read_header
+    """
+    if type(resource) != list:
+        resource = [resource]
+
+    keys = []
+    for nc in resource:
+        try:
+            stat = os.stat(nc)
+            keys.append((os.path.abspath(nc), stat.st_size, stat.st_mtime))
+        except OSError:
+            # remote dataset, kept in memory only
+            keys.append((nc, None, None))
+
+    headers = {}
+    for key in keys:
+        if key in _HEADERS_:
+            headers[key] = _HEADERS_.pop(key)
+            _HEADERS_[key] = headers[key]
+
+    missing = [key for key in keys if key not in headers]
+    local = [key for key in missing if key[1] is not None]
+    conn = None
+    if local:
+        try:
+            conn = _connect()
+            for key in local:
+                row = conn.execute('SELECT header FROM headers WHERE path=? AND size=? AND mtime=?',
+                                   key).fetchone()
+                if row is not None:
+                    headers[key] = _from_json(json.loads(row[0]))
+        except Exception:
+            LOGGER.exception('failed to read the catalog')
+            conn = None
+
+    new = []
+    for key in missing:
+        if key not in headers:
+            LOGGER.debug('read header of %s' % key[0])
+            headers[key] = read_header(key[0])
+            if key[1] is not None:
+                new.append(key)
+
+    if conn is not None:
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?)',
+                                 [key + (json.dumps(headers[key]),) for key in new])
+        except Exception:
+            LOGGER.exception('failed to update the catalog')
+        finally:
+            conn.close()
+
+    for key in missing:
+        _HEADERS_[key] = headers[key]
+    while len(_HEADERS_) > HEADERS_SIZE:
+        _HEADERS_.popitem(last=False)
+
+    return [headers[key] for key in keys]
+
+
+def get_header(resource):
+    """
+    returns the header of a netCDF file, see get_headers
+
+    :param resource: netCDF file
+
+    :return dict: header
+    """
+    return get_headers([resource])[0]
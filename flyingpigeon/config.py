@@ -1,5 +1,6 @@
 import os
 import tempfile
+import multiprocessing
 from pywps import configuration
 
 _PATH = os.path.abspath(os.path.dirname(__file__))
@@ -17,6 +18,17 @@ def cache_path():
     return cache_path
 
 
+def cache_max_size():
+    size = configuration.get_config_value("extra", "cache_max_size")
+    if not size:
+        LOGGER.warn("No cache_max_size configured. Using default value.")
+        size = 10240
+    size = int(size)
+    if size <= 0:
+        return None
+    return size * 2 ** 20
+
+
 def data_path():
     return os.path.join(_PATH, 'data')
 
@@ -37,6 +49,14 @@ def esgfsearch_url():
     return url
 
 
+def max_workers():
+    workers = configuration.get_config_value("extra", "max_workers")
+    if not workers:
+        LOGGER.warn("No max_workers configured. Using the number of CPUs.")
+        workers = multiprocessing.cpu_count()
+    return int(workers)
+
+
 def masks_path():
     # TODO: currently this folder is not used
     return os.path.join(data_path(), 'masks')
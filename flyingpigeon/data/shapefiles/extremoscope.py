@@ -8,9 +8,8 @@ def regionalize(infile, basedir, variable, aggregate, scenario):
     :param scenario: scenario name (e.g 'rcp45')"""
 
     from flyingpigeon import subset
-    from flyingpigeon.subset import _POLYGONS_EXTREMOSCOPE_
 
-    for polygon in _POLYGONS_EXTREMOSCOPE_:
+    for polygon in subset.regions_europe():
         region = polygon.replace('.', '-')
         prefix = os.basename(infile).replace('EUR', region)
         dir_output = os.path.join(basedir, 'polygons', variable, aggregate, scenario, region)
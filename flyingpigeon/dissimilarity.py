@@ -18,6 +18,7 @@ Methods available
  * Standardized Euclidean distance
  * Nearest Neighbour distance
  * Zech-Aslan energy statistic
+ * Szekely-Rizzo energy statistic
  * Friedman-Rafsky runs statistic
  * Kolmogorov-Smirnov statistic
  * Kullback-Leibler divergence
@@ -27,15 +28,29 @@ Methods available
 :institution: Ouranos inc.
 """
 
-# TODO: Szekely, G, Rizzo, M (2014) Energy statistics: A class of statistics
-# based on distances. J Stat Planning & Inference 143: 1249-1272
-
 # TODO: Hellinger distance
 
 __all__ = ['seuclidean', 'nearest_neighbor', 'zech_aslan',
-           'kolmogorov_smirnov', 'friedman_rafsky',
+           'szekely_rizzo', 'kolmogorov_smirnov', 'friedman_rafsky',
            'kldiv']
 
+# Number of grid cells processed at once by `dissimilarity_map`.
+BLOCK_SIZE = 4096
+
+# Initial number of neighbours used to build minimum spanning trees.
+MST_NEIGHBORS = 10
+
+# Number of points per block when computing quantities over all pairs of
+# points.
+PAIR_BLOCK_SIZE = 1024
+
+# Number of cells evaluated with the full metric per cell kept by
+# `top_k_cells`.
+TOP_K_SCREEN = 4
+
+# Size in bytes above which candidate cubes are memory-mapped.
+MEMMAP_SIZE = 2 ** 30
+
 
 # ---------------------------------------------------------------------------- #
 # -------------------------- Utility functions ------------------------------- #
@@ -100,6 +115,194 @@ def standardize(x, y):
     return x / s, y / s
 
 
+def distance_sums(a, b=None, v=None, block_size=PAIR_BLOCK_SIZE):
+    """
+    Sum the standardized Euclidean distances, and their logarithm, between
+    pairs of points.
+
+    The distances are computed over blocks of points, so that memory use
+    does not depend on the sample size.
+
+    Parameters
+    ----------
+    a : ndarray (n,d)
+        First sample.
+    b : ndarray (m,d), optional
+        Second sample. If None, the sums are over the pairs of distinct
+        points of `a`, each pair being counted once.
+    v : ndarray (d,)
+        Variance used to standardize each dimension.
+    block_size : int
+        Number of points per block.
+
+    Returns
+    -------
+    float, float
+        Sum of the log-distances and sum of the distances.
+    """
+    if v is not None:
+        v = np.asarray(v, np.float64)
+
+    slog = s = 0.
+    for i in range(0, len(a), block_size):
+        ai = a[i:i + block_size]
+        if b is None:
+            blocks = [spatial.distance.pdist(ai, 'seuclidean', V=v)]
+            blocks += [spatial.distance.cdist(ai, a[j:j + block_size],
+                                              'seuclidean', V=v)
+                       for j in range(i + block_size, len(a), block_size)]
+        else:
+            blocks = (spatial.distance.cdist(ai, b[j:j + block_size],
+                                             'seuclidean', V=v)
+                      for j in range(0, len(b), block_size))
+        for dist in blocks:
+            slog += np.log(dist).sum()
+            s += dist.sum()
+
+    return slog, s
+
+
+def _cached(func):
+    """Turn a `Reference` method into a property computed on first access."""
+    name = func.__name__
+
+    def wrapper(self):
+        if name not in self._cache:
+            self._cache[name] = func(self)
+        return self._cache[name]
+
+    wrapper.__doc__ = func.__doc__
+    return property(wrapper)
+
+
+class Reference(object):
+    """
+    Reference sample along with the quantities the dissimilarity metrics
+    derive from it alone.
+
+    These quantities are computed on first use and cached, so that when the
+    same reference sample is compared with many candidate samples, only the
+    candidate side is computed for each comparison.
+
+    Parameters
+    ----------
+    x : ndarray (n,d)
+        Reference sample.
+    """
+
+    def __init__(self, x):
+        x = np.atleast_2d(x)
+        if x.shape[0] == 1:
+            x = x.T
+
+        self.x = x
+        self.n, self.d = x.shape
+        self._cache = {}
+
+    @_cached
+    def mean(self):
+        """Mean of the reference sample."""
+        return self.x.mean(0)
+
+    @_cached
+    def var(self):
+        """Unbiased variance of the reference sample."""
+        return self.x.var(0, ddof=1)
+
+    @_cached
+    def std(self):
+        """Unbiased standard deviation of the reference sample."""
+        return self.x.std(0, ddof=1)
+
+    @_cached
+    def tree(self):
+        """KD tree of the reference sample."""
+        return KDTree(self.x)
+
+    @_cached
+    def sqdiff(self):
+        """Squared differences along each dimension between every pair of
+        points of the reference sample, in `pdist` order."""
+        i, j = np.triu_indices(self.n, 1)
+        return (self.x[i] - self.x[j]) ** 2
+
+    @_cached
+    def quadrants(self):
+        """Fraction of the reference sample in each quadrant around each of
+        its points."""
+        return _quadrant_fractions(self.x, self.x)
+
+    def knn(self, k):
+        """Distances from each point of the reference sample to its k
+        nearest neighbours in the sample, the first one being itself."""
+        key = ('knn', k)
+        if key not in self._cache:
+            self._cache[key], _ = self.tree.query(self.x, k=k, eps=0, p=2,
+                                                  n_jobs=2)
+        return self._cache[key]
+
+
+class PreparedMetric(object):
+    """
+    Dissimilarity metric bound to a reference sample.
+
+    Calling the instance with a candidate sample `y` returns the same value
+    as ``dist(x, y)``, but the quantities depending on the reference sample
+    only are computed once for all candidates.
+
+    Parameters
+    ----------
+    dist : {'seuclidean', 'nearest_neighbor', 'zech_aslan',
+       'szekely_rizzo', 'kolmogorov_smirnov', 'friedman_rafsky', 'kldiv'}
+        Name of the dissimilarity metric.
+    x : ndarray (n,d)
+        Reference sample.
+    kwds : dict
+        Additional arguments passed to the metric, e.g. `k` for `kldiv`.
+    """
+
+    def __init__(self, dist, x, **kwds):
+        if dist not in __all__:
+            raise ValueError("{} is not a dissimilarity metric.".format(dist))
+
+        self.dist = dist
+        self.ref = Reference(x)
+        self.kwds = kwds
+        self._func = globals()['_' + dist]
+
+    def __call__(self, y):
+        _, y = reshape_sample(self.ref.x, y)
+        return self._func(self.ref, y, **self.kwds)
+
+
+def prepare(dist, x, **kwds):
+    """
+    Prepare the comparison of a reference sample with many candidate samples.
+
+    Parameters
+    ----------
+    dist : {'seuclidean', 'nearest_neighbor', 'zech_aslan',
+       'szekely_rizzo', 'kolmogorov_smirnov', 'friedman_rafsky', 'kldiv'}
+        Name of the dissimilarity metric.
+    x : ndarray (n,d)
+        Reference sample.
+    kwds : dict
+        Additional arguments passed to the metric, e.g. `k` for `kldiv`.
+
+    Returns
+    -------
+    PreparedMetric
+        Callable taking a candidate sample and returning its dissimilarity
+        with the reference sample.
+
+    Examples
+    --------
+    >>> metric = prepare('kldiv', x)
+    >>> values = [metric(y) for y in candidates]
+    """
+    return PreparedMetric(dist, x, **kwds)
+
+
 # ---------------------------------------------------------------------------- #
 # ------------------------ Dissimilarity metrics ----------------------------- #
 # ---------------------------------------------------------------------------- #
@@ -134,27 +337,13 @@ def seuclidean(x, y):
     DOI 10.1007/s10584-011-0261-z.
     """
     x, y = reshape_sample(x, y)
+    return _seuclidean(Reference(x), y)
 
-    mx = x.mean(0)
-    my = y.mean(0)
 
-    return spatial.distance.seuclidean(mx, my, x.var(0, ddof=1))
-
-
-"""
-I'm wondering if there is value in writing a generator version of these
-functions, such as the example below, to optimize computations in the case
-multiple candidate samples are compared to the same reference sample.
-
-def seuclidean_gen(x, y):
-    mx = x.mean(0)
-
-    for vec in y:
-        my = vec.mean(0)
-        yield spatial.distance.seuclidean(mx, my, x.var(0, ddof=1))
+def _seuclidean(ref, y):
+    my = y.mean(0)
 
-seuclidean_gen.__doc__ = seuclidean.__doc__
-"""
+    return spatial.distance.seuclidean(ref.mean, my, ref.var)
 
 
 def nearest_neighbor(x, y):
@@ -180,7 +369,12 @@ def nearest_neighbor(x, y):
     nearest neighbor type coincidences. Ann. of Stat., Vol. 16, No.2, 772-783.
     """
     x, y = reshape_sample(x, y)
-    x, y = standardize(x, y)
+    return _nearest_neighbor(Reference(x), y)
+
+
+def _nearest_neighbor(ref, y):
+    s = np.sqrt(ref.std * y.std(0, ddof=1))
+    x, y = ref.x / s, y / s
 
     nx, dx = x.shape
 
@@ -221,25 +415,35 @@ def zech_aslan(x, y):
     """
 
     x, y = reshape_sample(x, y)
+    return _zech_aslan(Reference(x), y)
+
+
+def _zech_aslan(ref, y):
+    x = ref.x
     nx, d = x.shape
     ny, d = y.shape
 
-    v = x.std(0, ddof=1) * y.std(0, ddof=1)
+    v = ref.std * y.std(0, ddof=1)
 
-    dx = spatial.distance.pdist(x, 'seuclidean', V=v)
-    dy = spatial.distance.pdist(y, 'seuclidean', V=v)
-    dxy = spatial.distance.cdist(x, y, 'seuclidean', V=v)
+    # The pairwise differences of the reference sample are cached when they
+    # fit in a block.
+    if nx * (nx - 1) / 2 * d <= PAIR_BLOCK_SIZE ** 2:
+        lx = np.log(np.sqrt(ref.sqdiff.dot(1. / v))).sum()
+    else:
+        lx, _ = distance_sums(x, v=v)
+    ly, _ = distance_sums(y, v=v)
+    lxy, _ = distance_sums(x, y, v=v)
 
-    phix = -np.log(dx).sum() / nx / (nx - 1)
-    phiy = -np.log(dy).sum() / ny / (ny - 1)
-    phixy = np.log(dxy).sum() / nx / ny
+    phix = -lx / nx / (nx - 1)
+    phiy = -ly / ny / (ny - 1)
+    phixy = lxy / nx / ny
     return phix + phiy + phixy
 
 
-def skezely_rizzo(x, y):
-    """
-    Compute the Skezely-Rizzo energy distance dissimimilarity metric
-    based on an analogy with the energy of a cloud of electrical charges.
+def szekely_rizzo(x, y):
+    r"""
+    Compute the Szekely-Rizzo energy distance dissimilarity metric based on
+    the distances between and within the samples.
 
     Parameters
     ----------
@@ -251,33 +455,41 @@ def skezely_rizzo(x, y):
     Returns
     -------
     float
-        Skezely-Rizzo dissimilarity metric ranging from -infinity to infinity.
+        Szekely-Rizzo dissimilarity metric ranging from 0 to infinity.
+
+    Notes
+    -----
+    The statistic is computed from the standardized Euclidean distances
+
+    .. math
+        T = \frac{nm}{n+m} \left( \frac{2}{nm} \sum_{i,j} |x_i - y_j| -
+        \frac{1}{n^2} \sum_{i,j} |x_i - x_j| -
+        \frac{1}{m^2} \sum_{i,j} |y_i - y_j| \right)
 
     References
     ----------
-    TODO
+    Szekely, G. J. and Rizzo, M. L. (2013) Energy statistics: A class of
+    statistics based on distances. J. Stat. Planning & Inference 143,
+    1249-1272.
     """
-    raise NotImplementedError
-
     x, y = reshape_sample(x, y)
-    nx, d = x.shape
-    ny, d = y.shape
+    return _szekely_rizzo(Reference(x), y)
 
-    v = x.std(0, ddof=1) * y.std(0, ddof=1)
 
-    dx = spatial.distance.pdist(x, 'seuclidean', V=v)
-    dy = spatial.distance.pdist(y, 'seuclidean', V=v)
-    dxy = spatial.distance.cdist(x, y, 'seuclidean', V=v)
+def _szekely_rizzo(ref, y):
+    x = ref.x
+    nx, d = x.shape
+    ny, d = y.shape
 
-    phix = -np.log(dx).sum() / nx / (nx - 1)
-    phiy = -np.log(dy).sum() / ny / (ny - 1)
-    phixy = np.log(dxy).sum() / nx / ny
+    v = ref.std * y.std(0, ddof=1)
 
-    # z = dxy.sum() * 2. / (nx*ny) - (1./nx**2) *
+    # Each pair within a sample is counted once.
+    _, sx = distance_sums(x, v=v)
+    _, sy = distance_sums(y, v=v)
+    _, sxy = distance_sums(x, y, v=v)
 
-    # z = (2 / (n * m)) * sum(dxy(:)) - (1 / (n ^ 2)) * sum(2 * dx) - (1 /
-    #  (m ^ 2)) * sum(2 * dy);
-    # z = ((n * m) / (n + m)) * z;
+    z = 2. * sxy / (nx * ny) - 2. * sx / nx ** 2 - 2. * sy / ny ** 2
+    return z * nx * ny / (nx + ny)
 
 
 def friedman_rafsky(x, y):
@@ -306,20 +518,20 @@ def friedman_rafsky(x, y):
     Wald-Wolfowitz and Smirnov two-sample tests. Annals of Stat. Vol.7,
     No. 4, 697-717.
     """
-    from sklearn import neighbors
-    from scipy.sparse.csgraph import minimum_spanning_tree
-
     x, y = reshape_sample(x, y)
+    return _friedman_rafsky(Reference(x), y)
+
+
+def _friedman_rafsky(ref, y):
+    x = ref.x
     nx, d = x.shape
     ny, d = y.shape
     n = nx + ny
 
     xy = np.vstack([x, y])
 
-    # Compute the NNs and the minimum spanning tree
-    g = neighbors.kneighbors_graph(xy, n_neighbors=n - 1, mode='distance')
-    mst = minimum_spanning_tree(g, overwrite=True)
-    edges = np.array(mst.nonzero()).T
+    # Compute the minimum spanning tree
+    edges = minimum_spanning_tree_edges(xy)
 
     # Number of points whose neighbor is from the other sample
     diff = np.logical_xor(*(edges < nx).T).sum()
@@ -327,6 +539,129 @@ def friedman_rafsky(x, y):
     return 1. - (1. + diff) / n
 
 
+def _dense_mst_edges(xy):
+    """Return the edges of the minimum spanning tree of the complete graph."""
+    from sklearn import neighbors
+    from scipy.sparse.csgraph import minimum_spanning_tree
+
+    n = len(xy)
+    g = neighbors.kneighbors_graph(xy, n_neighbors=n - 1, mode='distance')
+    mst = minimum_spanning_tree(g, overwrite=True)
+    return np.array(mst.nonzero()).T
+
+
+def _knn_mst_edges(xy, k):
+    """
+    Return the edges of the minimum spanning tree of the k-nearest neighbour
+    graph, or None if it cannot be shown to be the minimum spanning tree of
+    the complete graph.
+
+    With duplicated points or equal distances, the minimum spanning tree is
+    not unique, and the one of the complete graph depends on the order in
+    which its edges are visited. The tree of the complete graph is then
+    returned, so that the statistics do not depend on the graph used.
+
+    The tree is built by Kruskal's algorithm. An edge joining components A and
+    B is also the shortest edge leaving A in the complete graph if it is not
+    longer than the distance from any point of A to its kth neighbour, since
+    the edges missing from the graph are at least that long. The same holds
+    for B. If this is verified for every edge, the tree is the minimum
+    spanning tree of the complete graph.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import minimum_spanning_tree
+
+    n = len(xy)
+    dist, ind = KDTree(xy).query(xy, k=k + 1, eps=0, p=2, n_jobs=2)
+    row = np.repeat(np.arange(n), k + 1).reshape(n, k + 1)
+
+    # Distance to the kth neighbour, the first neighbour being the point itself.
+    rk = dist[:, -1]
+
+    # Drop the self-loops. With duplicated points, the point itself is not
+    # necessarily the first neighbour.
+    edge = ind != row
+
+    # Distances of the distinct pairs of points, to look for ties.
+    _, first = np.unique(np.minimum(row[edge], ind[edge]) * n +
+                         np.maximum(row[edge], ind[edge]),
+                         return_index=True)
+    d = dist[edge][first]
+    if (d == 0).any() or len(np.unique(d)) < len(d):
+        return _dense_mst_edges(xy)
+
+    g = coo_matrix((dist[edge], (row[edge], ind[edge])), shape=(n, n)).tocsr()
+
+    mst = minimum_spanning_tree(g, overwrite=True).tocoo()
+
+    # Replay Kruskal's algorithm over the tree edges, tracking the smallest
+    # kth neighbour distance of each component.
+    parent = np.arange(n)
+    bound = rk.copy()
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[j] = i
+        bound[i] = min(bound[i], bound[j])
+
+    order = np.argsort(mst.data, kind='mergesort')
+    for w, i, j in zip(mst.data[order], mst.row[order], mst.col[order]):
+        i, j = find(i), find(j)
+        if w > bound[i] and w > bound[j]:
+            return None
+        union(i, j)
+
+    # The graph is disconnected.
+    if len(set(find(i) for i in range(n))) > 1:
+        return None
+
+    return np.array([mst.row, mst.col]).T
+
+
+def minimum_spanning_tree_edges(xy, k=MST_NEIGHBORS):
+    """
+    Compute the Euclidean minimum spanning tree of a sample.
+
+    The tree is built from the sparse graph linking each point to its `k`
+    nearest neighbours. The number of neighbours is doubled until the tree of
+    this sparse graph is provably the minimum spanning tree of the complete
+    graph, and the complete graph is only used when `k` reaches the sample
+    size.
+
+    Parameters
+    ----------
+    xy : ndarray (n,d)
+        Sample.
+    k : int
+        Initial number of neighbours.
+
+    Returns
+    -------
+    ndarray (e,2)
+        Indices of the points linked by each edge of the tree. As for the
+        complete graph, the edges between duplicated points are not included.
+
+    Notes
+    -----
+    When some distances are equal, e.g. with duplicated points, the minimum
+    spanning tree is not unique and the complete graph is used, so that the
+    tree is the same as with `k` equal to the sample size.
+    """
+    n = len(xy)
+    while k < n - 1:
+        edges = _knn_mst_edges(xy, k)
+        if edges is not None:
+            return edges
+        k *= 2
+
+    return _dense_mst_edges(xy)
+
+
 def kolmogorov_smirnov(x, y):
     """
     Compute the Kolmogorov-Smirnov statistic applied to two multivariate
@@ -351,31 +686,160 @@ def kolmogorov_smirnov(x, y):
     Astronomical Society, vol. 225, pp. 155-170.
     """
     x, y = reshape_sample(x, y)
+    return _kolmogorov_smirnov(Reference(x), y)
+
+
+def _count_dominating(s, p, gs, gp):
+    """
+    Count, for each point of `p`, the points of `s` belonging to the same
+    group that are larger or equal along every dimension.
+
+    The points are sorted along the first dimension and split recursively in
+    halves, so that the points of `s` in the first half of a block dominate
+    the points of `p` in the second half along the first dimension. Counting
+    among those pairs is the same problem with one dimension less. The cost
+    is O(n log(n)**d).
+
+    Parameters
+    ----------
+    s : ndarray (ns,d)
+        Points to count.
+    p : ndarray (np,d)
+        Query points.
+    gs, gp : ndarray (ns,), (np,)
+        Integer group of each point.
+
+    Returns
+    -------
+    ndarray (np,)
+        Number of dominating points.
+    """
+    ns, d = s.shape
+    n = ns + len(p)
+
+    if len(p) == 0 or ns == 0:
+        return np.zeros(len(p), int)
+
+    if d == 0:
+        return np.bincount(gs, minlength=gp.max() + 1)[gp]
+
+    # Rank the values along the first dimension. Equal values get the same
+    # rank.
+    _, rank = np.unique(np.concatenate([s[:, 0], p[:, 0]]),
+                        return_inverse=True)
+    rank_s, rank_p = rank[:ns], rank[ns:]
+
+    if d == 1:
+        k = rank.max() + 2
+        key = np.sort(gs * k + rank_s)
+        return np.searchsorted(key, gp * k + k - 1, 'right') - \
+            np.searchsorted(key, gp * k + rank_p, 'left')
+
+    # Sort by group, then by decreasing value, with the points of `s` coming
+    # before the query points for equal values.
+    g = np.concatenate([gs, gp])
+    is_p = np.arange(n) >= ns
+    order = np.lexsort((is_p, -rank, g))
+    g = g[order]
+    pos = np.arange(n) - np.searchsorted(g, g, 'left')
+    inv = np.empty(n, int)
+    inv[order] = np.arange(n)
+    pos_s, pos_p = pos[inv[:ns]], pos[inv[ns:]]
+
+    count = np.zeros(len(p), int)
+    level = 0
+    while (1 << level) < pos.max() + 1:
+        ls = (pos_s >> level) & 1 == 0
+        lp = (pos_p >> level) & 1 == 1
+
+        # Groups of the sub-problem: one per group and block.
+        _, sub = np.unique(np.concatenate([gs[ls] * n + (pos_s[ls] >> (level + 1)),
+                                           gp[lp] * n + (pos_p[lp] >> (level + 1))]),
+                           return_inverse=True)
+        count[lp] += _count_dominating(s[ls, 1:], p[lp, 1:],
+                                       sub[:ls.sum()], sub[ls.sum():])
+        level += 1
+
+    return count
+
+
+def _quadrant_fractions(p, s):
+    """
+    Return the fraction of the sample `s` in each of the 2**d quadrants
+    centered on each point of `p`, as an array of shape (2**d, len(p)).
+
+    The quadrant of s[i] with respect to p[j] is identified by the integer
+    whose bit k is set if p[j,k] <= s[i,k].
+    """
+    ns, d = s.shape
+    l = 2 ** d
+
+    if d > 3:
+        return _quadrant_fractions_blocks(p, s)
+
+    # Number of points of s larger or equal to each point of p along each
+    # subset of the dimensions, the subset being identified as a quadrant.
+    gs, gp = np.zeros(ns, int), np.zeros(len(p), int)
+    dominating = np.empty((l, len(p)))
+    for q in range(l):
+        dims = [k for k in range(d) if q >> k & 1]
+        dominating[q] = _count_dominating(s[:, dims], p[:, dims], gs, gp)
+
+    # Number of points in each quadrant by inclusion-exclusion.
+    count = np.zeros((l, len(p)))
+    for q in range(l):
+        for r in range(l):
+            if r & q == q:
+                sign = (-1) ** bin(r ^ q).count('1')
+                count[q] += sign * dominating[r]
+
+    return 1. * count / ns
+
+
+def _quadrant_fractions_blocks(p, s):
+    """
+    Same as `_quadrant_fractions`, comparing blocks of points of `p` with all
+    the points of `s`. The memory used is bounded, but the cost is
+    O(len(p) * len(s)).
+    """
+    ns, d = s.shape
+    l = 2 ** d
 
-    def pivot(x, y):
-        nx, d = x.shape
-        ny, d = y.shape
+    # Multiplicating factor converting d-dim booleans to a unique integer.
+    mf = 2 ** np.arange(d)
 
-        # Multiplicating factor converting d-dim booleans to a unique integer.
-        mf = (2 ** np.arange(d)).reshape(1, d, 1)
-        l = 2 ** d
+    count = np.empty((l, len(p)))
+    b = max(1, PAIR_BLOCK_SIZE ** 2 // (ns * d))
+    for i in range(0, len(p), b):
+        pb = p[i:i + b]
+        nb = len(pb)
 
-        # Assign a unique integer according on whether or not x[i] <= sample
-        ix = ((x.T <= np.atleast_3d(x)) * mf).sum(1)
-        iy = ((x.T <= np.atleast_3d(y)) * mf).sum(1)
+        # Assign a unique integer according on whether or not p[j] <= s[i]
+        code = ((pb[:, np.newaxis] <= s) * mf).sum(-1)
 
         # Count the number of samples in each quadrant
-        cx = 1. * np.apply_along_axis(np.bincount, 0, ix, minlength=l) / nx
-        cy = 1. * np.apply_along_axis(np.bincount, 0, iy, minlength=l) / ny
+        code += l * np.arange(nb)[:, np.newaxis]
+        count[:, i:i + nb] = np.bincount(code.ravel(),
+                                         minlength=l * nb).reshape(nb, l).T
 
-        # This is from https://github.com/syrte/ndtest/blob/master/ndtest.py
-        # D = cx - cy
-        # D[0,:] -= 1. / nx # I don't understand this...
-        # dmin, dmax = -D.min(), D.max() + .1 / nx
+    return 1. * count / ns
 
-        return np.max(np.abs(cx - cy))
 
-    return max(pivot(x, y), pivot(y, x))
+def _kolmogorov_smirnov(ref, y):
+    x = ref.x
+
+    # Pivot on the points of each sample and compare the fraction of both
+    # samples in each quadrant.
+
+    # This is from https://github.com/syrte/ndtest/blob/master/ndtest.py
+    # D = cx - cy
+    # D[0,:] -= 1. / nx # I don't understand this...
+    # dmin, dmax = -D.min(), D.max() + .1 / nx
+
+    dx = np.max(np.abs(ref.quadrants - _quadrant_fractions(x, y)))
+    dy = np.max(np.abs(_quadrant_fractions(y, y) - _quadrant_fractions(y, x)))
+
+    return max(dx, dy)
 
 
 def kldiv(x, y, k=1):
@@ -434,11 +898,15 @@ def kldiv(x, y, k=1):
     Fernando Pérez-Cruz.
     """
 
+    x, y = reshape_sample(x, y)
+    return _kldiv(Reference(x), y, k)
+
+
+def _kldiv(ref, y, k=1):
     mk = np.iterable(k)
     ka = np.atleast_1d(k)
 
-    x, y = reshape_sample(x, y)
-
+    x = ref.x
     nx, d = x.shape
     ny, d = y.shape
 
@@ -449,14 +917,13 @@ def kldiv(x, y, k=1):
     if nx < 5 or ny < 5:
         return np.nan
 
-    # Build a KD tree representation of the samples.
-    xtree = KDTree(x)
+    # Build a KD tree representation of the candidate sample.
     ytree = KDTree(y)
 
     # Get the k'th nearest neighbour from each points in x for both x and y.
     # We get the values for K + 1 to make sure the output is a 2D array.
     kmax = max(ka) + 1
-    r, indx = xtree.query(x, k=kmax, eps=0, p=2, n_jobs=2)
+    r = ref.knn(kmax)
     s, indy = ytree.query(x, k=kmax, eps=0, p=2, n_jobs=2)
 
     # There is a mistake in the paper. In Eq. 14, the right side misses a
@@ -474,3 +941,411 @@ def kldiv(x, y, k=1):
         return out
     else:
         return out[0]
+
+
+# ---------------------------------------------------------------------------- #
+# ------------------------ Whole-grid computation ---------------------------- #
+# ---------------------------------------------------------------------------- #
+
+def _seuclidean_block(ref, y, valid):
+    """
+    Vectorized version of `seuclidean` over a block of candidate cells.
+
+    Parameters
+    ----------
+    ref : Reference
+        Reference sample.
+    y : ndarray (b,m,d)
+        Candidate samples for `b` grid cells.
+    valid : ndarray (b,m)
+        True where every dimension of the candidate sample is valid.
+
+    Returns
+    -------
+    ndarray (b,)
+        Standardized Euclidean distance for each cell.
+    """
+    n = valid.sum(1)[:, np.newaxis]
+    my = np.where(valid[..., np.newaxis], y, 0).sum(1) / n
+
+    return np.sqrt(((my - ref.mean) ** 2 / ref.var).sum(1))
+
+
+# Metrics with a block implementation. The others are evaluated cell by cell.
+_block_metrics = {'seuclidean': _seuclidean_block}
+
+
+def _compute_block(metrics, block, valid, min_samples):
+    """
+    Compute prepared metrics for a block of candidate cells.
+
+    Parameters
+    ----------
+    metrics : sequence of PreparedMetric
+        Metrics bound to the reference samples.
+    block : ndarray (b,m,d)
+        Candidate samples for `b` grid cells. They are converted to the
+        type of the reference samples.
+    valid : ndarray (b,m)
+        True where every dimension of the candidate sample is valid.
+    min_samples : int
+        Minimum number of valid candidate samples.
+
+    Returns
+    -------
+    ndarray (t,b)
+        Dissimilarity values for each of the `t` metrics, NaN for cells with
+        too few valid samples.
+    """
+    out = np.empty((len(metrics), len(block)))
+    out.fill(np.nan)
+
+    block = np.asarray(block, metrics[0].ref.x.dtype)
+    count = valid.sum(1)
+    enough = count >= min_samples
+    complete = count == block.shape[1]
+
+    # Block implementations first, then the cell by cell metrics, so that
+    # each valid candidate sample is extracted only once.
+    cellwise = []
+    for j, metric in enumerate(metrics):
+        block_metric = _block_metrics.get(metric.dist)
+        if block_metric is not None:
+            out[j, enough] = block_metric(metric.ref, block[enough],
+                                          valid[enough])
+        else:
+            cellwise.append(j)
+
+    if cellwise:
+        for i in np.flatnonzero(enough):
+            # Complete samples are passed as views, without copy.
+            y = block[i] if complete[i] else block[i][valid[i]]
+            for j in cellwise:
+                out[j, i] = metrics[j](y)
+
+    return out
+
+
+# Metrics prepared once in each worker process of `dissimilarity_map`.
+_worker_metrics = None
+
+
+def _init_worker(dist, refs):
+    global _worker_metrics
+    _worker_metrics = [prepare(dist, x, **kwds) for x, kwds in refs]
+
+
+def _compute_tile(args):
+    block, valid, min_samples = args
+    return _compute_block(_worker_metrics, block, valid, min_samples)
+
+
+def _tile_slices(ncells, block_size, processes):
+    """
+    Split a sequence of grid cells into tiles.
+
+    Parameters
+    ----------
+    ncells : int
+        Number of grid cells.
+    block_size : int
+        Maximum number of grid cells per tile.
+    processes : int
+        Number of worker processes. The tiles are made small enough for
+        every worker to get at least one.
+
+    Returns
+    -------
+    list of slice
+        Cells of each tile.
+    """
+    if processes > 1:
+        block_size = min(block_size, int(np.ceil(1. * ncells / processes)))
+    block_size = max(block_size, 1)
+    return [slice(start, start + block_size)
+            for start in range(0, ncells, block_size)]
+
+
+def _compute_cells(metrics, cells, valid, min_samples, block_size,
+                   processes):
+    """
+    Compute prepared metrics for a sequence of candidate cells, tile by tile.
+
+    Parameters
+    ----------
+    metrics : sequence of PreparedMetric
+        Metrics bound to the reference samples. They must share the same
+        distance.
+    cells : ndarray (c,m,d)
+        Candidate samples for `c` grid cells.
+    valid : ndarray (c,m)
+        True where every dimension of the candidate sample is valid.
+    min_samples : int
+        Minimum number of valid candidate samples.
+    block_size : int
+        Maximum number of grid cells processed at once.
+    processes : int
+        Number of worker processes.
+
+    Returns
+    -------
+    ndarray (t,c)
+        Dissimilarity values for each of the `t` metrics.
+    """
+    tiles = [(cells[s], valid[s])
+             for s in _tile_slices(len(cells), block_size, processes)]
+
+    if processes > 1 and len(tiles) > 1:
+        from multiprocessing import Pool
+
+        pool = Pool(min(processes, len(tiles)), _init_worker,
+                    (metrics[0].dist, [(m.ref.x, m.kwds) for m in metrics]))
+        try:
+            res = pool.map(_compute_tile, [(block, mask, min_samples)
+                                           for block, mask in tiles])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        res = [_compute_block(metrics, block, mask, min_samples)
+               for block, mask in tiles]
+
+    return np.concatenate(res, axis=1) if res else \
+        np.empty((len(metrics), 0))
+
+
+def top_k_cells(x, cells, dist, k, min_samples=5, screen=TOP_K_SCREEN,
+                block_size=BLOCK_SIZE, processes=1, valid=None):
+    """
+    Find the `k` candidate cells most similar to the reference sample.
+
+    All cells are first ranked with the standardized Euclidean distance,
+    which is cheap to compute over the whole grid. The `screen * k` best
+    ranked cells are kept and the metric `dist` is evaluated on these
+    survivors only.
+
+    Parameters
+    ----------
+    x : ndarray (n,d)
+        Reference sample.
+    cells : ndarray (c,m,d)
+        Candidate samples for `c` grid cells.
+    dist : str
+        Name of the dissimilarity metric.
+    k : int
+        Number of cells to return.
+    min_samples : int
+        Minimum number of valid candidate samples.
+    screen : int
+        Number of cells evaluated with `dist` per cell returned.
+    block_size : int
+        Number of grid cells processed at once.
+    processes : int
+        Number of worker processes.
+    valid : ndarray (c,m), optional
+        True where every dimension of the candidate sample is valid.
+        Computed from `cells` if not given.
+
+    Returns
+    -------
+    index : ndarray (k,)
+        Index of the best cells, sorted by increasing dissimilarity.
+    values : ndarray (k,)
+        Dissimilarity values of these cells.
+
+    Notes
+    -----
+    The screen compares the means of the samples only. It is a heuristic,
+    not a lower bound of the other metrics: a cell whose mean is far from
+    the reference but whose distribution is otherwise close could be
+    missed. Increase `screen` to trade speed for exhaustiveness. With
+    `dist='seuclidean'` the result is exact.
+    """
+    metric = prepare(dist, x)
+    seuclid = metric if dist == 'seuclidean' else prepare('seuclidean', x)
+
+    cells = np.asarray(cells)
+    assert (cells.shape[-1] == metric.ref.d)
+    if valid is None:
+        valid = np.isfinite(cells).all(-1)
+
+    values = _compute_cells([seuclid], cells, valid, min_samples,
+                            block_size, 1)[0]
+    index = np.flatnonzero(np.isfinite(values))
+
+    if dist != 'seuclidean':
+        n = min(len(index), screen * k)
+        index = index[np.argsort(values[index], kind='mergesort')[:n]]
+        values = np.empty(len(cells))
+        values.fill(np.nan)
+        values[index] = _compute_cells([metric], cells[index], valid[index],
+                                       min_samples, block_size, processes)[0]
+        index = index[np.isfinite(values[index])]
+
+    best = index[np.argsort(values[index], kind='mergesort')[:k]]
+    return best, values[best]
+
+
+def dissimilarity_map(x, cube, dist='seuclidean', min_samples=5,
+                      block_size=BLOCK_SIZE, processes=1, top_k=None,
+                      valid=None, dtype=None):
+    """
+    Compute the dissimilarity between a reference sample and the candidate
+    samples of every cell of a grid.
+
+    Parameters
+    ----------
+    x : ndarray (n,d)
+        Reference sample.
+    cube : ndarray (..., m, d)
+        Candidate samples. The leading dimensions index the grid cells, the
+        last two the time steps and the climate indices. Time steps with
+        an invalid value (NaN) in any dimension are discarded.
+    dist : {'seuclidean', 'nearest_neighbor', 'zech_aslan',
+       'szekely_rizzo', 'kolmogorov_smirnov', 'friedman_rafsky', 'kldiv'}
+        Name of the dissimilarity metric.
+    min_samples : int
+        Minimum number of valid candidate samples. Cells with fewer
+        samples are set to NaN.
+    block_size : int
+        Number of grid cells processed at once.
+    processes : int
+        Number of worker processes. With more than one, the grid is split
+        into tiles of at most `block_size` cells, at least one per worker,
+        which are computed in a process pool.
+    top_k : int, optional
+        If given, only the `top_k` most similar cells are computed, see
+        `top_k_cells`. The other cells are set to NaN.
+    valid : ndarray (..., m), optional
+        True where every dimension of the candidate sample is valid, as
+        returned by `candidate_cube`. Computed from `cube` if not given.
+    dtype : dtype, optional
+        Floating point type of the computations. Defaults to float64. With
+        float32, the candidate samples of a `float32` cube are used as is,
+        halving the memory traffic, at the cost of precision.
+
+    Returns
+    -------
+    ndarray (...)
+        Dissimilarity values over the grid.
+    """
+    return dissimilarity_maps([x], cube, dist, min_samples, block_size,
+                              processes, top_k, valid, dtype)[0]
+
+
+def dissimilarity_maps(xs, cube, dist='seuclidean', min_samples=5,
+                       block_size=BLOCK_SIZE, processes=1, top_k=None,
+                       valid=None, dtype=None):
+    """
+    Compute the dissimilarity between multiple reference samples and the
+    candidate samples of every cell of a grid.
+
+    The candidate cube is traversed once, each tile being compared to all
+    the reference samples before moving on to the next one.
+
+    Parameters
+    ----------
+    xs : sequence of ndarray (n,d)
+        Reference samples. Their length `n` may differ.
+    cube : ndarray (..., m, d)
+        Candidate samples, see `dissimilarity_map`.
+    dist : str
+        Name of the dissimilarity metric.
+    min_samples : int
+        Minimum number of valid candidate samples.
+    block_size : int
+        Number of grid cells processed at once.
+    processes : int
+        Number of worker processes.
+    top_k : int, optional
+        If given, only the `top_k` most similar cells are computed for each
+        reference sample.
+    valid : ndarray (..., m), optional
+        True where every dimension of the candidate sample is valid.
+    dtype : dtype, optional
+        Floating point type of the computations. Defaults to float64.
+
+    Returns
+    -------
+    ndarray (t, ...)
+        Dissimilarity values over the grid for each of the `t` reference
+        samples.
+    """
+    cube = np.asarray(cube)
+    shape = cube.shape[:-2]
+    m, d = cube.shape[-2:]
+    cells = cube.reshape((-1, m, d))
+
+    # The validity of the candidate samples is computed once for all
+    # targets.
+    if valid is None:
+        valid = np.isfinite(cells).all(-1)
+    else:
+        valid = np.asarray(valid).reshape((-1, m))
+
+    xs = [np.asarray(x, dtype or np.float64) for x in xs]
+
+    if top_k:
+        out = np.empty((len(xs), len(cells)))
+        out.fill(np.nan)
+        for j, x in enumerate(xs):
+            index, values = top_k_cells(x, cells, dist, top_k, min_samples,
+                                        block_size=block_size,
+                                        processes=processes, valid=valid)
+            out[j, index] = values
+        return out.reshape((len(xs),) + shape)
+
+    metrics = [prepare(dist, x) for x in xs]
+    for metric in metrics:
+        assert (d == metric.ref.d)
+
+    return _compute_cells(metrics, cells, valid, min_samples, block_size,
+                          processes).reshape((len(xs),) + shape)
+
+
+def candidate_cube(arrays, axis=0, dtype=None, memmap_size=MEMMAP_SIZE):
+    """
+    Load the candidate climate indices into a single contiguous array.
+
+    Parameters
+    ----------
+    arrays : sequence of array_like
+        Values of each of the `d` climate indices over the grid, all with
+        the same shape. Masked values are considered invalid.
+    axis : int
+        Time axis of the arrays.
+    dtype : dtype, optional
+        Floating point type of the cube. Defaults to float32, unless the
+        arrays hold values of higher precision.
+    memmap_size : int
+        Cubes larger than this number of bytes are memory-mapped to a
+        temporary file instead of being held in memory.
+
+    Returns
+    -------
+    cube : ndarray (..., m, d)
+        Candidate samples, with invalid values set to NaN. Each grid cell
+        sample is a contiguous (m, d) block.
+    valid : ndarray (..., m)
+        True where every dimension of the candidate sample is valid.
+    """
+    arrays = [np.moveaxis(np.ma.asarray(a), axis, -1) for a in arrays]
+    if dtype is None:
+        dtype = np.result_type(np.float32, *[a.dtype for a in arrays])
+    shape = arrays[0].shape + (len(arrays),)
+
+    if np.prod(shape) * np.dtype(dtype).itemsize > memmap_size:
+        from tempfile import TemporaryFile
+        cube = np.memmap(TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+    else:
+        cube = np.empty(shape, dtype)
+
+    # Each index is copied once, directly into its slot of the cube.
+    valid = np.ones(shape[:-1], bool)
+    for j, a in enumerate(arrays):
+        cube[..., j] = np.ma.getdata(a)
+        if np.ma.is_masked(a):
+            cube[..., j][np.ma.getmaskarray(a)] = np.nan
+        valid &= np.isfinite(cube[..., j])
+
+    return cube, valid
@@ -0,0 +1,458 @@
+"""
+Cached grid cell weights of polygons.
+
+For a grid, a shapefile and a set of polygons, the fraction of each grid cell
+covered by the polygons is computed once and stored in the cache directory.
+Subsetting a dataset on the same grid then only requires slicing the data to
+the bounding box of the polygons and masking the cells outside.
+
+Land/sea masks derived from land area fraction files are kept in memory, so
+that datasets sharing a grid are masked with a single read of the mask.
+"""
+
+import hashlib
+import os
+from tempfile import mkstemp
+
+import numpy as np
+from netCDF4 import Dataset
+
+from flyingpigeon import config
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# Number of time steps copied at once when subsetting.
+TIME_CHUNK = 1000
+
+# Version of the cached cell weights, part of their key.
+WEIGHTS_VERSION = 2
+
+# Boolean land/sea masks, by (sftlf file, modification time, threshold, land_area).
+_LANDSEA_MASKS_ = {}
+
+
+def _is_coordinate(var, axis):
+    units = getattr(var, 'units', '')
+    standard_name = getattr(var, 'standard_name', '')
+    if axis == 'lat':
+        return standard_name == 'latitude' or units in ['degrees_north', 'degree_north']
+    return standard_name == 'longitude' or units in ['degrees_east', 'degree_east']
+
+
+def get_grid(ds, variable):
+    """
+    returns the coordinates of the grid cells of a variable
+
+    :param ds: netCDF4 Dataset
+    :param variable: variable name
+
+    :return: latitudes, longitudes and True if the grid is rectilinear (1D coordinates), \
+        else 2D coordinates of the cell centers
+    """
+    var = ds.variables[variable]
+    ydim, xdim = var.dimensions[-2:]
+    if ydim in ds.variables and xdim in ds.variables and \
+            _is_coordinate(ds.variables[ydim], 'lat') and _is_coordinate(ds.variables[xdim], 'lon'):
+        return ds.variables[ydim][:], ds.variables[xdim][:], True
+
+    names = getattr(var, 'coordinates', '').split()
+    lat = [n for n in names if n in ds.variables and _is_coordinate(ds.variables[n], 'lat')]
+    lon = [n for n in names if n in ds.variables and _is_coordinate(ds.variables[n], 'lon')]
+    if len(lat) == 0 or len(lon) == 0:
+        raise Exception('no latitude and longitude found for %s' % variable)
+    return ds.variables[lat[0]][:], ds.variables[lon[0]][:], False
+
+
+def grid_fingerprint(lats, lons):
+    """
+    returns a string identifying a grid by its coordinates
+
+    :param lats: latitudes
+    :param lons: longitudes
+
+    :return str: hexadecimal fingerprint
+    """
+    sha = hashlib.sha1()
+    for a in [lats, lons]:
+        a = np.ascontiguousarray(a, dtype=np.float64)
+        sha.update(str(a.shape).encode('ascii'))
+        sha.update(a.tobytes())
+    return sha.hexdigest()
+
+
+def _edges(centers):
+    """cell edges of 1D cell centers"""
+    mid = (centers[1:] + centers[:-1]) / 2.
+    return np.concatenate([[2 * centers[0] - mid[0]], mid, [2 * centers[-1] - mid[-1]]])
+
+
+def _wrap(lon):
+    return (np.asarray(lon) + 180.) % 360. - 180.
+
+
+def compute_fractions(lats, lons, rectilinear, polygon):
+    """
+    computes the fraction of the grid cells covered by a polygon
+
+    :param lats: latitudes, 1D if rectilinear else 2D
+    :param lons: longitudes, 1D if rectilinear else 2D
+    :param rectilinear: if True, the area fractions of the cells are computed, \
+        else the cells whose center is inside the polygon get a weight of 1
+    :param polygon: shapely geometry in longitude, latitude (-180 to 180)
+
+    :return numpy.array: fractions over the grid (y, x)
+    """
+    from shapely.geometry import box, Point
+    from shapely.prepared import prep
+
+    minx, miny, maxx, maxy = polygon.bounds
+    prepared = prep(polygon)
+
+    if rectilinear:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        yedges = _edges(lats)
+        xedges = _edges(lons)
+        fractions = np.zeros((len(lats), len(lons)))
+
+        ylo = np.minimum(yedges[:-1], yedges[1:])
+        yhi = np.maximum(yedges[:-1], yedges[1:])
+        rows = np.flatnonzero((yhi >= miny) & (ylo <= maxy))
+
+        # shift the cells to the longitude range of the polygon
+        xlo = np.minimum(xedges[:-1], xedges[1:])
+        xhi = np.maximum(xedges[:-1], xedges[1:])
+        shift = _wrap(lons) - lons
+        xlo, xhi = xlo + shift, xhi + shift
+        cols = np.flatnonzero((xhi >= minx) & (xlo <= maxx))
+
+        for i in rows:
+            for j in cols:
+                cell = box(xlo[j], ylo[i], xhi[j], yhi[i])
+                if prepared.contains(cell):
+                    fractions[i, j] = 1.
+                elif prepared.intersects(cell):
+                    fractions[i, j] = cell.intersection(polygon).area / cell.area
+    else:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = _wrap(lons)
+        fractions = np.zeros(lats.shape)
+        inside = (lats >= miny) & (lats <= maxy) & (lons >= minx) & (lons <= maxx)
+        for i, j in zip(*np.nonzero(inside)):
+            if prepared.contains(Point(lons[i, j], lats[i, j])):
+                fractions[i, j] = 1.
+    return fractions
+
+
+def _is_cyclic(lons, rectilinear):
+    """True if the 1D longitudes cover the whole globe"""
+    if not rectilinear or len(lons) < 2:
+        return False
+    edges = _edges(np.asarray(lons, dtype=np.float64))
+    return abs(edges[-1] - edges[0]) >= 360. - 1e-6
+
+
+def get_window(fractions, cyclic=False):
+    """
+    returns the window of the grid covering the cells with a weight.
+    On a global grid, the window crosses the longitude seam if the cells are on both sides of it.
+
+    :param fractions: weights over the grid (y, x)
+    :param cyclic: True if the x dimension covers the whole globe
+
+    :return: y slice and list of x slices, two slices if the window crosses the seam
+    """
+    rows = np.flatnonzero(fractions.any(1))
+    cols = np.flatnonzero(fractions.any(0))
+    if len(rows) == 0:
+        return slice(0, 0), [slice(0, 0)]
+    ywindow = slice(rows[0], rows[-1] + 1)
+    if cyclic:
+        nx = fractions.shape[1]
+        # columns without weight after each selected column, the last gap across the seam
+        gaps = np.diff(np.concatenate([cols, [cols[0] + nx]])) - 1
+        k = gaps[:-1].argmax() if len(cols) > 1 else 0
+        if len(cols) > 1 and gaps[k] > gaps[-1]:
+            return ywindow, [slice(cols[k + 1], nx), slice(0, cols[k] + 1)]
+    return ywindow, [slice(cols[0], cols[-1] + 1)]
+
+
+def get_weights(resource, variable, geom, ugids):
+    """
+    returns the cell weights of polygons for the grid of a dataset.
+    The weights are computed once per grid, shapefile and polygons and cached on disk.
+
+    :param resource: netCDF file
+    :param variable: variable name
+    :param geom: name of the shapefile
+    :param ugids: list of ugids of the polygons, see subset.get_ugid
+
+    :return: (y slice, list of x slices) covering the polygons, see get_window, \
+        and the fractions of the cells in this window
+    """
+    from shapely.ops import unary_union
+    from flyingpigeon.cache import file_lock
+    from flyingpigeon.subset import get_geometries
+
+    with Dataset(resource) as ds:
+        lats, lons, rectilinear = get_grid(ds, variable)
+
+    shapefile = os.path.join(config.shapefiles_path(), geom + '.shp')
+    key = hashlib.sha1()
+    key.update(grid_fingerprint(lats, lons).encode('ascii'))
+    key.update(('%s;%r;%r;%s' % (geom, os.path.getmtime(shapefile), sorted(ugids),
+                                 WEIGHTS_VERSION)).encode('utf-8'))
+    key = key.hexdigest()
+
+    dir_masks = os.path.join(config.cache_path(), 'masks')
+    if not os.path.isdir(dir_masks):
+        try:
+            os.makedirs(dir_masks)
+        except OSError:
+            if not os.path.isdir(dir_masks):
+                raise
+    filename = os.path.join(dir_masks, key + '.npz')
+
+    with file_lock(filename + '.lock'):
+        if not os.path.isfile(filename):
+            LOGGER.info('compute cell weights of %s %s' % (geom, ugids))
+            polygon = unary_union([g['geom'] for g in get_geometries(geom, ugids)])
+            fractions = compute_fractions(lats, lons, rectilinear, polygon)
+            ywindow, xwindow = get_window(fractions, cyclic=_is_cyclic(lons, rectilinear))
+            fraction = np.concatenate([fractions[ywindow, x] for x in xwindow], axis=1)
+            fd, tmp = mkstemp(dir=dir_masks, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    np.savez_compressed(fp, fraction=fraction,
+                                        ywindow=[ywindow.start, ywindow.stop],
+                                        xwindow=[[x.start, x.stop] for x in xwindow])
+                os.rename(tmp, filename)
+            finally:
+                if os.path.isfile(tmp):
+                    os.remove(tmp)
+        else:
+            LOGGER.debug('cell weights found in cache: %s' % os.path.basename(filename))
+
+    with np.load(filename) as npz:
+        y0, y1 = [int(y) for y in npz['ywindow']]
+        xwindow = [slice(int(x0), int(x1)) for x0, x1 in npz['xwindow']]
+        return (slice(y0, y1), xwindow), npz['fraction']
+
+
+def _sftlf_variable(ds):
+    """name of the land area fraction variable"""
+    if 'sftlf' in ds.variables:
+        return 'sftlf'
+    names = [name for name, v in ds.variables.items()
+             if v.ndim >= 2 and name not in ds.dimensions and
+             not _is_coordinate(v, 'lat') and not _is_coordinate(v, 'lon')]
+    if len(names) == 0:
+        raise Exception('no land area fraction found in %s' % ds.filepath())
+    return names[0]
+
+
+def check_landsea_grid(resource, variable, sftlf):
+    """
+    checks that a dataset and a land area fraction file are on the same grid
+
+    :param resource: netCDF file
+    :param variable: variable name
+    :param sftlf: land_area fraction netCDF file
+    """
+    if type(resource) == list:
+        resource = resource[0]
+    with Dataset(resource) as ds, Dataset(sftlf) as dm:
+        name = _sftlf_variable(dm)
+        shape = ds.variables[variable].shape[-2:]
+        if dm.variables[name].shape[-2:] != shape:
+            raise Exception('land area fraction grid %s does not match the grid %s of %s' %
+                            (dm.variables[name].shape[-2:], shape, variable))
+        try:
+            grid = get_grid(ds, variable)
+            grid_sftlf = get_grid(dm, name)
+        except Exception:
+            LOGGER.debug('no coordinates to compare, grids checked by their shape only')
+            return
+    if grid[2] != grid_sftlf[2]:
+        LOGGER.debug('rectilinear and curvilinear coordinates, grids checked by their shape only')
+        return
+    if not (np.allclose(grid[0], grid_sftlf[0], atol=1e-4) and
+            np.allclose(_wrap(grid[1]), _wrap(grid_sftlf[1]), atol=1e-4)):
+        raise Exception('land area fraction coordinates do not match the coordinates of %s' % variable)
+
+
+def get_landsea_mask(sftlf, threshold=50, land_area=True):
+    """
+    returns the cells to keep according to a land area fraction file.
+    The mask is computed once per file and threshold and kept in memory.
+
+    :param sftlf: land_area fraction netCDF file
+    :param threshold: Percentage of land area
+    :param land_area: If True (default), the land cells are kept, else the sea cells
+
+    :return numpy.array: boolean mask over the grid (y, x), True for the cells to keep
+    """
+    try:
+        mtime = os.path.getmtime(sftlf)
+    except OSError:
+        # remote file
+        mtime = None
+    key = (sftlf, mtime, threshold, land_area)
+    if key in _LANDSEA_MASKS_:
+        return _LANDSEA_MASKS_[key]
+
+    with Dataset(sftlf) as ds:
+        var = ds.variables[_sftlf_variable(ds)]
+        fraction = np.ma.filled(np.ma.asarray(var[:], dtype=np.float64), np.nan)
+        units = getattr(var, 'units', '')
+    fraction = fraction.reshape(fraction.shape[-2:])
+
+    # sftlf is given in percent in CMIP, as a fraction in some other datasets
+    if units == '%' or np.nanmax(fraction) > 1:
+        th = float(threshold)
+    else:
+        th = threshold / 100.0
+
+    with np.errstate(invalid='ignore'):
+        if land_area is True:
+            mask = fraction > th
+        else:
+            mask = fraction < th
+    LOGGER.debug('land/sea mask of %s: %s of %s cells kept' % (sftlf, mask.sum(), mask.size))
+
+    _LANDSEA_MASKS_[key] = mask
+    return mask
+
+
+def _read_window(var, index, xdim, xwindow):
+    """reads a variable over a window whose x dimension is made of several slices"""
+    if xdim not in var.dimensions or len(xwindow) == 1:
+        return var[index]
+    axis = var.dimensions.index(xdim)
+    parts = []
+    for x in xwindow:
+        part = list(index)
+        part[axis] = x
+        parts.append(var[tuple(part)])
+    return np.ma.concatenate(parts, axis=axis)
+
+
+def masked_subset(resource, variable, window, keep, prefix=None, dir_output=None,
+                  output_profile=None, wrap_longitudes=False):
+    """
+    subsets a dataset to a window of its grid and masks the cells not to keep
+
+    :param resource: list of netCDF files of one dataset, sorted in time
+    :param variable: variable name
+    :param window: (y slice, x slice or list of x slices) of the grid, see get_window
+    :param keep: boolean array over the window, False for the cells to mask
+    :param prefix: output file base name
+    :param dir_output: output directory (default= curdir)
+    :param output_profile: chunking and compression of the output file, see flyingpigeon.output_profiles
+    :param wrap_longitudes: if True, the longitudes are written in the range -180 to 180, \
+        as with the ocgis spatial wrapping, if they stay increasing
+
+    :return str: path to the output file
+    """
+    import uuid
+    from flyingpigeon.output_profiles import variable_kwargs
+
+    if type(resource) != list:
+        resource = [resource]
+    if prefix is None:
+        prefix = str(uuid.uuid1())
+    if dir_output is None:
+        dir_output = os.path.abspath(os.curdir)
+    output = os.path.join(dir_output, prefix + '.nc')
+
+    ywindow, xwindow = window
+    if not isinstance(xwindow, list):
+        xwindow = [xwindow]
+    outside = ~np.asarray(keep, dtype=bool)
+
+    nt = None
+    if output_profile is not None:
+        # length of the time axis over all files, for the chunk sizes
+        nt = 0
+        for nc in resource:
+            with Dataset(nc) as ds:
+                nt += ds.variables[variable].shape[0]
+
+    dst = None
+    try:
+        with Dataset(resource[0]) as src:
+            ydim, xdim = src.variables[variable].dimensions[-2:]
+            tdim = src.variables[variable].dimensions[0]
+            sizes = {ydim: ywindow.stop - ywindow.start,
+                     xdim: sum(x.stop - x.start for x in xwindow)}
+
+            # longitude coordinates and their bounds
+            longitudes = set()
+            for name, var in src.variables.items():
+                if _is_coordinate(var, 'lon'):
+                    longitudes.update([name, getattr(var, 'bounds', None)])
+            if wrap_longitudes and xdim in longitudes:
+                lon = _wrap(_read_window(src.variables[xdim], (slice(None),), xdim, xwindow))
+                if len(lon) > 1 and not np.all(np.diff(lon) > 0):
+                    LOGGER.debug('longitudes not wrapped, they would not be increasing')
+                    wrap_longitudes = False
+
+            data_model = src.data_model
+            if output_profile is not None and not data_model.startswith('NETCDF4'):
+                # chunking and compression require the HDF5 based formats
+                data_model = 'NETCDF4_CLASSIC'
+            dst = Dataset(output, 'w', format=data_model)
+            dst.setncatts(dict((a, src.getncattr(a)) for a in src.ncattrs()))
+            for name, dim in src.dimensions.items():
+                if name == tdim:
+                    dst.createDimension(name, None)
+                else:
+                    dst.createDimension(name, sizes.get(name, len(dim)))
+            for name, var in src.variables.items():
+                fill_value = getattr(var, '_FillValue', None)
+                if name == variable and fill_value is None:
+                    fill_value = 1.e20
+                kwds = {}
+                if output_profile is not None:
+                    shape = [nt if d == tdim else len(dst.dimensions[d]) for d in var.dimensions]
+                    kwds = variable_kwargs(output_profile, var.dimensions, shape, time_dimension=tdim)
+                out = dst.createVariable(name, var.dtype, var.dimensions, fill_value=fill_value, **kwds)
+                out.setncatts(dict((a, var.getncattr(a)) for a in var.ncattrs() if a != '_FillValue'))
+
+        def _index(var, time_slice):
+            return tuple(time_slice if d == tdim else ywindow if d == ydim else slice(None)
+                         for d in var.dimensions)
+
+        t = 0
+        for i, nc in enumerate(resource):
+            with Dataset(nc) as src:
+                nt = len(src.dimensions[tdim])
+                for name, var in src.variables.items():
+                    if tdim not in var.dimensions:
+                        if i == 0:
+                            values = _read_window(var, _index(var, None), xdim, xwindow)
+                            if wrap_longitudes and name in longitudes:
+                                values = _wrap(values)
+                            dst.variables[name][:] = values
+                        continue
+                    for start in range(0, nt, TIME_CHUNK):
+                        stop = min(start + TIME_CHUNK, nt)
+                        values = _read_window(var, _index(var, slice(start, stop)), xdim, xwindow)
+                        if name == variable:
+                            values = np.ma.masked_where(np.broadcast_to(outside, values.shape), values)
+                        dst.variables[name][tuple(slice(t + start, t + stop) if d == tdim else slice(None)
+                                                  for d in var.dimensions)] = values
+                t += nt
+    except Exception:
+        # no partial output file is left
+        if dst is not None:
+            dst.close()
+            dst = None
+        if os.path.isfile(output):
+            os.remove(output)
+        raise
+    finally:
+        if dst is not None:
+            dst.close()
+    return output
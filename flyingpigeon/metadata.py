@@ -216,33 +216,18 @@ def get_frequency(resource):
     :param resource: NetCDF file
     :return: frequency
     """
-    from netCDF4 import num2date
-    from numpy import mean
+    from flyingpigeon.catalog import get_header
 
     if type(resource) != list:
         resource = [resource]
     LOGGER.debug('length of recources: %s files' % len(resource))
 
-    if len(resource) > 1:
-        ds = MFDataset(resource)
-        LOGGER.debug('MFDataset loaded for %s of files in resource:' % len(resource))
-    else:
-        ds = Dataset(resource[0])
-        LOGGER.debug('Dataset loaded for %s file in resource:' % len(resource))
-    time = ds.variables['time']
-    dates = num2date(time[:], time.units, time.calendar)
-
-    diffs = []
-    m = len(time)
-    if m > 100:
-        m = 100
-
-    for i, date in enumerate(dates):
-        if i > 0 and i < m:
-            diff = date - dates[i-1]
-            diffs.append(diff.days)
-
-    fqz = mean(diffs)
+    # mean time step in days over the first time steps
+    time = get_header(resource[0])['time']
+    if time is None or time['step'] is None:
+        raise Exception('frequency not found in %s: a time axis of two time steps at least is needed'
+                        % resource[0])
+    fqz = time['step']
 
     if (350 < fqz < 370):
         frequency = 'yr'
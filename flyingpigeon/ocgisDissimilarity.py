@@ -1,8 +1,8 @@
 import dissimilarity as dd
 import numpy as np
-from ocgis.util.helpers import iter_array
 from ocgis.calc.base import AbstractParameterizedFunction, AbstractFieldFunction
 from ocgis.collection.field import Field
+from ocgis.variable.dimension import Dimension
 from ocgis.constants import NAME_DIMENSION_TEMPORAL
 
 metrics = dd.__all__
@@ -20,11 +20,14 @@ class Dissimilarity(AbstractFieldFunction, AbstractParameterizedFunction):
     standard_name = 'dissimilarity_metric'
     description = 'Metric evaluating the dissimilarity between two ' \
                   'multivariate samples'
-    parms_definition = {'dist': str, 'target': Field, 'candidate': tuple}
+    parms_definition = {'dist': str, 'target': Field, 'targets': tuple,
+                        'candidate': tuple, 'processes': int, 'top_k': int,
+                        'dtype': str}
     required_variables = ['candidate', 'target']
     _potential_dist = metrics
 
-    def calculate(self, target=None, candidate=None, dist='seuclidean'):
+    def calculate(self, target=None, candidate=None, dist='seuclidean',
+                  processes=1, top_k=None, targets=None, dtype='float64'):
         """
 
         Parameters
@@ -36,21 +39,38 @@ class Dissimilarity(AbstractFieldFunction, AbstractParameterizedFunction):
             Sequence of variable names identifying climate indices on which
             the comparison will be performed.
         dist : {'seuclidean', 'nearest_neighbor', 'zech_aslan',
-           'kolmogorov_smirnov', 'friedman_rafsky', 'kldiv'}
+           'szekely_rizzo', 'kolmogorov_smirnov', 'friedman_rafsky', 'kldiv'}
             Name of the distance measure, or dissimilarity metric.
+        processes : int
+            Number of worker processes computing the metric over tiles of
+            the candidate grid.
+        top_k : int
+            If given, only the `top_k` cells most similar to the target are
+            computed, after a screening of all cells with the standardized
+            Euclidean distance. The other cells are set to NaN.
+        targets : tuple
+            Sequence of target Fields, used instead of `target` to compare
+            the candidates to multiple targets at once. The output then has
+            a leading `target` dimension.
+        dtype : {'float64', 'float32'}
+            Floating point type of the computations. With float32, the
+            candidate data is held in single precision, halving memory use.
         """
         assert (dist in self._potential_dist)
 
-        # Get the function from the module.
-        metric = getattr(dd, dist)
+        multiple = targets is not None
+        if not multiple:
+            targets = [target]
 
-        for var in candidate:
-            if var not in target.keys():
-                raise ValueError("{} not in candidate Field.".format(var))
+        for tfield in targets:
+            for var in candidate:
+                if var not in tfield.keys():
+                    raise ValueError("{} not in candidate Field.".format(var))
 
-        # Build the (n,d) array for the target sample.
-        ref = np.array([target[c].get_value().squeeze() for c in candidate]).T
-        assert ref.ndim == 2
+        # Build the (n,d) arrays for the target samples.
+        refs = [np.array([t[c].get_value().squeeze() for c in candidate]).T
+                for t in targets]
+        assert all(ref.ndim == 2 for ref in refs)
 
         # Create the fill variable based on the first candidate variable.
         variable = self.field[candidate[0]]
@@ -58,6 +78,8 @@ class Dissimilarity(AbstractFieldFunction, AbstractParameterizedFunction):
         time_axis = crosswalk.index(NAME_DIMENSION_TEMPORAL)
         fill_dimensions = list(variable.dimensions)
         fill_dimensions.pop(time_axis)
+        if multiple:
+            fill_dimensions.insert(0, Dimension('target', len(refs)))
         fill = self.get_fill_variable(variable,
                                       'dissimilarity', fill_dimensions,
                                       self.file_only,
@@ -67,29 +89,26 @@ class Dissimilarity(AbstractFieldFunction, AbstractParameterizedFunction):
         # Metric computation #
         # ================== #
 
-        # Iterator over every dimension except time
-        itr = iter_array(fill)
-
+        # Load the candidate cube once, with time and the indices as the
+        # last two dimensions. The remaining dimensions are those of the
+        # fill variable. Values are kept in single precision unless the
+        # input is stored in double precision, and invalid values are
+        # flagged once for all cells.
+        dtype = np.dtype(dtype)
+        cube, valid = dd.candidate_cube(
+            [self.field[c].get_masked_value() for c in candidate],
+            axis=time_axis,
+            dtype=np.float32 if dtype == np.float32 else None)
+
+        # Compute the metric over whole blocks of cells. The target samples
+        # are prepared once, so that the cost per cell only covers the
+        # candidate side, and each block of the cube is compared to all the
+        # targets before moving on. The 5 value threshold is arbitrary.
         arr = self.get_variable_value(fill)
-        for ind in itr:
-
-            # Build target array
-            dind = list(ind)
-            dind.insert(time_axis, slice(None))
-            data = np.array([self.field[c][dind].get_value().squeeze() for c in
-                             candidate])
-
-            p = np.ma.masked_invalid(data).T
-
-            # Compress masked values from target array.
-            pc = p.compress(~p.mask.any(1), 0)
-
-            # Compute the actual metric value. The 5 value threshold is
-            # arbitrary.
-            if pc.shape[0] >= 5:
-                arr.data[ind] = metric(ref, pc)
-            else:
-                arr.data[ind] = np.nan
+        res = dd.dissimilarity_maps(refs, cube, dist, min_samples=5,
+                                    processes=processes, top_k=top_k,
+                                    valid=valid, dtype=dtype)
+        arr.data[...] = res if multiple else res[0]
 
         # Add the output variable to calculations variable collection. This
         # is what is returned by the execute() call.
@@ -1,9 +1,12 @@
-from os.path import join, abspath, dirname, getsize, curdir, isfile
+from os.path import join, abspath, dirname, getsize, curdir, isfile, isdir, basename
 from netCDF4 import Dataset
 from flyingpigeon import config
 import logging
 LOGGER = logging.getLogger("PYWPS")
 
+# Upper bound in Mb of the memory used by an ocgis operation when no limit is given.
+MAX_MEMORY_LIMIT = 1024. * 4
+
 
 def has_Lambert_Conformal(resource):
     """
@@ -28,11 +31,12 @@ def call(resource=[], variable=None, dimension_map=None, agg_selection=True, cal
          geom=None, output_format_options=None, search_radius_mult=2.,
          select_nearest=False, select_ugid=None, spatial_wrapping=None,
          t_calendar=None, time_region=None,
-         time_range=None, dir_output=None, output_format='nc'):
+         time_range=None, dir_output=None, output_format='nc', output_profile=None):
     '''
     ocgis operation call
 
-    :param resource:
+    :param resource: netCDF files or OPeNDAP URLs. Only the hyperslabs of the remote datasets \
+        covering the geometries and the time range are downloaded.
     :param variable: variable in the input file to be picked
     :param dimension_map: dimension map in case of unconventional storage of data
     :param agg_selection: For aggregation of in case of mulitple polygons geoms
@@ -41,8 +45,9 @@ def call(resource=[], variable=None, dimension_map=None, agg_selection=True, cal
     :param cdover: use py-cdo ('python', by default) or cdo from the system ('system')
     :param conform_units_to:
     :param crs: coordinate reference system
-    :param memory_limit: limit the amount of data to be loaded into the memory at once \
-        if None (default) free memory is detected by birdhouse
+    :param memory_limit: limit (in Mb) the amount of data to be loaded into the memory at once \
+        if None (default) free memory is detected by birdhouse. Larger requests are computed \
+        in spatial tiles if the calculation allows it.
     :param level_range: subset of given levels
     :param prefix: string for the file base name
     :param regrid_destination: file path with netCDF file with grid for output file
@@ -64,6 +69,8 @@ def call(resource=[], variable=None, dimension_map=None, agg_selection=True, cal
     :param time_range: sequence of two datetime.datetime objects to mark start and end point
     :param dir_output (default= curdir):
     :param output_format:
+    :param output_profile: chunking and compression of netCDF output files, see flyingpigeon.output_profiles \
+        'timeseries', 'maps' or 'archive'. None (default) for the ocgis defaults.
     :return: output file path
     '''
     LOGGER.info('Start ocgis module call function')
@@ -116,11 +123,24 @@ def call(resource=[], variable=None, dimension_map=None, agg_selection=True, cal
     #     output_format_options = {'data_model': 'NETCDF4',  # NETCDF4_CLASSIC
     #                              'variable_kwargs': {'zlib': True, 'complevel': 9}}
     # else:
+    if output_profile is not None and output_format == 'nc' and output_format_options is None:
+        from flyingpigeon import output_profiles
+        output_format_options = output_profiles.output_format_options(output_profile)
     if output_format_options is not None:
         LOGGER.info('output_format_options are set to %s ' % (output_format_options))
 
     if type(resource) != list:
         resource = list([resource])
+
+    # remote datasets: only the region and period of the request are fetched,
+    # ocgis reads the remote datasets as a whole otherwise
+    try:
+        from flyingpigeon.opendap import fetch_subsets
+        resource = fetch_subsets(resource, variable=variable, geom=geom, select_ugid=select_ugid,
+                                 time_range=time_range, dir_output=dir_output)
+    except Exception:
+        LOGGER.exception('failed to fetch the subsets of the remote datasets, using the remote datasets')
+
     # execute ocgis
     LOGGER.info('Execute ocgis module call function')
 
@@ -140,144 +160,75 @@ def call(resource=[], variable=None, dimension_map=None, agg_selection=True, cal
         from ocgis.constants import DimensionMapKey
         rd.dimension_map.set_bounds(DimensionMapKey.TIME, None)
 
-        ops = OcgOperations(dataset=rd,
-                            output_format_options=output_format_options,
-                            dir_output=dir_output,
-                            spatial_wrapping=spatial_wrapping,
-                            spatial_reorder=spatial_reorder,
-                            # regrid_destination=rd_regrid,
-                            # options=options,
-                            calc=calc,
-                            calc_grouping=calc_grouping,
-                            geom=geom,
-                            agg_selection=agg_selection,
-                            output_format=output_format,
-                            prefix=prefix,
-                            search_radius_mult=search_radius_mult,
-                            select_nearest=select_nearest,
-                            select_ugid=select_ugid,
-                            add_auxiliary_files=False)
+        ops_kwds = dict(dataset=rd,
+                        output_format_options=output_format_options,
+                        dir_output=dir_output,
+                        spatial_wrapping=spatial_wrapping,
+                        spatial_reorder=spatial_reorder,
+                        # regrid_destination=rd_regrid,
+                        # options=options,
+                        calc=calc,
+                        calc_grouping=calc_grouping,
+                        geom=geom,
+                        agg_selection=agg_selection,
+                        output_format=output_format,
+                        prefix=prefix,
+                        search_radius_mult=search_radius_mult,
+                        select_nearest=select_nearest,
+                        select_ugid=select_ugid,
+                        add_auxiliary_files=False)
+        ops = OcgOperations(**ops_kwds)
         LOGGER.info('OcgOperations set')
     except:
         LOGGER.exception('failed to setup OcgOperations')
         return None
 
+    ##########################################
+    # compare the data load with the memory limit
+    ##########################################
     try:
-        LOGGER.info('ocgis module call as ops.execute()')
-        geom_file = ops.execute()
+        mem_limit = get_memory_limit(memory_limit)
+        LOGGER.info('memory_limit = %s Mb' % (mem_limit))
+        tile_dim = get_tile_dimension(ops, mem_limit)
     except:
-        LOGGER.exception('failed to execute ocgis operation')
-        return None
-
-    #
-    # try:
-    #     from numpy import sqrt
-    #     from flyingpigeon.utils import FreeMemory
-    #
-    #     if memory_limit is None:
-    #         f = FreeMemory()
-    #         mem_kb = f.user_free
-    #         mem_mb = mem_kb / 1024.
-    #         mem_limit = mem_mb / 2.  # set limit to half of the free memory
-    #     else:
-    #         mem_limit = memory_limit
-    #
-    #     if mem_limit >= 1024. * 4:
-    #         mem_limit = 1024. * 4
-    #         # 475.0 MB for openDAP
-    #
-    #     LOGGER.info('memory_limit = %s Mb' % (mem_limit))
-    #
-    #     data_kb = ops.get_base_request_size()['total']
-    #     data_mb = data_kb / 1024.
-    #
-    #     # data_kb = size['total']/reduce(lambda x,y: x*y,size['variables'][variable]['value']['shape'])
-    #     LOGGER.info('data_mb  = %s Mb' % (data_mb))
-    #
-    #     if data_mb <= mem_limit:  # input is smaler than the half of free memory size
-    #         try:
-    #             LOGGER.info('ocgis module call as ops.execute()')
-    #             geom_file = ops.execute()
-    #         except Exception as e:
-    #             LOGGER.debug('failed to execute ocgis operation')
-    #             raise
-    #             return None
-    #
-    #     else:
-    #         ##########################
-    #         # calcultion of chunk size
-    #         ##########################
-    #         try:
-    #             size = ops.get_base_request_size()
-    #             nb_time_coordinates_rd = size['variables'][variable]['temporal']['shape'][0]
-    #             element_in_kb = size['total']/reduce(lambda x, y: x*y, size['variables'][variable]['value']['shape'])
-    #             element_in_mb = element_in_kb / 1024.
-    #             tile_dim = sqrt(mem_limit/(element_in_mb*nb_time_coordinates_rd))  # maximum chunk size
-    #
-    #             LOGGER.info('ocgis module call compute with chunks')
-    #             if calc is None:
-    #                 calc = '%s=%s*1' % (variable, variable)
-    #                 LOGGER.info('calc set to = %s ' % calc)
-    #             ops = OcgOperations(dataset=rd,
-    #                                 output_format_options=output_format_options,
-    #                                 dir_output=dir_output,
-    #                                 spatial_wrapping=spatial_wrapping,
-    #                                 spatial_reorder=spatial_reorder,
-    #                                 # regrid_destination=rd_regrid,
-    #                                 # options=options,
-    #                                 calc=calc,
-    #                                 calc_grouping=calc_grouping,
-    #                                 geom=geom,
-    #                                 output_format=output_format,
-    #                                 prefix=prefix,
-    #                                 search_radius_mult=search_radius_mult,
-    #                                 select_nearest=select_nearest,
-    #                                 select_ugid=select_ugid,
-    #                                 add_auxiliary_files=False)
-    #             geom_file = compute(ops, tile_dimension=int(tile_dim), verbose=True)
-    #             print 'ocgis calculated'
-    #         except Exception as e:
-    #             LOGGER.debug('failed to compute ocgis with chunks')
-    #             raise
-    #             return None
-    #     LOGGER.info('Succeeded with ocgis module call function')
-    # except:
-    #     LOGGER.exception('failed to compare dataload with free memory, calling as execute instead')
+        LOGGER.exception('failed to compare dataload with free memory, calling as execute instead')
+        tile_dim = None
+
+    geom_file = None
+    if tile_dim is not None:
+        if output_format == 'nc' and calc_supports_tiling(calc):
+            try:
+                LOGGER.info('ocgis module call compute with chunks of %s x %s cells' % (tile_dim, tile_dim))
+                if calc is None:
+                    # the tiled computation requires a calculation
+                    variable = rd.variable
+                    ops_kwds['calc'] = '%s=%s*1' % (variable, variable)
+                    LOGGER.info('calc set to = %s ' % ops_kwds['calc'])
+                    ops = OcgOperations(**ops_kwds)
+                geom_file = compute(ops, tile_dimension=tile_dim, verbose=False)
+            except:
+                LOGGER.exception('failed to compute ocgis with chunks, calling as execute instead')
+                geom_file = None
+                ops_kwds['calc'] = calc
+                ops = OcgOperations(**ops_kwds)
+        else:
+            LOGGER.info('data exceeds the memory limit but the operation can not be computed in chunks')
+
+    if geom_file is None:
+        try:
+            LOGGER.info('ocgis module call as ops.execute()')
+            geom_file = ops.execute()
+        except:
+            LOGGER.exception('failed to execute ocgis operation')
+            return None
 
     ############################################
     # remapping according to regrid informations
     ############################################
     if regrid_destination is not None:
         try:
-            if (cdover=='system'):
-                from os import system
-                remap = 'remap%s' % regrid_options
-                output = '%s.nc' % uuid.uuid1()
-                output = abspath(curdir)+'/'+output
-                comcdo = 'cdo -O %s,%s %s %s' % (remap, regrid_destination, geom_file, output)
-                system(comcdo)
-                
-                if(isfile(output)==False):
-                    comcdo = '/usr/bin/cdo -O %s,%s %s %s' % (remap, regrid_destination, geom_file, output)
-                    system(comcdo)
-                
-                if(isfile(output)==False): cdover='python'
-
-                # need to substitute by subprocess call
-                # TODO: If system failed - py-cdo used insted
-                # what if py-cdo failed, with option 'python'
-                # need to call 'system' in this case - need to write function
-
-            if (cdover=='python'):
-                from tempfile import mkstemp
-                from cdo import Cdo
-                cdo = Cdo()
-                output = '%s.nc' % uuid.uuid1()
-                remap = 'remap%s' % regrid_options
-                call = [op for op in dir(cdo) if remap in op]
-                cmd = "output = cdo.%s('%s',input='%s', output='%s')" \
-                      % (str(call[0]), regrid_destination, geom_file, output)
-                exec cmd
+            output = remap(geom_file, regrid_destination, regrid_options=regrid_options,
+                           cdover=cdover, dir_output=dir_output)
         except Exception as e:
             LOGGER.debug('failed to remap')
             raise
@@ -293,6 +244,201 @@ def call(resource=[], variable=None, dimension_map=None, agg_selection=True, cal
     return output
 
 
+def get_memory_limit(memory_limit=None):
+    """
+    returns the amount of memory an ocgis operation is allowed to load at once
+
+    :param memory_limit: limit in Mb. If None (default), half of the free memory, \
+        but not more than MAX_MEMORY_LIMIT
+
+    :return float: memory limit in Mb
+    """
+    if memory_limit is None:
+        from flyingpigeon.utils import FreeMemory
+        f = FreeMemory(unit='MB')
+        memory_limit = min(f.user_free / 2., MAX_MEMORY_LIMIT)  # set limit to half of the free memory
+    return float(memory_limit)
+
+
+def get_tile_dimension(ops, memory_limit):
+    """
+    returns the size of the spatial tiles for a chunked computation of an ocgis operation
+
+    :param ops: OcgOperations
+    :param memory_limit: memory limit in Mb
+
+    :return int: tile dimension, None if the request fits into the memory limit
+    """
+    from numpy import sqrt, prod
+
+    size = ops.get_base_request_size()
+    data_mb = size['total'] / 1024.
+    LOGGER.info('data_mb  = %s Mb' % (data_mb))
+
+    if data_mb <= memory_limit:
+        return None
+
+    # The data variable is the largest array of the request, with the spatial dimensions last.
+    arrays = list(_iter_array_sizes(size))
+    value = max(arrays, key=lambda a: a['kb'])
+    shape = value['shape']
+    element_mb = value['kb'] / 1024. / prod(shape)
+    nb_time_coordinates = prod(shape[:-2])
+    tile_dim = sqrt(memory_limit / (element_mb * nb_time_coordinates))  # maximum chunk size
+    return max(int(tile_dim), 1)
+
+
+def _iter_array_sizes(size):
+    """yields the entries of ops.get_base_request_size() describing an array"""
+    for val in size.values():
+        if isinstance(val, dict):
+            if 'shape' in val and 'kb' in val:
+                if len(val['shape']) > 0:
+                    yield val
+            else:
+                for a in _iter_array_sizes(val):
+                    yield a
+
+
+def calc_supports_tiling(calc):
+    """
+    Check if a calculation can be computed over spatial tiles. Functions operating on the whole
+    field at once (e.g. the dissimilarity of spatial analogs) can not.
+
+    :param calc: ocgis calc syntax
+
+    :return Boolean: True/False
+    """
+    if calc is None:
+        return True
+    if not isinstance(calc, list):
+        calc = [calc]
+    # eval calculations (strings) are computed element-wise
+    funcs = [c['func'] for c in calc if isinstance(c, dict)]
+    if len(funcs) == 0:
+        return True
+    try:
+        from ocgis import FunctionRegistry
+        from ocgis.calc.base import AbstractFieldFunction
+        registry = FunctionRegistry()
+        for func in funcs:
+            cls = registry.get(func)
+            if cls is None or issubclass(cls, AbstractFieldFunction):
+                return False
+    except:
+        LOGGER.exception('failed to check the calculation functions')
+        return False
+    return True
+
+
+def _cdo(operator, args=[], input=None, output=None, cdover='python'):
+    """
+    runs a cdo operator, with py-cdo ('python') or the cdo command of the system ('system')
+
+    :return: output of the operator
+    """
+    if cdover == 'system':
+        from subprocess import check_output
+        cmd = ['cdo', '-O', ','.join([operator] + list(args)), input]
+        if output is None:
+            return check_output(cmd).splitlines()
+        check_output(cmd + [output])
+        return output
+    else:
+        from cdo import Cdo
+        cdo = Cdo()
+        return getattr(cdo, operator)(*args, input=input, output=output)
+
+
+def _grid_fingerprint(grid, cdover='python'):
+    """
+    returns a string identifying a grid
+
+    :param grid: netCDF file, grid description file or cdo grid name
+    """
+    if isfile(grid):
+        try:
+            return '\n'.join(_cdo('griddes', input=grid, cdover=cdover))
+        except Exception:
+            # not a data file: grid description file
+            with open(grid) as fp:
+                return fp.read()
+    return grid
+
+
+def get_regrid_weights(resource, regrid_destination, regrid_options='bil', cdover='python'):
+    """
+    returns the remapping weights from the grid of a file to a destination grid.
+    Weights are generated once per source grid, destination grid and method with cdo gen<method>,
+    and stored in the cache directory for later calls.
+
+    :param resource: netCDF file on the source grid
+    :param regrid_destination: file containing the targed grid (griddes.txt or netCDF file)
+    :param regrid_options: remapping method (see call)
+    :param cdover: use py-cdo ('python', by default) or cdo from the system ('system')
+
+    :return str: path to the weights netCDF file
+    """
+    from hashlib import sha1
+    from os import close, makedirs, remove, rename
+    from tempfile import mkstemp
+    from flyingpigeon.cache import file_lock
+
+    key = sha1()
+    key.update(_grid_fingerprint(resource, cdover=cdover).encode('utf-8'))
+    key.update(_grid_fingerprint(regrid_destination, cdover=cdover).encode('utf-8'))
+    key.update(regrid_options.encode('utf-8'))
+    key = key.hexdigest()
+
+    dir_weights = join(config.cache_path(), 'regrid_weights')
+    try:
+        makedirs(dir_weights)
+    except OSError:
+        if not isdir(dir_weights):
+            raise
+    weights = join(dir_weights, '%s_%s.nc' % (regrid_options, key))
+
+    # the lock prevents concurrent processes from generating the same weights
+    with file_lock(weights + '.lock'):
+        if not isfile(weights):
+            LOGGER.info('generate regrid weights %s' % basename(weights))
+            fd, tmp = mkstemp(dir=dir_weights, suffix='.tmp')
+            close(fd)
+            try:
+                _cdo('gen%s' % regrid_options, [regrid_destination], input=resource, output=tmp, cdover=cdover)
+                rename(tmp, weights)
+            finally:
+                if isfile(tmp):
+                    remove(tmp)
+        else:
+            LOGGER.debug('regrid weights found in cache: %s' % basename(weights))
+    return weights
+
+
+def remap(resource, regrid_destination, regrid_options='bil', cdover='python', dir_output=None):
+    """
+    remaps a netCDF file to a destination grid, reusing cached remapping weights
+
+    :param resource: netCDF file
+    :param regrid_destination: file containing the targed grid (griddes.txt or netCDF file)
+    :param regrid_options: remapping method (see call)
+    :param cdover: use py-cdo ('python', by default) or cdo from the system ('system')
+    :param dir_output: output directory (default= curdir)
+
+    :return str: path to remapped file
+    """
+    import uuid
+
+    if dir_output is None:
+        dir_output = abspath(curdir)
+    output = join(dir_output, '%s.nc' % uuid.uuid1())
+
+    weights = get_regrid_weights(resource, regrid_destination,
+                                 regrid_options=regrid_options, cdover=cdover)
+    _cdo('remap', [regrid_destination, weights], input=resource, output=output, cdover=cdover)
+    return output
+
+
 def eval_timerange(resource, time_range):
     """
     quality checker if given time_range is covered by timesteps in resource files
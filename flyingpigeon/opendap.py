@@ -0,0 +1,288 @@
+"""
+Subsets of remote OPeNDAP datasets.
+
+The spatial bounding box and the time range of a request are translated into
+index ranges of the dataset dimensions, so that the server only sends the
+corresponding hyperslabs. The subset is written to a local netCDF file which
+is then processed like any input file. Remote datasets are kept open in a
+bounded pool, so that the connections are reused by the following requests,
+and failed requests are retried with an increasing delay.
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+import six
+from netCDF4 import Dataset
+
+from flyingpigeon.masks import TIME_CHUNK
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# Maximum number of remote datasets kept open.
+POOL_SIZE = 8
+
+# Number of attempts of a remote request, and delay in seconds before the
+# first retry, doubled at each attempt.
+RETRIES = 4
+BACKOFF = 1.
+
+# Open remote datasets, by URL, the least recently used first.
+_POOL_ = OrderedDict()
+
+
+def is_opendap(resource):
+    """
+    :param resource: file path or URL
+
+    :return bool: True if the resource is a remote dataset
+    """
+    return resource.startswith('http://') or resource.startswith('https://')
+
+
+def retry(func, *args, **kwargs):
+    """
+    calls a function until it succeeds, with a delay growing exponentially between the attempts
+
+    :param func: function sending a remote request
+    :param args: positional arguments of the function
+    :param kwargs: keyword arguments of the function
+
+    :return: result of the function
+    """
+    delay = BACKOFF
+    for attempt in range(1, RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except (IOError, OSError, RuntimeError) as e:
+            if attempt == RETRIES:
+                raise
+            LOGGER.warning('remote request failed (attempt %s of %s): %s, retry in %s s' %
+                           (attempt, RETRIES, e, delay))
+            time.sleep(delay)
+            delay *= 2
+
+
+def open_dataset(url):
+    """
+    returns an open dataset from the pool, opened if needed
+
+    :param url: OPeNDAP URL
+
+    :return: netCDF4 Dataset
+    """
+    if url in _POOL_:
+        ds = _POOL_.pop(url)
+        if ds.isopen():
+            _POOL_[url] = ds
+            return ds
+
+    ds = retry(Dataset, url)
+    _POOL_[url] = ds
+    while len(_POOL_) > POOL_SIZE:
+        _, old = _POOL_.popitem(last=False)
+        try:
+            old.close()
+        except Exception:
+            pass
+    return ds
+
+
+def close_pool():
+    """
+    closes the remote datasets of the pool
+    """
+    while _POOL_:
+        _, ds = _POOL_.popitem()
+        try:
+            ds.close()
+        except Exception:
+            pass
+
+
+def _data_variable(ds):
+    from flyingpigeon.catalog import detect_variable
+
+    variable = detect_variable(ds)
+    if isinstance(variable, tuple):
+        return variable[0]
+    return variable
+
+
+def _index_range(selected, margin=1):
+    """slice covering the True values of a boolean array, widened by a margin"""
+    index = np.flatnonzero(selected)
+    if len(index) == 0:
+        raise Exception('the request does not intersect the dataset')
+    return slice(max(index[0] - margin, 0), min(index[-1] + 1 + margin, len(selected)))
+
+
+def get_index_window(ds, variable=None, bbox=None, time_range=None):
+    """
+    translates a bounding box and a time range into index ranges of the dataset dimensions
+
+    :param ds: netCDF4 Dataset
+    :param variable: variable name (if not set, variable will be detected)
+    :param bbox: [minx, miny, maxx, maxy] in longitude, latitude
+    :param time_range: sequence of two datetime.datetime objects
+
+    :return dict: dimension name -> slice, for the restricted dimensions
+    """
+    from netCDF4 import date2num
+    from flyingpigeon.masks import get_grid, _wrap
+
+    if variable is None:
+        variable = _data_variable(ds)
+    var = ds.variables[variable]
+    window = {}
+
+    if bbox is not None:
+        minx, miny, maxx, maxy = bbox
+        ydim, xdim = var.dimensions[-2:]
+        lats, lons, rectilinear = get_grid(ds, variable)
+        lats = np.asarray(lats)
+        lons = np.asarray(lons)
+        if rectilinear:
+            # cells overlapping the box, not only their centers
+            dy = np.abs(np.diff(lats)).max() if len(lats) > 1 else 0
+            dx = np.abs(np.diff(lons)).max() if len(lons) > 1 else 0
+        if minx >= -180 and maxx <= 180:
+            lons = _wrap(lons)
+        if rectilinear:
+            window[ydim] = _index_range((lats >= miny - dy) & (lats <= maxy + dy))
+            window[xdim] = _index_range((lons >= minx - dx) & (lons <= maxx + dx))
+        else:
+            inside = (lats >= miny) & (lats <= maxy) & (lons >= minx) & (lons <= maxx)
+            window[ydim] = _index_range(inside.any(1))
+            window[xdim] = _index_range(inside.any(0))
+
+    tdim = var.dimensions[0]
+    if time_range is not None and tdim in ds.variables and 'since' in getattr(ds.variables[tdim], 'units', ''):
+        times = ds.variables[tdim]
+        calendar = getattr(times, 'calendar', 'standard')
+        start, end = date2num(list(time_range), times.units, calendar)
+        values = times[:]
+        window[tdim] = _index_range((values >= start) & (values <= end), margin=0)
+    return window
+
+
+def fetch_subset(url, variable=None, bbox=None, time_range=None, prefix=None, dir_output=None):
+    """
+    copies the hyperslab of a remote dataset covering a bounding box and a time range to a local file
+
+    :param url: OPeNDAP URL
+    :param variable: variable name (if not set, variable will be detected)
+    :param bbox: [minx, miny, maxx, maxy] in longitude, latitude
+    :param time_range: sequence of two datetime.datetime objects
+    :param prefix: output file base name (default= base name of the url with a unique suffix)
+    :param dir_output: output directory (default= curdir)
+
+    :return str: path to the local netCDF file
+    """
+    import uuid
+
+    if prefix is None:
+        prefix = '%s_%s' % (os.path.basename(url).replace('.nc', ''), uuid.uuid1())
+    if dir_output is None:
+        dir_output = os.path.abspath(os.curdir)
+    output = os.path.join(dir_output, prefix + '.nc')
+
+    src = open_dataset(url)
+    window = retry(get_index_window, src, variable=variable, bbox=bbox, time_range=time_range)
+    LOGGER.info('fetch %s with constraints %s' % (url, window))
+
+    def _index(var, dim_slice):
+        return tuple(dim_slice.get(d, window.get(d, slice(None))) for d in var.dimensions)
+
+    with Dataset(output, 'w', format='NETCDF4_CLASSIC') as dst:
+        dst.setncatts(dict((a, src.getncattr(a)) for a in src.ncattrs()))
+        for name, dim in src.dimensions.items():
+            length = len(dim)
+            if name in window:
+                length = len(range(*window[name].indices(length)))
+            dst.createDimension(name, None if dim.isunlimited() else length)
+
+        for name, var in src.variables.items():
+            out = dst.createVariable(name, var.dtype, var.dimensions,
+                                     fill_value=getattr(var, '_FillValue', None))
+            out.setncatts(dict((a, var.getncattr(a)) for a in var.ncattrs() if a != '_FillValue'))
+            # copy the values as sent by the server, without scaling
+            var.set_auto_maskandscale(False)
+            out.set_auto_maskandscale(False)
+
+            if var.ndim == 0:
+                out.assignValue(retry(var.getValue))
+                continue
+            tdim = var.dimensions[0]
+            if not src.dimensions[tdim].isunlimited() and tdim not in window:
+                out[:] = retry(var.__getitem__, _index(var, {}))
+                continue
+            # long series are requested in time chunks
+            start, stop, _ = window.get(tdim, slice(None)).indices(len(src.dimensions[tdim]))
+            for t in range(start, stop, TIME_CHUNK):
+                chunk = slice(t, min(t + TIME_CHUNK, stop))
+                values = retry(var.__getitem__, _index(var, {tdim: chunk}))
+                out[(slice(t - start, t - start + values.shape[0]),) + (slice(None),) * (var.ndim - 1)] = values
+    return output
+
+
+def get_bbox(geom):
+    """
+    returns the bounding box of geometries
+
+    :param geom: shapely geometry, list of geometries or of dictionaries with a 'geom' key \
+        (see subset.get_geometries), or bounding box [minx, miny, maxx, maxy]
+
+    :return list: [minx, miny, maxx, maxy], None if the geometries are not supported
+    """
+    if geom is None:
+        return None
+    if hasattr(geom, 'bounds'):
+        return list(geom.bounds)
+    if isinstance(geom, (list, tuple)):
+        if len(geom) == 4 and all(isinstance(v, (int, float)) for v in geom):
+            return list(geom)
+        bounds = [get_bbox(g['geom'] if isinstance(g, dict) else g) for g in geom]
+        if len(bounds) == 0 or None in bounds:
+            return None
+        bounds = np.array(bounds)
+        return [bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()]
+    return None
+
+
+def fetch_subsets(resource, variable=None, geom=None, select_ugid=None, time_range=None, dir_output=None):
+    """
+    replaces the remote datasets of a list of files by local subsets of the region and period of a request
+
+    :param resource: list of files and OPeNDAP URLs
+    :param variable: variable name (if not set, variable will be detected)
+    :param geom: geometries, see get_bbox, or name of a shapefile in the shape cabinet
+    :param select_ugid: ugids of the polygons of the shapefile
+    :param time_range: sequence of two datetime.datetime objects
+    :param dir_output: output directory (default= curdir)
+
+    :return list: local files
+    """
+    if type(resource) != list:
+        resource = [resource]
+    if not any(is_opendap(nc) for nc in resource):
+        return resource
+
+    if isinstance(geom, six.string_types):
+        if select_ugid is None:
+            # whole shapefile, no spatial constraint
+            geom = None
+        else:
+            from flyingpigeon.subset import get_geometries
+            geom = get_geometries(geom, select_ugid)
+    bbox = get_bbox(geom)
+
+    local = []
+    for nc in resource:
+        if is_opendap(nc):
+            nc = fetch_subset(nc, variable=variable, bbox=bbox, time_range=time_range, dir_output=dir_output)
+        local.append(nc)
+    return local
@@ -0,0 +1,119 @@
+"""
+Storage layouts of the netCDF output files.
+
+An output profile describes how the variables of an output file are chunked
+and compressed, according to how the file is read afterwards:
+
+* ``timeseries``: long time chunks over small spatial tiles, for reading the
+  series of single cells or small regions (point inspection, field means,
+  dissimilarity).
+* ``maps``: one chunk per time step covering the whole grid, for reading
+  maps.
+* ``archive``: compressed with zlib and the shuffle filter, for storage and
+  transfer.
+
+The profiles are applied by the writer creating the file. The files written
+by flyingpigeon (see masks.masked_subset) get the chunk sizes of each
+variable. ocgis passes the same createVariable options to all variables, so
+the outputs of ocgis_module.call get the compression of the profile and a
+time dimension that suits the layout, the chunk sizes being chosen by the
+netCDF library: one time step per chunk along an unlimited time dimension,
+chunks spanning the time axis along a fixed size one.
+"""
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# Chunk length along the time and the spatial (y, x) dimensions, None for the
+# full dimension, and compression settings of the profiles.
+OUTPUT_PROFILES = {
+    'timeseries': {'chunks': {'time': 2048, 'y': 16, 'x': 16}},
+    'maps': {'chunks': {'time': 1, 'y': None, 'x': None}},
+    'archive': {'compression': {'zlib': True, 'complevel': 4, 'shuffle': True}},
+}
+
+
+def get_profile(profile):
+    """
+    returns the settings of an output profile
+
+    :param profile: profile name, see OUTPUT_PROFILES
+
+    :return dict: chunks and compression settings
+    """
+    if profile not in OUTPUT_PROFILES:
+        raise Exception('unknown output profile %s, options are %s' % (profile, sorted(OUTPUT_PROFILES)))
+    return OUTPUT_PROFILES[profile]
+
+
+def output_format_options(profile):
+    """
+    returns the ocgis output_format_options of a profile, see module documentation
+
+    :param profile: profile name, see OUTPUT_PROFILES
+
+    :return dict: ocgis output_format_options
+    """
+    settings = get_profile(profile)
+    options = {'data_model': 'NETCDF4',
+               'variable_kwargs': dict(settings.get('compression', {}))}
+    chunks = settings.get('chunks')
+    if chunks is not None and chunks['time'] != 1:
+        options['unlimited_to_fixedsize'] = True
+    return options
+
+
+def chunksizes(profile, dimensions, shape, time_dimension='time'):
+    """
+    returns the chunk sizes of a variable for a profile
+
+    :param profile: profile name, see OUTPUT_PROFILES
+    :param dimensions: dimension names of the variable
+    :param shape: shape of the variable
+    :param time_dimension: name of the time dimension
+
+    :return tuple: chunk sizes, None if the profile does not set the chunking
+    """
+    chunks = get_profile(profile).get('chunks')
+    if chunks is None or len(dimensions) == 0:
+        return None
+
+    # the two last dimensions are spatial if time is not among them
+    spatial = {}
+    if len(dimensions) >= 2 and time_dimension not in dimensions[-2:]:
+        spatial = {dimensions[-2]: 'y', dimensions[-1]: 'x'}
+
+    sizes = []
+    for dim, length in zip(dimensions, shape):
+        length = max(length, 1)
+        if dim == time_dimension:
+            size = chunks['time']
+        elif dim in spatial:
+            size = chunks[spatial[dim]]
+        else:
+            size = length
+        sizes.append(length if size is None else min(size, length))
+    return tuple(sizes)
+
+
+def variable_kwargs(profile, dimensions, shape, time_dimension='time'):
+    """
+    returns the netCDF4 createVariable options of a variable for a profile
+
+    :param profile: profile name, see OUTPUT_PROFILES
+    :param dimensions: dimension names of the variable
+    :param shape: shape of the variable
+    :param time_dimension: name of the time dimension
+
+    :return dict: chunksizes and compression options
+    """
+    kwds = {}
+    if len(dimensions) == 0:
+        # scalar variables are neither chunked nor compressed
+        return kwds
+    kwds.update(get_profile(profile).get('compression', {}))
+    chunks = chunksizes(profile, dimensions, shape, time_dimension=time_dimension)
+    if chunks is not None:
+        kwds['chunksizes'] = chunks
+    return kwds
+
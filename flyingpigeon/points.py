@@ -0,0 +1,120 @@
+"""
+Extraction of time series at point locations.
+
+The grid cells nearest to all points are found together with a KD-tree built
+over the cell centers, and the series of all points are then read from the
+files in one pass, without running an ocgis operation per point.
+"""
+
+import numpy as np
+from netCDF4 import Dataset
+
+from flyingpigeon.masks import get_grid, TIME_CHUNK
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def _to_xyz(lats, lons):
+    """cartesian coordinates on the unit sphere"""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.column_stack([np.cos(lats) * np.cos(lons),
+                            np.cos(lats) * np.sin(lons),
+                            np.sin(lats)])
+
+
+def get_point_grid(resource, variable):
+    """
+    returns the latitudes and longitudes of the grid cell centers
+
+    :param resource: list of netCDF files of one dataset
+    :param variable: variable name
+
+    :return: 2D latitudes and longitudes (y, x)
+    """
+    if type(resource) != list:
+        resource = [resource]
+
+    with Dataset(resource[0]) as ds:
+        try:
+            lats, lons, rectilinear = get_grid(ds, variable)
+        except Exception:
+            lats = None
+
+    if lats is None:
+        from flyingpigeon.utils import unrotate_pole
+        LOGGER.info('no latitude and longitude found, unrotate the pole')
+        lats, lons = unrotate_pole(resource)
+        # 1D coordinates of a grid which is not rotated
+        rectilinear = np.ndim(lats) == 1
+
+    if rectilinear:
+        lats, lons = np.meshgrid(lats, lons, indexing='ij')
+    return np.asarray(lats), np.asarray(lons)
+
+
+def nearest_cells(lats, lons, points):
+    """
+    finds the grid cells nearest to points
+
+    :param lats: 2D latitudes of the cell centers
+    :param lons: 2D longitudes of the cell centers
+    :param points: list of (lon, lat) tuples
+
+    :return: row and column indices of the cells, one per point
+    """
+    from scipy.spatial import cKDTree
+
+    points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+    tree = cKDTree(_to_xyz(lats.ravel(), lons.ravel()))
+    _, index = tree.query(_to_xyz(points[:, 1], points[:, 0]))
+    return np.unravel_index(index, lats.shape)
+
+
+def extract_points(resource, points, variable=None, level=None):
+    """
+    extracts the time series of a dataset at the cells nearest to points
+
+    :param resource: list of netCDF files of one dataset, sorted in time
+    :param points: list of (lon, lat) tuples
+    :param variable: variable name (if not set, variable will be detected)
+    :param level: index or tuple of indices of the dimensions between time and the grid, \
+        e.g. the pressure level (default= all levels)
+
+    :return numpy.array: values (time, [levels,] point), nan for missing values
+    """
+    if type(resource) != list:
+        resource = [resource]
+    if variable is None:
+        from flyingpigeon.utils import get_variable
+        variable = get_variable(resource)
+
+    lats, lons = get_point_grid(resource, variable)
+    rows, cols = nearest_cells(lats, lons, points)
+    LOGGER.debug('points %s at cells %s' % (points, list(zip(rows, cols))))
+
+    # read the bounding rows and columns of the points only once, then
+    # pick the point cells from them
+    urows, irows = np.unique(rows, return_inverse=True)
+    ucols, icols = np.unique(cols, return_inverse=True)
+
+    series = []
+    for nc in resource:
+        with Dataset(nc) as ds:
+            var = ds.variables[variable]
+            nt = var.shape[0]
+            # additional dimensions between time and the grid, e.g. height
+            if level is None:
+                levels = [slice(None)] * (var.ndim - 3)
+            else:
+                levels = list(level) if isinstance(level, tuple) else [level]
+                if len(levels) != var.ndim - 3:
+                    raise Exception('%s has %s level dimensions, %s indices given' %
+                                    (variable, var.ndim - 3, len(levels)))
+            for start in range(0, nt, TIME_CHUNK):
+                stop = min(start + TIME_CHUNK, nt)
+                values = var[tuple([slice(start, stop)] + levels + [urows, ucols])]
+                values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+                series.append(values[..., irows, icols])
+    return np.concatenate(series)
@@ -68,7 +68,17 @@ class LandseamaskProcess(Process):
                          allowed_values=['land', 'sea'],
                          min_occurs=1,
                          max_occurs=1,
-                         )
+                         ),
+
+            LiteralInput("output_profile", "Output layout",
+                         data_type='string',
+                         abstract="Chunking and compression of the output files:"
+                                  " 'timeseries' for reading time series of single cells or regions,"
+                                  " 'maps' for reading maps, 'archive' for compressed files.",
+                         min_occurs=0,
+                         max_occurs=1,
+                         default='maps',
+                         allowed_values=['timeseries', 'maps', 'archive']),
         ]
 
         outputs = [
@@ -122,6 +132,12 @@ class LandseamaskProcess(Process):
         # land or sea flag
         land_area_flag = request.inputs['land_or_sea'][0].data == 'land'
 
+        # output layout
+        if 'output_profile' in request.inputs:
+            output_profile = request.inputs['output_profile'][0].data
+        else:
+            output_profile = 'maps'
+
         masked_datasets = []
         count = 0
         max_count = len(datasets)
@@ -135,7 +151,8 @@ class LandseamaskProcess(Process):
             LOGGER.info("using landsea_mask: %s", landsea_mask)
             prefix = 'masked_{}'.format(ds_name.replace('.nc', ''))
             try:
-                new_ds = masking(ds, landsea_mask, land_area=land_area_flag, prefix=prefix)
+                new_ds = masking(ds, landsea_mask, land_area=land_area_flag, prefix=prefix,
+                                 output_profile=output_profile)
                 masked_datasets.append(new_ds)
             except:
                 LOGGER.exception("Could not subset dataset.")
@@ -1,9 +1,8 @@
 from flyingpigeon.utils import archive, archiveextract
 from flyingpigeon.utils import rename_complexinputs
-from flyingpigeon.ocgis_module import call
-from flyingpigeon.utils import sort_by_filename, get_values, get_time
-from numpy import savetxt, column_stack
-from shapely.geometry import Point
+from flyingpigeon.points import extract_points
+from flyingpigeon.utils import sort_by_filename, get_time
+from numpy import savetxt, column_stack, indices
 
 from pywps import Process
 from pywps import LiteralInput
@@ -82,41 +81,38 @@ class PointinspectionProcess(Process):
 
         coords = []
         for coord in request.inputs['coords']:
-            coords.append(coord.data)
+            try:
+                p = coord.data.split(',')
+                coords.append((float(p[0]), float(p[1])))
+            except Exception as e:
+                LOGGER.debug('failed for point %s %s' % (coord.data, e))
 
         LOGGER.info("coords %s", coords)
         filenames = []
         nc_exp = sort_by_filename(ncs, historical_concatination=True)
 
+        columns = ['%s-%s' % (lon, lat) for lon, lat in coords]
         for key in nc_exp.keys():
             try:
                 LOGGER.info('start calculation for %s ' % key)
                 ncs = nc_exp[key]
+                response.update_status('processing {0} points for {1}'.format(len(coords), key), 20)
                 times = get_time(ncs)  # , format='%Y-%m-%d_%H:%M:%S')
-                concat_vals = times  # ['%s-%02d-%02d_%02d:%02d:%02d' %
-                # (t.year, t.month, t.day, t.hour, t.minute, t.second) for t in times]
-                header = 'date_time'
+                # all points are extracted together, in one read of the files
+                vals = extract_points(ncs, coords)
+                header = columns
+                if vals.ndim > 2:
+                    # one column per point and level
+                    levels = vals.shape[1:-1]
+                    vals = vals.reshape(vals.shape[0], -1)
+                    header = ['%s_level%s' % (column, '-'.join(str(i) for i in index))
+                              for index in zip(*[a.ravel() for a in indices(levels)])
+                              for column in columns]
+                header = ','.join(['date_time'] + header)
                 filename = '%s.csv' % key
+                savetxt(filename, column_stack([times, vals]), fmt='%s', delimiter=',', header=header)
                 filenames.append(filename)
-
-                for p in coords:
-                    try:
-                        response.update_status('processing point : {0}'.format(p), 20)
-                        # define the point:
-                        p = p.split(',')
-                        point = Point(float(p[0]), float(p[1]))
-
-                        # get the values
-                        timeseries = call(resource=ncs, geom=point, select_nearest=True)
-                        vals = get_values(timeseries)
-
-                        # concatenation of values
-                        header = header + ',%s-%s' % (p[0], p[1])
-                        concat_vals = column_stack([concat_vals, vals])
-                    except Exception as e:
-                        LOGGER.debug('failed for point %s %s' % (p, e))
                 response.update_status('*** all points processed for {0} ****'.format(key), 50)
-                savetxt(filename, concat_vals, fmt='%s', delimiter=',', header=header)
             except Exception as e:
                 LOGGER.debug('failed for %s %s' % (key, e))
 
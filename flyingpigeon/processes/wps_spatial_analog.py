@@ -4,6 +4,8 @@ Process for spatial analog calculations.
 Author: David Huard (huard.david@ouranos.ca),
 """
 
+from flyingpigeon import config
+from flyingpigeon.cache import ResultCache, make_key
 from flyingpigeon.log import init_process_logger
 from flyingpigeon.utils import archiveextract
 from flyingpigeon.utils import rename_complexinputs
@@ -59,10 +61,12 @@ class SpatialAnalogProcess(Process):
                          ]),
 
             LiteralInput('location', 'Target coordinates (lon,lat)',
-                         abstract="Geographical coordinates (lon,lat) of the target location.",
+                         abstract="Geographical coordinates (lon,lat) of the target location. "
+                                  "With multiple locations, the candidate data is processed "
+                                  "once and the output has a leading target dimension.",
                          data_type='string',
                          min_occurs=1,
-                         max_occurs=1,
+                         max_occurs=100,
                          ),
 
             LiteralInput('indices', 'Indices',
@@ -81,6 +85,21 @@ class SpatialAnalogProcess(Process):
                          allowed_values=metrics,
                          ),
 
+            LiteralInput('top_k', 'Number of best analogs',
+                         abstract="If larger than 0, only the given number of "
+                                  "cells most similar to the target are computed "
+                                  "and the other cells are left empty. All cells "
+                                  "are first ranked with the standardized euclidean "
+                                  "distance and the selected metric is evaluated on "
+                                  "the best ranked ones only, which is much faster "
+                                  "for the expensive metrics. Defaults to 0, the "
+                                  "full map.",
+                         data_type='integer',
+                         min_occurs=0,
+                         max_occurs=1,
+                         default=0,
+                         ),
+
             LiteralInput('dateStartCandidate', 'Candidate start date',
                          abstract="Beginning of period (YYYY-MM-DD) for candidate data. "
                                   "Defaults to first entry.",
@@ -170,9 +189,10 @@ class SpatialAnalogProcess(Process):
                 request.inputs['candidate']))
             target = archiveextract(resource=rename_complexinputs(
                 request.inputs['target']))
-            location = request.inputs['location'][0].data
+            locations = [el.data for el in request.inputs['location']]
             indices = [el.data for el in request.inputs['indices']]
             dist = request.inputs['dist'][0].data
+            top_k = request.inputs['top_k'][0].data
             dateStartCandidate = request.inputs['dateStartCandidate'][0].data
             dateEndCandidate = request.inputs['dateEndCandidate'][0].data
             dateStartTarget = request.inputs['dateStartTarget'][0].data
@@ -190,7 +210,8 @@ class SpatialAnalogProcess(Process):
         ######################################
 
         try:
-            point = Point(*map(float, location.split(',')))
+            points = [Point(*map(float, location.split(',')))
+                      for location in locations]
             dateStartCandidate = dt.strptime(dateStartCandidate, '%Y-%m-%d')
             dateEndCandidate = dt.strptime(dateEndCandidate, '%Y-%m-%d')
             dateStartTarget = dt.strptime(dateStartTarget, '%Y-%m-%d')
@@ -204,31 +225,46 @@ class SpatialAnalogProcess(Process):
         LOGGER.debug("init took {}".format(dt.now() - tic ) )
         response.update_status('Processed input parameters', 3)
 
+        ######################################
+        # Look for a previous identical request
+        ######################################
+        try:
+            cache = ResultCache(os.path.join(config.cache_path(), 'spatial_analog'),
+                                max_size=config.cache_max_size())
+            key = make_key({'candidate': candidate, 'target': target},
+                           locations=locations,
+                           indices=indices,
+                           dist=dist,
+                           top_k=top_k,
+                           candidate_time_range=(dateStartCandidate, dateEndCandidate),
+                           target_time_range=(dateStartTarget, dateEndTarget))
+            cached = cache.copy(key, 'spatial_analog_{}.nc'.format(key[:8]))
+        except Exception:
+            LOGGER.exception('Failed to query the result cache')
+            cache = None
+            cached = None
+
+        if cached is not None:
+            output = cached
+            response.outputs['output_netcdf'].file = output
+            response.update_status('Spatial analog found in cache', 100)
+            LOGGER.debug("Total execution took {}".format(dt.now() - tic))
+            return response
 
         ######################################
         # Extract target time series
         ######################################
-        savetarget=False
         try:
-            # Using `call` creates a netCDF file in the tmp directory.
-            #
-            # Here we keep this stuff in memory
-            if savetarget:
-                prefix = 'target_ts'
-                target_ts = call(resource=target, geom=point, variable=indices,
-                                 time_range=[dateStartTarget, dateEndTarget],
-                                 select_nearest=True, prefix=prefix)
-
-                #target_ts = [get_values(prefix+'.nc', ind) for ind in indices]
-
-            else:
-                trd = RequestDataset(target, variable=indices,
-                                     time_range=[dateStartTarget, dateEndTarget])
+            trd = RequestDataset(target, variable=indices,
+                                 time_range=[dateStartTarget, dateEndTarget])
 
-                op = OcgOperations(trd, geom=point, select_nearest=True,
-                                   search_radius_mult=1.75)
-                out = op.execute()
-                target_ts = out.get_element()
+            # All the target series are extracted at once, one
+            # container per location.
+            op = OcgOperations(trd, geom=points, select_nearest=True,
+                               search_radius_mult=1.75)
+            out = op.execute()
+            target_ts = [out.get_element(container_ugid=ugid)
+                         for ugid in out.children.keys()]
 
         except Exception as e:
             msg = 'Target extraction failed {}'.format(e)
@@ -244,10 +280,18 @@ class SpatialAnalogProcess(Process):
 
         response.update_status('Computing spatial analog', 6)
         try:
+            kwds = {'dist': dist, 'candidate': indices,
+                    'processes': config.max_workers()}
+            if len(target_ts) == 1:
+                kwds['target'] = target_ts[0]
+            else:
+                kwds['targets'] = tuple(target_ts)
+            if top_k > 0:
+                kwds['top_k'] = top_k
+
             output = call(resource=candidate,
                           calc=[{'func': 'dissimilarity', 'name': 'spatial_analog',
-                                 'kwds': {'dist': dist, 'target': target_ts,
-                                          'candidate': indices}}],
+                                 'kwds': kwds}],
                           time_range=[dateStartCandidate, dateEndCandidate],
                           )
 
@@ -259,8 +303,9 @@ class SpatialAnalogProcess(Process):
 
         add_metadata(output,
                      dist=dist,
+                     top_k=top_k,
                      indices=",".join(indices),
-                     target_location=location,
+                     target_location=";".join(locations),
                      candidate_time_range="{},{}".format(dateStartCandidate,
                                                          dateEndCandidate),
                      target_time_range="{},{}".format(dateStartTarget,
@@ -269,6 +314,12 @@ class SpatialAnalogProcess(Process):
 
         response.update_status('Computed spatial analog', 95)
 
+        if cache is not None:
+            try:
+                cache.put(key, output)
+            except Exception:
+                LOGGER.exception('Failed to store the result in cache')
+
         response.outputs['output_netcdf'].file = output
 
         response.update_status('Execution completed', 100)
@@ -1,5 +1,5 @@
 from flyingpigeon.subset import clipping
-from flyingpigeon.subset import _CONTINENTS_
+from flyingpigeon.subset import continents
 from flyingpigeon.log import init_process_logger
 from flyingpigeon.utils import archive, archiveextract
 from flyingpigeon.utils import rename_complexinputs
@@ -24,9 +24,9 @@ class ClipcontinentProcess(Process):
                          data_type='string',
                          abstract="Continent name.",
                          min_occurs=1,
-                         max_occurs=len(_CONTINENTS_),
+                         max_occurs=len(continents()),
                          default='Africa',
-                         allowed_values=_CONTINENTS_),  # REGION_EUROPE #COUNTRIES
+                         allowed_values=continents()),  # REGION_EUROPE #COUNTRIES
 
             LiteralInput('mosaic', 'Union of multiple regions',
                          data_type='boolean',
@@ -36,6 +36,16 @@ class ClipcontinentProcess(Process):
                          max_occurs=1,
                          default=False),
 
+            LiteralInput('output_profile', 'Output layout',
+                         data_type='string',
+                         abstract="Chunking and compression of the output files:"
+                                  " 'timeseries' for reading time series of single cells or regions,"
+                                  " 'maps' for reading maps, 'archive' for compressed files.",
+                         min_occurs=0,
+                         max_occurs=1,
+                         default='timeseries',
+                         allowed_values=['timeseries', 'maps', 'archive']),
+
             ComplexInput('resource', 'Resource',
                          abstract='NetCDF Files or archive (tar/zip) containing netCDF files.',
                          metadata=[Metadata('Info')],
@@ -101,6 +111,11 @@ class ClipcontinentProcess(Process):
             mosaic = request.inputs['mosaic'][0].data
         else:
             mosaic = False
+        # output layout
+        if 'output_profile' in request.inputs:
+            output_profile = request.inputs['output_profile'][0].data
+        else:
+            output_profile = 'timeseries'
         # regions used for subsetting
         regions = [inp.data for inp in request.inputs['region']]
 
@@ -117,6 +132,8 @@ class ClipcontinentProcess(Process):
                 polygons=regions,  # self.region.getValue(),
                 mosaic=mosaic,
                 spatial_wrapping='wrap',
+                mask_cache=True,
+                output_profile=output_profile,
                 # variable=variable,
                 # dir_output=os.path.abspath(os.curdir),
                 # dimension_map=dimension_map,
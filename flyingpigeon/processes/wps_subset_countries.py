@@ -38,6 +38,16 @@ class ClippingProcess(Process):
                          max_occurs=1,
                          default=False),
 
+            LiteralInput('output_profile', 'Output layout',
+                         data_type='string',
+                         abstract="Chunking and compression of the output files:"
+                                  " 'timeseries' for reading time series of single cells or regions,"
+                                  " 'maps' for reading maps, 'archive' for compressed files.",
+                         min_occurs=0,
+                         max_occurs=1,
+                         default='timeseries',
+                         allowed_values=['timeseries', 'maps', 'archive']),
+
             ComplexInput('resource', 'Resource',
                          abstract='NetCDF Files or archive (tar/zip) containing NetCDF files.',
                          metadata=[Metadata('Info')],
@@ -103,6 +113,11 @@ class ClippingProcess(Process):
             mosaic = request.inputs['mosaic'][0].data
         else:
             mosaic = False
+        # output layout
+        if 'output_profile' in request.inputs:
+            output_profile = request.inputs['output_profile'][0].data
+        else:
+            output_profile = 'timeseries'
         # regions used for subsetting
         regions = [inp.data for inp in request.inputs['region']]
 
@@ -119,6 +134,8 @@ class ClippingProcess(Process):
                 polygons=regions,  # self.region.getValue(),
                 mosaic=mosaic,
                 spatial_wrapping='wrap',
+                mask_cache=True,
+                output_profile=output_profile,
                 # variable=variable,
                 # dir_output=os.path.abspath(os.curdir),
                 # dimension_map=dimension_map,
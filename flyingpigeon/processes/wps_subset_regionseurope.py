@@ -1,6 +1,6 @@
 from flyingpigeon.subset import clipping
 # from flyingpigeon.subset import countries, countries_longname
-from flyingpigeon.subset import _EUREGIONS_
+from flyingpigeon.subset import regions_europe
 from flyingpigeon.log import init_process_logger
 from flyingpigeon.utils import archive, archiveextract
 from flyingpigeon.utils import rename_complexinputs
@@ -25,9 +25,9 @@ class ClipregionseuropeProcess(Process):
                          data_type='string',
                          abstract="European region code, see ISO-3166 Alpha2: https://en.wikipedia.org/wiki/ISO_3166-2 ",  # noqa
                          min_occurs=1,
-                         max_occurs=len(_EUREGIONS_),
+                         max_occurs=len(regions_europe()),
                          default='DE.HH',
-                         allowed_values=_EUREGIONS_),
+                         allowed_values=regions_europe()),
 
             LiteralInput('mosaic', 'Union of multiple regions',
                          data_type='boolean',
@@ -37,6 +37,16 @@ class ClipregionseuropeProcess(Process):
                          max_occurs=1,
                          default=False),
 
+            LiteralInput('output_profile', 'Output layout',
+                         data_type='string',
+                         abstract="Chunking and compression of the output files:"
+                                  " 'timeseries' for reading time series of single cells or regions,"
+                                  " 'maps' for reading maps, 'archive' for compressed files.",
+                         min_occurs=0,
+                         max_occurs=1,
+                         default='timeseries',
+                         allowed_values=['timeseries', 'maps', 'archive']),
+
             ComplexInput('resource', 'Resource',
                          abstract='NetCDF Files or archive (tar/zip) containing NetCDF files.',
                          min_occurs=1,
@@ -101,6 +111,11 @@ class ClipregionseuropeProcess(Process):
             mosaic = request.inputs['mosaic'][0].data
         else:
             mosaic = False
+        # output layout
+        if 'output_profile' in request.inputs:
+            output_profile = request.inputs['output_profile'][0].data
+        else:
+            output_profile = 'timeseries'
         # regions used for subsetting
         regions = [inp.data for inp in request.inputs['region']]
 
@@ -117,6 +132,8 @@ class ClipregionseuropeProcess(Process):
                 polygons=regions,  # self.region.getValue(),
                 mosaic=mosaic,
                 spatial_wrapping='wrap',
+                mask_cache=True,
+                output_profile=output_profile,
                 # variable=variable,
                 # dir_output=os.path.abspath(os.curdir),
                 # dimension_map=dimension_map,
@@ -1,5 +1,5 @@
-from cdo import Cdo
 from tempfile import mkstemp
+import json
 import os
 
 from flyingpigeon.utils import drs_filename, get_variable, calc_grouping, sort_by_filename
@@ -9,27 +9,64 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
+# Attribute columns stored in the polygon index of each shapefile.
+_INDEX_COLUMNS_ = {'countries': ['ADM0_A3', 'NAME_LONG', 'CONTINENT'],
+                   'continents': ['CONTINENT'],
+                   'extremoscope': ['HASC_1', 'NAME_1']}
+
+# Attribute column holding the polygon names used by get_ugid.
+_UGID_COLUMNS_ = {'countries': 'ADM0_A3',
+                  'extremoscope': 'HASC_1',
+                  'continents': 'CONTINENT'}
+
+# Polygon indices loaded in this process, by shapefile name.
+_POLYGON_INDEX_ = {}
+
+# Polygon name -> UGIDs dictionaries, by shapefile name.
+_UGID_LOOKUP_ = {}
+
+# Shapely geometries loaded in this process, by (shapefile name, UGID).
+_GEOMETRIES_ = {}
+
+
 def countries():
     """
     :return: a list of all country codes.
     """
-    countries = _COUNTRIES_.keys()
+    countries = get_shp_column_values(geom='countries', columnname='ADM0_A3')
     # countries = ['DEU', 'FRA', 'GBR', 'ESP', 'ITA']
-    countries.sort()
-    return countries
+    # a code can be shared by several polygons
+    return sorted(set(countries))
 
 
 def countries_longname():
     """
     :return: the long name of all countries.
     """
+    names = dict(zip(get_shp_column_values(geom='countries', columnname='ADM0_A3'),
+                     get_shp_column_values(geom='countries', columnname='NAME_LONG')))
     longname = ''
     for country in countries():
-        longname = longname + "%s : %s \n" % (country, _COUNTRIES_[country]['longname'])
+        longname = longname + "%s : %s \n" % (country, names[country])
     return longname
 
 
-def masking(resource, sftlf, threshold=50, land_area=True, prefix=None):
+def continents():
+    """
+    :return: a list of all continent names.
+    """
+    return sorted(set(get_shp_column_values(geom='continents', columnname='CONTINENT')))
+
+
+def regions_europe():
+    """
+    :return: a list of all European region codes (HASC_1).
+    """
+    regions = get_shp_column_values(geom='extremoscope', columnname='HASC_1')
+    return sorted(set(regions))
+
+
+def masking(resource, sftlf, threshold=50, land_area=True, prefix=None, output_profile=None):
     """
     Set land/sea areas to nan.
 
@@ -38,45 +75,113 @@ def masking(resource, sftlf, threshold=50, land_area=True, prefix=None):
     :param threshold: Percentage of land area
     :param land_area: If True (default), sea areas will set to nan
     :param prefix:  prefix for filename. If prefix is not set, a filename will be created
+    :param output_profile: chunking and compression of the output file, see flyingpigeon.output_profiles
 
     :returns str: path to netCDF file
     """
-    cdo = Cdo()
-    #######################
-    # TODO check sftlf unit
-    #######################
-    th = threshold / 100.0
-
-    ###################
-    # generate the mask
-    if land_area is True:
-        mask = cdo.gtc(th, input=sftlf, output='mask.nc')
-    else:
-        # TODO: check the operator ltc/stc
-        mask = cdo.ltc(th, input=sftlf, output='mask.nc')
+    from flyingpigeon.masks import get_landsea_mask, check_landsea_grid, masked_subset
+
+    # the mask is applied over the whole grid, which must be the grid of the land area fraction
+    variable = get_variable(resource)
+    check_landsea_grid(resource, variable, sftlf)
+    mask = get_landsea_mask(sftlf, threshold=threshold, land_area=land_area)
 
     # generate output filename
     if prefix is not None:
-        nc_masked = prefix + '.nc'
+        dir_output, prefix = os.path.split(os.path.abspath(prefix))
     else:
-        _, nc_masked = mkstemp(dir='.', suffix='.nc')
+        fd, nc_masked = mkstemp(dir='.', suffix='.nc')
+        os.close(fd)
+        dir_output, prefix = os.path.split(os.path.abspath(nc_masked[:-3]))
+
+    ny, nx = mask.shape
+    nc_masked = masked_subset(resource, variable, (slice(0, ny), slice(0, nx)),
+                              mask, prefix=prefix, dir_output=dir_output,
+                              output_profile=output_profile)
+    return nc_masked
 
-    #################
-    # divide by mask
 
-    _ = cdo.div(input=[resource, mask], output=nc_masked)
+def _clip_with_weights(job):
+    """
+    clips one dataset with the cached cell weights of the polygons (see flyingpigeon.masks)
 
-    return nc_masked
+    :param job: clipping job, see _clipping_job
+
+    :returns str: path to clipped file
+    """
+    from flyingpigeon.masks import get_weights, masked_subset
+
+    resource = job['resource']
+    if type(resource) != list:
+        resource = [resource]
+    resource = sorted(resource)
+
+    window, fraction = get_weights(resource[0], job['variable'], job['geom'], job['select_ugid'])
+    if not fraction.any():
+        raise Exception('polygons do not intersect the grid')
+    # the cells partly covered by the polygons are kept, as with ocgis
+    return masked_subset(resource, job['variable'], window, fraction > 0,
+                         prefix=job['prefix'], dir_output=job['dir_output'],
+                         output_profile=job['output_profile'],
+                         wrap_longitudes=job['spatial_wrapping'] == 'wrap')
+
+
+def _clipping_job(job):
+    """
+    clips one dataset with one (or a mosaic of) polygon(s). Runs in a worker process of clipping.
+
+    :param job: dictionary of call arguments, with the shapefile name (geom) and the ugids (select_ugid)
+
+    :returns tuple: (path to clipped file, None) or (None, error message)
+    """
+    from flyingpigeon.ocgis_module import call
+    from flyingpigeon.opendap import fetch_subsets
+
+    job = dict(job)
+    key = job.pop('key')
+    mask_cache = job.pop('mask_cache')
+    try:
+        # remote datasets: only the region and period of the request are fetched
+        job['resource'] = fetch_subsets(job['resource'], geom=job['geom'], select_ugid=job['select_ugid'],
+                                        time_range=job['time_range'], dir_output=job['dir_output'])
+
+        # if variable is None:
+        job['variable'] = get_variable(job['resource'])
+        LOGGER.info('variable %s detected in resource' % (job['variable']))
+
+        geom_file = None
+        # plain subsets are done with the cached cell weights if possible
+        if mask_cache and job['calc'] is None and job['output_format'] == 'nc' \
+                and job['time_range'] is None and job['time_region'] is None \
+                and job['spatial_wrapping'] in [None, 'wrap']:
+            try:
+                geom_file = _clip_with_weights(job)
+                LOGGER.info('clipping with cached cell weights done for %s ' % (key))
+                return geom_file, None
+            except Exception:
+                LOGGER.exception('clipping with cached cell weights failed for %s, using ocgis' % (key))
+
+        job['geom'] = get_geometries(job['geom'], job['select_ugid'])
+        geom_file = call(**job)
+        if geom_file is None:
+            raise Exception('ocgis call returned no file')
+        LOGGER.info('ocgis clipping done for %s ' % (key))
+        return geom_file, None
+    except Exception as e:
+        msg = 'ocgis clipping failed for %s: %s' % (key, e)
+        LOGGER.exception(msg)
+        return None, msg
 
 
 def clipping(resource=[], variable=None, dimension_map=None, calc=None, output_format='nc',
              calc_grouping=None, time_range=None, time_region=None,
              historical_concatination=True, prefix=None,
              spatial_wrapping='wrap', polygons=None, mosaic=False,
-             dir_output=None, memory_limit=None):
+             dir_output=None, memory_limit=None, processes=None, mask_cache=False,
+             output_profile=None):
     """ returns list of clipped netCDF files
 
-    :param resource: list of input netCDF files
+    :param resource: list of input netCDF files or OPeNDAP URLs
     :param variable: variable (string) to be used in netCDF
     :param dimesion_map: specify a dimension map if input netCDF has unconventional dimension
     :param calc: ocgis calculation argument
@@ -89,12 +194,15 @@ def clipping(resource=[], variable=None, dimension_map=None, calc=None, output_f
     :param dir_output: specify an output location
     :param time_range: [start, end] of time subset
     :param time_region: year, months or days to be extracted in the timeseries
+    :param processes: number of datasets clipped in parallel. Defaults to the max_workers configuration.
+    :param mask_cache: If True, subsets without calculation nor time selection are done by slicing and masking
+                       the data with cell weights cached per grid and polygons, instead of an ocgis operation.
+                       The longitudes are then kept as in the input files.
+    :param output_profile: chunking and compression of the output files, see flyingpigeon.output_profiles
 
-    :returns list: path to clipped files
+    :returns list: path to clipped files, in the order of the polygons and datasets
     """
-
-    from flyingpigeon.utils import get_variable, drs_filename
-    from flyingpigeon.ocgis_module import call
+    import multiprocessing
 
     if type(resource) != list:
         resource = list([resource])
@@ -103,10 +211,20 @@ def clipping(resource=[], variable=None, dimension_map=None, calc=None, output_f
     if prefix is not None:
         if type(prefix) != list:
             prefix = list([prefix])
+    if processes is None:
+        processes = config.max_workers()
+
+    options = dict(calc=calc, calc_grouping=calc_grouping, output_format=output_format,
+                   time_range=time_range, time_region=time_region,
+                   spatial_wrapping=spatial_wrapping, memory_limit=memory_limit,
+                   dir_output=dir_output, dimension_map=dimension_map, mask_cache=mask_cache,
+                   output_profile=output_profile)
 
     geoms = set()
     ncs = sort_by_filename(resource, historical_concatination=historical_concatination)  # historical_concatenation=True
-    geom_files = []
+
+    # one job per polygon (or mosaic) and dataset, in the order of the results
+    jobs = []
     if mosaic is True:
         try:
             nameadd = '_'
@@ -118,55 +236,47 @@ def clipping(resource=[], variable=None, dimension_map=None, calc=None, output_f
             else:
                 geom = geoms.pop()
             ugids = get_ugid(polygons=polygons, geom=geom)
-        except:
-            LOGGER.exception('geom identification failed')
-        for i, key in enumerate(ncs.keys()):
-            try:
-                # if variable is None:
-                variable = get_variable(ncs[key])
-                LOGGER.info('variable %s detected in resource' % (variable))
+            for i, key in enumerate(ncs.keys()):
                 if prefix is None:
                     name = key + nameadd
                 else:
                     name = prefix[i]
-                geom_file = call(resource=ncs[key], variable=variable, calc=calc, calc_grouping=calc_grouping,
-                                 output_format=output_format, prefix=name,
-                                 geom=geom, select_ugid=ugids, time_range=time_range,
-                                 time_region=time_region,
-                                 spatial_wrapping=spatial_wrapping, memory_limit=memory_limit,
-                                 dir_output=dir_output, dimension_map=dimension_map)
-                geom_files.append(geom_file)
-                LOGGER.info('ocgis mosaik clipping done for %s ' % (key))
-            except:
-                msg = 'ocgis mosaik clipping failed for %s ' % (key)
-                LOGGER.exception(msg)
+                jobs.append(dict(options, key=key, resource=ncs[key], prefix=name,
+                                 geom=geom, select_ugid=ugids))
+        except:
+            LOGGER.exception('geom identification failed')
     else:
         for i, polygon in enumerate(polygons):
             try:
                 geom = get_geom(polygon)
                 ugid = get_ugid(polygons=polygon, geom=geom)
                 for key in ncs.keys():
-                    try:
-                        # if variable is None:
-                        variable = get_variable(ncs[key])
-                        LOGGER.info('variable %s detected in resource' % (variable))
-                        if prefix is None:
-                            name = key + '_' + polygon.replace(' ', '')
-                        else:
-                            name = prefix[i]
-                        geom_file = call(resource=ncs[key], variable=variable, calc=calc, calc_grouping=calc_grouping,
-                                         output_format=output_format,
-                                         prefix=name, geom=geom, select_ugid=ugid, dir_output=dir_output,
-                                         dimension_map=dimension_map, spatial_wrapping=spatial_wrapping,
-                                         memory_limit=memory_limit, time_range=time_range, time_region=time_region,
-                                         )
-                        geom_files.append(geom_file)
-                        LOGGER.info('ocgis clipping done for %s ' % (key))
-                    except:
-                        msg = 'ocgis clipping failed for %s ' % (key)
-                        LOGGER.exception(msg)
+                    if prefix is None:
+                        name = key + '_' + polygon.replace(' ', '')
+                    else:
+                        name = prefix[i]
+                    jobs.append(dict(options, key=key, resource=ncs[key], prefix=name,
+                                     geom=geom, select_ugid=ugid))
             except:
                 LOGGER.exception('geom identification failed')
+
+    # worker processes can not be started from a daemonic process
+    processes = min(processes, len(jobs))
+    if processes > 1 and not multiprocessing.current_process().daemon:
+        LOGGER.info('clipping %s datasets with %s processes' % (len(jobs), processes))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_clipping_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_clipping_job(job) for job in jobs]
+
+    geom_files = [geom_file for geom_file, _ in results if geom_file is not None]
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        LOGGER.error('%s of %s clipping jobs failed: %s' % (len(errors), len(jobs), errors))
     return geom_files
 
 
@@ -222,6 +332,69 @@ def get_dimension_map(resource):
 # return dimension_map
 
 
+def _build_polygon_index(geom):
+    """ reads a shapefile once and returns its polygon index records, see get_polygon_index """
+    from ocgis import env, ShpCabinetIterator
+
+    env.DIR_SHPCABINET = config.shapefiles_path()
+    columns = _INDEX_COLUMNS_.get(geom, [])
+
+    records = []
+    for offset, row in enumerate(ShpCabinetIterator(geom)):
+        properties = row['properties']
+        records.append({'UGID': properties['UGID'],
+                        'bbox': list(row['geom'].bounds),
+                        'offset': offset,
+                        'properties': dict((c, properties[c]) for c in columns)})
+    return records
+
+
+def get_polygon_index(geom):
+    """ returns the index of the polygons of a shapefile.
+    The index is built on first use and persisted in the cache directory, so that later
+    processes do not need to read the shapefile. It is rebuilt when the shapefile is modified.
+
+    :param geom: name of the shapefile
+
+    :returns list: one dictionary per polygon with the UGID, the bounding box (bbox),
+                   the position of the geometry in the shapefile (offset) and the
+                   identifying attributes (properties)
+    """
+    mtime = os.path.getmtime(os.path.join(config.shapefiles_path(), geom + '.shp'))
+    index = _POLYGON_INDEX_.get(geom)
+    if index is not None and index['mtime'] == mtime:
+        return index['records']
+
+    filename = os.path.join(config.cache_path(), 'polygons', geom + '.json')
+    try:
+        with open(filename) as fp:
+            index = json.load(fp)
+        if index['mtime'] != mtime:
+            index = None
+    except (IOError, ValueError, KeyError, TypeError):
+        index = None
+
+    if index is None:
+        LOGGER.info('build polygon index for shapefile %s', geom)
+        index = {'mtime': mtime, 'records': _build_polygon_index(geom)}
+        try:
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            fd, tmp = mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+            os.close(fd)
+            with open(tmp, 'w') as fp:
+                json.dump(index, fp)
+            os.rename(tmp, filename)
+        except Exception:
+            LOGGER.exception('failed to store the polygon index of %s', geom)
+
+    _POLYGON_INDEX_[geom] = index
+    # geometries loaded from a previous version of the shapefile
+    for key in [k for k in _GEOMETRIES_ if k[0] == geom]:
+        del _GEOMETRIES_[key]
+    return index['records']
+
+
 def get_shp_column_values(geom, columnname):
     """ returns a list of all entries the shapefile column name
 
@@ -230,6 +403,9 @@ def get_shp_column_values(geom, columnname):
 
     returns list: column names
     """
+    if columnname in _INDEX_COLUMNS_.get(geom, []):
+        return [record['properties'][columnname] for record in get_polygon_index(geom)]
+
     from ocgis import env, ShpCabinetIterator
     # import ocgis
 
@@ -242,6 +418,20 @@ def get_shp_column_values(geom, columnname):
     return vals
 
 
+def _ugid_lookup(geom):
+    """ returns the dictionary polygon name -> list of UGIDs of a shapefile """
+    records = get_polygon_index(geom)
+    lookup = _UGID_LOOKUP_.get(geom)
+    if lookup is None or lookup[0] is not records:
+        column = _UGID_COLUMNS_[geom]
+        ugids = {}
+        for record in records:
+            ugids.setdefault(record['properties'][column], []).append(record['UGID'])
+        lookup = (records, ugids)
+        _UGID_LOOKUP_[geom] = lookup
+    return lookup[1]
+
+
 def get_ugid(polygons=None, geom=None):
     """
     returns geometry id of given polygon in a given shapefile.
@@ -251,36 +441,18 @@ def get_ugid(polygons=None, geom=None):
 
     :returns list: ugids used by ocgis
     """
-    from ocgis import env, ShpCabinetIterator
-    # from ocgis import env
-
     if polygons is None:
         result = None
     else:
         if type(polygons) != list:
             polygons = list([polygons])
 
-        env.DIR_SHPCABINET = config.shapefiles_path()
-        sc_iter = ShpCabinetIterator(geom)
         result = []
-
-        if geom == 'countries':
-            for row in sc_iter:
-                for polygon in polygons:
-                    if row['properties']['ADM0_A3'] == polygon:
-                        result.append(row['properties']['UGID'])
-
-        elif geom == 'extremoscope':
-            for row in sc_iter:
-                for polygon in polygons:
-                    if row['properties']['HASC_1'] == polygon:
-                        result.append(row['properties']['UGID'])
-
-        elif geom == 'continents':
-            for row in sc_iter:
-                for polygon in polygons:
-                    if row['properties']['CONTINENT'] == polygon:
-                        result.append(row['properties']['UGID'])
+        if geom in _UGID_COLUMNS_:
+            lookup = _ugid_lookup(geom)
+            for polygon in polygons:
+                result.extend(lookup.get(polygon, []))
+            result.sort()
         else:
             from ocgis import ShpCabinet
             sc = ShpCabinet(config.shapefiles_path())
@@ -288,6 +460,33 @@ def get_ugid(polygons=None, geom=None):
     return result
 
 
+def get_geometries(geom, ugids):
+    """
+    returns the geometries of the given polygons of a shapefile, in a form accepted by ocgis as geom argument.
+    Geometries are read once per process and reused for later calls.
+
+    :param geom: name of the shapefile
+    :param ugids: list of ugids, see get_ugid
+
+    :returns list: dictionaries with the shapely geometry (geom), the UGID (properties) and the crs
+    """
+    from ocgis import crs
+
+    missing = [ugid for ugid in ugids if (geom, ugid) not in _GEOMETRIES_]
+    if missing:
+        import fiona
+        from shapely.geometry import shape
+
+        offsets = dict((record['UGID'], record['offset']) for record in get_polygon_index(geom))
+        with fiona.open(os.path.join(config.shapefiles_path(), geom + '.shp')) as src:
+            for ugid in missing:
+                _GEOMETRIES_[(geom, ugid)] = shape(src[offsets[ugid]]['geometry'])
+
+    return [{'geom': _GEOMETRIES_[(geom, ugid)],
+             'properties': {'UGID': ugid},
+             'crs': crs.WGS84()} for ugid in ugids]
+
+
 def get_geom(polygon=None):
     """ returns the approriate shapefile (geom) for a given polygon abbreviation
 
@@ -299,42 +498,12 @@ def get_geom(polygon=None):
     if polygon is None:
         geom = None
     else:
-        if polygon in _COUNTRIES_:  # (polygon) == 3:
+        if polygon in _ugid_lookup('countries'):  # (polygon) == 3:
             geom = 'countries'
-        elif polygon in _POLYGONS_EXTREMOSCOPE_:  # len(polygon) == 5 and polygon[2] == '.':
+        elif polygon in _ugid_lookup('extremoscope'):  # len(polygon) == 5 and polygon[2] == '.':
             geom = 'extremoscope'
-        elif polygon in _EUREGIONS_:
-            geom = 'extremoscope'
-        elif polygon in _CONTINENTS_:
+        elif polygon in _ugid_lookup('continents'):
             geom = 'continents'
         else:
             LOGGER.debug('polygon: %s not found in geoms' % polygon)
     return geom
-
-# === Available Polygons
-_CONTINENTS_ = get_shp_column_values(geom='continents', columnname='CONTINENT')
-
-_COUNTRIES_ = {}
-_COUNTRIES_Europe_ = {}
-
-# === popultate polygons dictionaties
-ADM0_A3 = get_shp_column_values(geom='countries', columnname='ADM0_A3')
-NAMELONG = get_shp_column_values(geom='countries', columnname='NAME_LONG')
-CONTINENT = get_shp_column_values(geom='countries', columnname='CONTINENT')
-
-for c, key in enumerate(ADM0_A3):
-    _COUNTRIES_[key] = dict(longname=NAMELONG[c])
-
-for c, key in enumerate(ADM0_A3):
-    if CONTINENT[c] == 'Europe':
-        _COUNTRIES_Europe_[key] = dict(longname=NAMELONG[c])
-
-_EUREGIONS_ = {}
-
-HASC_1 = get_shp_column_values(geom='extremoscope', columnname='HASC_1')
-NAME_1 = get_shp_column_values(geom='extremoscope', columnname='NAME_1')
-
-_POLYGONS_EXTREMOSCOPE_ = HASC_1
-
-for c, key in enumerate(HASC_1):
-    _EUREGIONS_[key] = dict(longname=NAME_1[c])
@@ -0,0 +1,64 @@
+import pytest
+
+import numpy as np
+from netCDF4 import Dataset
+
+from flyingpigeon.aggregation import Aggregation
+
+
+def _write(filename, year, fmt='NETCDF4'):
+    with Dataset(filename, 'w', format=fmt) as ds:
+        ds.frequency = 'mon'
+        ds.createDimension('time', None)
+        ds.createDimension('lat', 2)
+        ds.createDimension('lon', 3)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since %s-01-01' % year
+        time.calendar = '360_day'
+        time[:] = np.arange(12) * 30 + 15
+        ds.createVariable('lat', 'f8', ('lat',))[:] = [10, 20]
+        ds.createVariable('lon', 'f8', ('lon',))[:] = [0, 10, 20]
+        tas = ds.createVariable('tas', 'f4', ('time', 'lat', 'lon'))
+        tas.units = 'K'
+        tas[:] = (year * 100 + np.arange(12)).reshape(12, 1, 1) + np.zeros((12, 2, 3))
+    return filename
+
+
+def test_aggregation(tmpdir):
+    ncs = [_write(str(tmpdir.join('tas_2000.nc')), 2000),
+           _write(str(tmpdir.join('tas_2001.nc')), 2001, 'NETCDF3_CLASSIC'),
+           _write(str(tmpdir.join('tas_2002.nc')), 2002)]
+
+    with Aggregation(ncs, pool_size=1) as ds:
+        assert list(ds.offsets) == [0, 12, 24]
+        assert ds.frequency == 'mon'
+
+        tas = ds.variables['tas']
+        assert tas.shape == (36, 2, 3)
+        assert tas.units == 'K'
+        assert tas[:].shape == (36, 2, 3)
+        assert tas[11:13, 0, 0].tolist() == [200011, 200100]
+        assert tas[-1, 1, 2] == 200211
+        assert tas[[25, 0, 13], 0, 0].tolist() == [200201, 200000, 200101]
+        assert tas[::12, ..., 0].shape == (3, 2)
+        assert tas[5:5].shape == (0, 2, 3)
+        assert len(ds._handles) == 1
+
+        # time values in the units of the first file
+        time = ds.variables['time'][:]
+        assert time[12] == 360 + 15
+        assert np.all(np.diff(time) == 30)
+        assert ds.variables['lon'][:].tolist() == [0, 10, 20]
+
+        with pytest.raises(IndexError):
+            tas[36]
+
+
+def test_aggregation_order(tmpdir):
+    ncs = [_write(str(tmpdir.join('tas_2001.nc')), 2001),
+           _write(str(tmpdir.join('tas_2000.nc')), 2000)]
+
+    # the files are aggregated in the given order, as with MFDataset
+    with Aggregation(ncs) as ds:
+        assert ds.files == ncs
+        assert ds.variables['tas'][0, 0, 0] == 200100
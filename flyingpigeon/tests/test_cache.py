@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+from flyingpigeon.cache import ResultCache, make_key
+
+
+def _write(path, content):
+    with open(path, 'w') as fp:
+        fp.write(content)
+    return path
+
+
+def test_make_key():
+    tmp = tempfile.mkdtemp()
+    a = _write(os.path.join(tmp, 'a.nc'), 'a')
+    b = _write(os.path.join(tmp, 'b.nc'), 'b')
+
+    assert make_key({'candidate': [a], 'target': [b]}, dist='kldiv') != \
+        make_key({'candidate': [b], 'target': [a]}, dist='kldiv')
+    assert make_key({'candidate': [a, b]}) != make_key({'candidate': [b, a]})
+    assert make_key({'candidate': [a]}, dist='kldiv') == make_key({'candidate': [a]}, dist='kldiv')
+    assert make_key({'candidate': [a]}, dist='kldiv') != make_key({'candidate': [b]}, dist='kldiv')
+    assert make_key({'candidate': [a]}, dist='kldiv') != make_key({'candidate': [a]}, dist='seuclidean')
+
+    # A rewritten file gives another key.
+    key = make_key({'candidate': [a]})
+    _write(a, 'aa')
+    assert make_key({'candidate': [a]}) != key
+
+
+def test_result_cache():
+    tmp = tempfile.mkdtemp()
+    cache = ResultCache(os.path.join(tmp, 'cache'), max_size=25)
+    assert cache.get('k1') is None
+
+    for i in range(3):
+        nc = _write(os.path.join(tmp, 'out%d.nc' % i), '%d' % i * 10)
+        cached = cache.put('k%d' % i, nc)
+        assert open(cached).read() == open(nc).read()
+        os.utime(cached, (i, i))
+
+    # k0 is the least recently used entry and is evicted first.
+    assert cache.get('k0') is None
+    assert cache.get('k1') is not None
+    assert cache.get('k2') is not None
+
+    out = os.path.join(tmp, 'copy.nc')
+    assert cache.copy('k2', out) == out
+    assert open(out).read() == '2' * 10
+    assert cache.copy('k0', out) is None
+    assert cache.copy('k2', os.path.join(tmp, 'missing', 'copy.nc')) is None
@@ -0,0 +1,33 @@
+import pytest
+
+import numpy as np
+from netCDF4 import num2date
+
+from flyingpigeon import calendars
+
+
+@pytest.mark.parametrize('calendar', ['standard', 'proleptic_gregorian', 'noleap', 'all_leap',
+                                      '360_day', 'julian'])
+def test_components(calendar):
+    units = 'hours since 1950-03-01 06:00:00'
+    values = np.arange(0, 150 * 365 * 24, 7.5)
+
+    dates = calendars.components(calendars.decode(values, units, calendar), calendar)
+    expected = [[d.year, d.month, d.day, d.hour, d.minute, d.second]
+                for d in num2date(values, units, calendar)]
+    np.testing.assert_array_equal(dates, expected)
+
+
+def test_decode():
+    ordinals = calendars.decode([0, 1, 2], 'days since 2000-02-29', '360_day')
+    assert list(np.diff(ordinals)) == [86400, 86400]
+    np.testing.assert_array_equal(calendars.components(ordinals, '360_day')[:, :3],
+                                  [[2000, 2, 29], [2000, 2, 30], [2000, 3, 1]])
+
+    dates = calendars.to_datetime64(calendars.decode([0, 36], 'hours since 2000-01-01', 'gregorian'))
+    assert str(dates[1]) == '2000-01-02T12:00:00'
+
+    with pytest.raises(Exception):
+        calendars.parse_units('months since 2000-01-01')
+    with pytest.raises(Exception):
+        calendars.get_calendar_name('lunar')
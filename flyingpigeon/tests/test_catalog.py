@@ -0,0 +1,103 @@
+import pytest
+from collections import OrderedDict
+
+import numpy as np
+from netCDF4 import Dataset
+
+from flyingpigeon import catalog
+from flyingpigeon import config
+
+
+def _write(filename, start=0):
+    with Dataset(filename, 'w') as ds:
+        ds.project_id = 'CMIP5'
+        ds.frequency = 'day'
+        ds.createDimension('time', None)
+        ds.createDimension('lat', 3)
+        ds.createDimension('lon', 4)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 2000-01-01'
+        time.calendar = '360_day'
+        time[:] = np.arange(start, start + 360)
+        lat = ds.createVariable('lat', 'f8', ('lat',))
+        lat.units = 'degrees_north'
+        lat[:] = [10, 20, 30]
+        lon = ds.createVariable('lon', 'f8', ('lon',))
+        lon.units = 'degrees_east'
+        lon[:] = [0, 10, 20, 30]
+        ds.createVariable('tas', 'f4', ('time', 'lat', 'lon'))
+    return filename
+
+
+def test_read_header(tmpdir):
+    header = catalog.read_header(_write(str(tmpdir.join('tas.nc'))))
+    assert header['attributes']['frequency'] == 'day'
+    assert header['dimensions']['time'] == [360, True]
+    assert header['variables']['tas']['dimensions'] == ['time', 'lat', 'lon']
+    assert header['time']['calendar'] == '360_day'
+    assert header['time']['start'][:3] == [2000, 1, 1]
+    assert header['time']['end'][:3] == [2000, 12, 30]
+    assert header['time']['step'] == 1.
+    assert header['variable'] == 'tas'
+
+
+def test_detect_variable(tmpdir):
+    nc = str(tmpdir.join('tas.nc'))
+    with Dataset(nc, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('bnds', 2)
+        ds.createDimension('rlat', 3)
+        ds.createDimension('rlon', 4)
+        ds.createVariable('time', 'f8', ('time',)).bounds = 'time_bnds'
+        ds.createVariable('time_bnds', 'f8', ('time', 'bnds'))
+        ds.createVariable('rotated_pole', 'c', ())
+        for name in ['lat', 'lon']:
+            ds.createVariable(name, 'f8', ('rlat', 'rlon'))
+        ds.createVariable('orog', 'f4', ('rlat', 'rlon')).coordinates = 'lat lon'
+        tas = ds.createVariable('tas', 'f4', ('time', 'rlat', 'rlon'))
+        tas.coordinates = 'lat lon'
+        tas.grid_mapping = 'rotated_pole'
+
+    with Dataset(nc) as ds:
+        assert catalog.detect_variable(ds) == 'tas'
+
+
+def test_get_headers(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'cache_path', lambda: str(tmpdir.join('cache')))
+    ncs = [_write(str(tmpdir.join('tas_%d.nc' % i)), start=360 * i) for i in range(2)]
+
+    headers = catalog.get_headers(ncs)
+    assert [h['time']['start'][0] for h in headers] == [2000, 2001]
+    assert headers[0]['variable'] == 'tas'
+    assert tmpdir.join('cache', 'catalog.sqlite').check()
+
+    # the headers are read from the database in a new process
+    monkeypatch.setattr(catalog, '_HEADERS_', OrderedDict())
+    monkeypatch.setattr(catalog, 'read_header', None)
+    assert catalog.get_headers(ncs) == headers
+    assert all(type(name) == str for name in catalog.get_header(ncs[0])['variables'])
+
+
+def test_headers_size(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'cache_path', lambda: str(tmpdir.join('cache')))
+    monkeypatch.setattr(catalog, '_HEADERS_', OrderedDict())
+    monkeypatch.setattr(catalog, 'HEADERS_SIZE', 1)
+    ncs = [_write(str(tmpdir.join('tas_%d.nc' % i)), start=360 * i) for i in range(2)]
+
+    assert len(catalog.get_headers(ncs)) == 2
+    assert len(catalog._HEADERS_) == 1
+
+
+def test_read_time_counter(tmpdir):
+    nc = str(tmpdir.join('tas.nc'))
+    with Dataset(nc, 'w') as ds:
+        ds.createDimension('time_counter', None)
+        time = ds.createVariable('time_counter', 'f8', ('time_counter',))
+        time.units = 'days since 2000-01-01'
+        time.axis = 'T'
+        time[:] = np.arange(10)
+        ds.createVariable('tas', 'f4', ('time_counter',))
+
+    header = catalog.read_header(nc)
+    assert header['time']['name'] == 'time_counter'
+    assert header['time']['end'][:3] == [2000, 1, 10]
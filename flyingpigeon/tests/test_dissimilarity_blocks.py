@@ -0,0 +1,227 @@
+import pytest
+
+from flyingpigeon import dissimilarity as dd
+import numpy as np
+from numpy.testing import assert_equal as aeq, assert_almost_equal as aaeq
+from scipy import spatial
+
+from .test_dissimilarity import matlab_sample
+
+
+class TestSR():
+    def test_simple(self):
+        np.random.seed(7)
+        x = np.random.randn(100, 2)
+        y = np.random.randn(80, 2)
+
+        assert dd.szekely_rizzo(x, x + .001) < dd.szekely_rizzo(x, y)
+        assert dd.szekely_rizzo(x, y) < dd.szekely_rizzo(x, y + 1)
+
+    def test_against_full_matrices(self):
+        x, y = matlab_sample()
+        nx, ny = len(x), len(y)
+        v = x.std(0, ddof=1) * y.std(0, ddof=1)
+
+        dx = spatial.distance.cdist(x, x, 'seuclidean', V=v)
+        dy = spatial.distance.cdist(y, y, 'seuclidean', V=v)
+        dxy = spatial.distance.cdist(x, y, 'seuclidean', V=v)
+        z = 2. * dxy.mean() - dx.mean() - dy.mean()
+
+        aaeq(dd.szekely_rizzo(x, y), z * nx * ny / (nx + ny))
+
+
+class TestDistanceSums():
+    def test_blocks(self):
+        np.random.seed(8)
+        x = np.random.randn(50, 3)
+        y = np.random.randn(40, 3)
+        v = np.array([1., 2., 3.])
+
+        d = spatial.distance.pdist(x, 'seuclidean', V=v)
+        aaeq(dd.distance_sums(x, v=v, block_size=7), (np.log(d).sum(), d.sum()))
+
+        d = spatial.distance.cdist(x, y, 'seuclidean', V=v)
+        aaeq(dd.distance_sums(x, y, v=v, block_size=7),
+             (np.log(d).sum(), d.sum()))
+
+
+class TestFR():
+    def test_sparse_mst(self):
+        np.random.seed(6)
+        for n, d in [(50, 1), (200, 2), (300, 3)]:
+            xy = np.random.randn(n, d)
+            xy[:n // 4] += 5
+            sparse = dd.minimum_spanning_tree_edges(xy, k=3)
+            dense = dd._dense_mst_edges(xy)
+            assert set(map(tuple, np.sort(sparse, 1))) == \
+                set(map(tuple, np.sort(dense, 1)))
+
+    def test_duplicates(self):
+        # With duplicated points, the tree is not unique: the statistic must
+        # not depend on the graph used to build it.
+        np.random.seed(7)
+        for i in range(20):
+            x = np.random.randint(0, 4, (60, 2)).astype(float)
+            y = np.vstack([x[:10], np.random.randint(0, 4, (40, 2))])
+            xy = np.vstack([x, y])
+
+            dense = dd._dense_mst_edges(xy)
+            sparse = dd.minimum_spanning_tree_edges(xy, k=3)
+            assert set(map(tuple, np.sort(sparse, 1))) == \
+                set(map(tuple, np.sort(dense, 1)))
+
+            diff = np.logical_xor(*(dense < len(x)).T).sum()
+            aeq(dd.friedman_rafsky(x, y), 1. - (1. + diff) / len(xy))
+
+
+class TestKS():
+    def test_quadrant_fractions(self):
+        def brute_force(p, s):
+            mf = (2 ** np.arange(p.shape[1])).reshape(1, -1, 1)
+            i = ((p.T <= np.atleast_3d(s)) * mf).sum(1)
+            return 1. * np.apply_along_axis(np.bincount, 0, i,
+                                            minlength=2 ** p.shape[1]) / len(s)
+
+        np.random.seed(9)
+        for d in range(1, 5):
+            p = np.random.randn(40, d)
+            s = np.random.randn(30, d)
+            aeq(dd._quadrant_fractions(p, s), brute_force(p, s))
+
+            # Ties
+            p = np.random.randint(0, 3, (40, d))
+            s = np.vstack([np.random.randint(0, 3, (30, d)), p[:5]])
+            aeq(dd._quadrant_fractions(p, s), brute_force(p, s))
+
+
+class TestPrepare():
+    def test_against_metrics(self):
+        np.random.seed(4)
+        x = np.random.randn(30, 3)
+        ys = [np.random.randn(25, 3) + i for i in range(3)]
+
+        for dist in dd.__all__:
+            metric = dd.prepare(dist, x)
+            for y in ys:
+                aaeq(metric(y), getattr(dd, dist)(x, y))
+
+    def test_kldiv_k(self):
+        x, y = matlab_sample()
+        metric = dd.prepare('kldiv', x, k=[1, 2])
+        aaeq(metric(y), dd.kldiv(x, y, k=[1, 2]))
+
+    def test_unknown(self):
+        with pytest.raises(ValueError):
+            dd.prepare('unknown', np.ones((10, 2)))
+
+
+class TestDissimilarityMap():
+    def test_against_loop(self):
+        np.random.seed(3)
+        x = np.random.randn(30, 2)
+        cube = np.random.randn(3, 4, 25, 2) + .5
+        cube[0, 0, :3, 1] = np.nan
+        cube[1, 2, :22] = np.nan
+
+        for dist in dd.__all__:
+            dm = dd.dissimilarity_map(x, cube, dist, block_size=5)
+            assert dm.shape == (3, 4)
+            assert np.isnan(dm[1, 2])
+
+            y = cube[0, 0, 3:]
+            aaeq(dm[0, 0], getattr(dd, dist)(x, y))
+            aaeq(dm[2, 3], getattr(dd, dist)(x, cube[2, 3]))
+
+    def test_processes(self):
+        np.random.seed(5)
+        x = np.random.randn(30, 2)
+        cube = np.random.randn(6, 5, 20, 2)
+
+        for dist in ['seuclidean', 'kldiv']:
+            serial = dd.dissimilarity_map(x, cube, dist, block_size=7)
+            parallel = dd.dissimilarity_map(x, cube, dist, block_size=7,
+                                            processes=3)
+            aeq(parallel, serial)
+
+    def test_tiles(self):
+        # A grid smaller than a block is split across the workers.
+        tiles = dd._tile_slices(10, dd.BLOCK_SIZE, 4)
+        assert len(tiles) == 4
+        aeq(np.concatenate([np.arange(10)[t] for t in tiles]), np.arange(10))
+        assert len(dd._tile_slices(10, dd.BLOCK_SIZE, 1)) == 1
+        assert len(dd._tile_slices(40000, dd.BLOCK_SIZE, 16)) == 16
+
+    def test_processes_small_grid(self):
+        np.random.seed(9)
+        x = np.random.randn(30, 2)
+        cells = np.random.randn(12, 20, 2)
+        valid = np.ones((12, 20), bool)
+
+        # The prepared metric arguments reach the worker processes.
+        metrics = [dd.prepare('kldiv', x, k=3)]
+        serial = dd._compute_cells(metrics, cells, valid, 5, dd.BLOCK_SIZE, 1)
+        parallel = dd._compute_cells(metrics, cells, valid, 5, dd.BLOCK_SIZE, 3)
+        aeq(parallel, serial)
+        aaeq(serial[0, 0], dd.kldiv(x, cells[0], k=3))
+
+    def test_multiple_targets(self):
+        np.random.seed(6)
+        xs = [np.random.randn(30, 2), np.random.randn(25, 2) + 1]
+        cube = np.random.randn(4, 5, 20, 2)
+        cube[3, 4, :18] = np.nan
+
+        for dist in ['seuclidean', 'kolmogorov_smirnov']:
+            dm = dd.dissimilarity_maps(xs, cube, dist, block_size=6)
+            assert dm.shape == (2, 4, 5)
+            for j, x in enumerate(xs):
+                aeq(dm[j], dd.dissimilarity_map(x, cube, dist))
+
+            parallel = dd.dissimilarity_maps(xs, cube, dist, block_size=6,
+                                             processes=2)
+            aeq(parallel, dm)
+
+    def test_top_k(self):
+        np.random.seed(7)
+        x = np.random.randn(30, 2)
+        cube = np.random.randn(8, 5, 20, 2) + np.random.rand(8, 5, 1, 2) * 3
+        cube[0, 0] = np.nan
+
+        for dist in ['seuclidean', 'zech_aslan']:
+            full = dd.dissimilarity_map(x, cube, dist)
+            top = dd.dissimilarity_map(x, cube, dist, top_k=5)
+            assert top.shape == (8, 5)
+            assert np.isfinite(top).sum() == 5
+            aeq(top[np.isfinite(top)], full[np.isfinite(top)])
+
+        # With a screen covering every cell, the result is exact.
+        full = dd.dissimilarity_map(x, cube, 'kldiv').ravel()
+        index, values = dd.top_k_cells(x, cube.reshape(-1, 20, 2), 'kldiv',
+                                       5, screen=8)
+        aeq(index, np.argsort(np.where(np.isnan(full), np.inf, full))[:5])
+        aeq(values, full[index])
+
+    def test_candidate_cube(self):
+        np.random.seed(8)
+        tx = np.ma.masked_invalid(np.random.randn(20, 4, 5))
+        pr = np.random.randn(20, 4, 5).astype(np.float32)
+        tx[:3, 1, 1] = np.ma.masked
+        pr[5, 2, 2] = np.nan
+
+        cube, valid = dd.candidate_cube([tx, pr], axis=0)
+        assert cube.shape == (4, 5, 20, 2)
+        assert cube.dtype == np.float64
+        assert valid.sum() == 4 * 5 * 20 - 4
+        aeq(valid, np.isfinite(cube).all(-1))
+
+        cube32, _ = dd.candidate_cube([tx, pr], axis=0, dtype=np.float32,
+                                      memmap_size=0)
+        assert isinstance(cube32, np.memmap)
+        assert cube32.dtype == np.float32
+
+        x = np.random.randn(30, 2)
+        for dist in ['seuclidean', 'zech_aslan']:
+            dm = dd.dissimilarity_map(x, cube, dist, valid=valid)
+            aeq(dm, dd.dissimilarity_map(x, cube, dist))
+            dm32 = dd.dissimilarity_map(x, cube32, dist, valid=valid,
+                                        dtype=np.float32)
+            np.testing.assert_allclose(dm32, dm, rtol=1e-4)
@@ -0,0 +1,120 @@
+import pytest
+
+import numpy as np
+from shapely.geometry import box
+
+from flyingpigeon import masks
+
+
+def test_grid_fingerprint():
+    lats, lons = np.arange(10.), np.arange(20.)
+    assert masks.grid_fingerprint(lats, lons) == masks.grid_fingerprint(lats.astype(np.float32), lons)
+    assert masks.grid_fingerprint(lats, lons) != masks.grid_fingerprint(lats, lons + 1)
+
+
+def test_compute_fractions():
+    lats = np.arange(30.5, 60, 1.)
+    lons = np.arange(0.5, 360, 1.)
+    polygon = box(-4.5, 40.25, 4.5, 49.75)
+
+    fractions = masks.compute_fractions(lats, lons, True, polygon)
+    np.testing.assert_almost_equal(fractions.sum(), polygon.area)
+    assert fractions.max() == 1.
+    assert set(np.flatnonzero(fractions.any(0))) == set(range(5)) | set(range(355, 360))
+
+    la, lo = np.meshgrid(lats, lons, indexing='ij')
+    centers = masks.compute_fractions(la, lo, False, box(-4, 40, 4, 50))
+    assert centers.sum() == 8 * 10
+
+
+
+def test_get_window():
+    lats = np.arange(30.5, 60, 1.)
+    lons = np.arange(0.5, 360, 1.)
+    fractions = masks.compute_fractions(lats, lons, True, box(-4.5, 40.25, 4.5, 49.75))
+
+    # the window crosses the seam of the global grid
+    ywindow, xwindow = masks.get_window(fractions, cyclic=True)
+    assert ywindow == slice(10, 20)
+    assert xwindow == [slice(355, 360), slice(0, 5)]
+    assert masks.get_window(fractions)[1] == [slice(0, 360)]
+
+    fractions = masks.compute_fractions(lats, lons, True, box(10.5, 40.25, 20.5, 49.75))
+    assert masks.get_window(fractions, cyclic=True)[1] == [slice(10, 21)]
+
+
+def test_masked_subset(tmpdir):
+    from netCDF4 import Dataset
+
+    nc = str(tmpdir.join('tas.nc'))
+    with Dataset(nc, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('lat', 2)
+        ds.createDimension('lon', 8)
+        ds.createVariable('time', 'f8', ('time',))[:] = [0, 1]
+        ds.createVariable('lat', 'f8', ('lat',))[:] = [0, 45]
+        lon = ds.createVariable('lon', 'f8', ('lon',))
+        lon.units = 'degrees_east'
+        lon[:] = np.arange(0, 360, 45.)
+        ds.createVariable('tas', 'f4', ('time', 'lat', 'lon'))[:] = np.arange(32).reshape(2, 2, 8)
+
+    keep = np.array([[True, True, True], [False, True, True]])
+    output = masks.masked_subset([nc], 'tas', (slice(0, 2), [slice(7, 8), slice(0, 2)]), keep,
+                                 dir_output=str(tmpdir), wrap_longitudes=True)
+    with Dataset(output) as ds:
+        assert ds.variables['lon'][:].tolist() == [-45, 0, 45]
+        tas = ds.variables['tas'][:]
+        assert tas[1, 0].tolist() == [23, 16, 17]
+        assert tas.mask[:, 1, 0].all()
+        assert tas[0, 1, 1:].tolist() == [8, 9]
+
+    # no partial output file is left when the subset fails
+    bad = str(tmpdir.join('bad.nc'))
+    with Dataset(bad, 'w') as ds:
+        ds.createDimension('lat', 2)
+    with pytest.raises(KeyError):
+        masks.masked_subset([nc, bad], 'tas', (slice(0, 2), slice(0, 8)), np.ones((2, 8)),
+                            prefix='failed', dir_output=str(tmpdir))
+    assert not tmpdir.join('failed.nc').check()
+
+
+def test_landsea_mask(tmpdir):
+    from netCDF4 import Dataset
+
+    sftlf = str(tmpdir.join('sftlf.nc'))
+    with Dataset(sftlf, 'w') as ds:
+        ds.createDimension('lat', 2)
+        ds.createDimension('lon', 3)
+        var = ds.createVariable('sftlf', 'f4', ('lat', 'lon'))
+        var.units = '%'
+        var[:] = [[0, 40, 60], [100, 50, 0]]
+
+    land = masks.get_landsea_mask(sftlf, threshold=50, land_area=True)
+    np.testing.assert_array_equal(land, [[False, False, True], [True, False, False]])
+    sea = masks.get_landsea_mask(sftlf, threshold=50, land_area=False)
+    np.testing.assert_array_equal(sea, [[True, True, False], [False, False, True]])
+    assert masks.get_landsea_mask(sftlf, threshold=50, land_area=True) is land
+
+
+def test_check_landsea_grid(tmpdir):
+    from netCDF4 import Dataset
+
+    def _write(filename, variable, lats, lons):
+        with Dataset(filename, 'w') as ds:
+            ds.createDimension('lat', len(lats))
+            ds.createDimension('lon', len(lons))
+            lat = ds.createVariable('lat', 'f8', ('lat',))
+            lat.units = 'degrees_north'
+            lat[:] = lats
+            lon = ds.createVariable('lon', 'f8', ('lon',))
+            lon.units = 'degrees_east'
+            lon[:] = lons
+            ds.createVariable(variable, 'f4', ('lat', 'lon'))[:] = 0
+        return filename
+
+    tas = _write(str(tmpdir.join('tas.nc')), 'tas', [0, 1], [0, 1, 2])
+    masks.check_landsea_grid(tas, 'tas', _write(str(tmpdir.join('sftlf.nc')), 'sftlf', [0, 1], [0, 1, 2]))
+    with pytest.raises(Exception):
+        masks.check_landsea_grid(tas, 'tas', _write(str(tmpdir.join('sftlf2.nc')), 'sftlf', [0, 1], [0, 1]))
+    with pytest.raises(Exception):
+        masks.check_landsea_grid(tas, 'tas', _write(str(tmpdir.join('sftlf3.nc')), 'sftlf', [5, 6], [0, 1, 2]))
@@ -1,4 +1,5 @@
 import pytest
+import os
 
 from .common import TESTDATA
 
@@ -24,3 +25,35 @@ def test_has_Lambert_Conformal():
 
 def test_gdal():
     from flyingpigeon.subset import clipping
+
+
+class _Ops(object):
+    """Stands for OcgOperations in the memory estimate."""
+    def get_base_request_size(self):
+        return {'field': {'tas': {'time': {'shape': (3650,), 'kb': 28.5},
+                                  'tas': {'shape': (3650, 100, 200), 'kb': 3650 * 100 * 200 * 4 / 1024.}}},
+                'total': 3650 * 100 * 200 * 4 / 1024. + 28.5}
+
+
+def test_get_tile_dimension():
+    ops = _Ops()
+    assert ocgis_module.get_tile_dimension(ops, memory_limit=1024.) is None
+    tile_dim = ocgis_module.get_tile_dimension(ops, memory_limit=100.)
+    assert tile_dim ** 2 * 3650 * 4 <= 100. * 1024 * 1024
+    assert (tile_dim + 1) ** 2 * 3650 * 4 > 100. * 1024 * 1024
+
+
+def test_calc_supports_tiling():
+    assert ocgis_module.calc_supports_tiling(None)
+    assert ocgis_module.calc_supports_tiling('tas=tas*1')
+
+
+def test_regrid_weights_reused():
+    resource = local_path(TESTDATA['cmip5_tasmax_2006_nc'])
+    weights = ocgis_module.get_regrid_weights(resource, 'r36x18', regrid_options='bil')
+    mtime = os.path.getmtime(weights)
+
+    other = local_path(TESTDATA['cmip5_tasmax_2007_nc'])
+    assert ocgis_module.get_regrid_weights(other, 'r36x18', regrid_options='bil') == weights
+    assert os.path.getmtime(weights) == mtime
+    assert ocgis_module.get_regrid_weights(other, 'r36x18', regrid_options='nn') != weights
@@ -0,0 +1,70 @@
+import pytest
+
+import datetime
+import numpy as np
+from netCDF4 import Dataset
+
+from flyingpigeon import opendap
+
+
+def _write(filename):
+    with Dataset(filename, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('lat', 90)
+        ds.createDimension('lon', 180)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 2000-01-01'
+        time.calendar = '365_day'
+        time[:] = np.arange(730)
+        lat = ds.createVariable('lat', 'f8', ('lat',))
+        lat.units = 'degrees_north'
+        lat[:] = np.arange(-89., 90., 2.)
+        lon = ds.createVariable('lon', 'f8', ('lon',))
+        lon.units = 'degrees_east'
+        lon[:] = np.arange(1., 360., 2.)
+        tas = ds.createVariable('tas', 'f4', ('time', 'lat', 'lon'))
+        tas[:] = np.arange(730)[:, None, None] + np.zeros((90, 180))
+    return filename
+
+
+def test_is_opendap():
+    assert opendap.is_opendap('https://esgf.example.org/thredds/dodsC/tas.nc')
+    assert not opendap.is_opendap('/tmp/tas.nc')
+
+
+def test_retry(monkeypatch):
+    monkeypatch.setattr(opendap, 'BACKOFF', 0)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise IOError('connection reset')
+        return 'ok'
+
+    assert opendap.retry(flaky) == 'ok'
+    assert len(calls) == 3
+
+
+def test_get_bbox():
+    from shapely.geometry import box
+    assert opendap.get_bbox([{'geom': box(0, 40, 10, 50)}, {'geom': box(-5, 45, 5, 55)}]) == [-5, 40, 10, 55]
+    assert opendap.get_bbox(None) is None
+
+
+def test_fetch_subset(tmpdir):
+    nc = _write(str(tmpdir.join('tas.nc')))
+    time_range = [datetime.datetime(2001, 1, 1), datetime.datetime(2001, 1, 31)]
+
+    with Dataset(nc) as ds:
+        window = opendap.get_index_window(ds, 'tas', bbox=[-10, 40, 20, 50], time_range=time_range)
+    assert window['time'] == slice(365, 396)
+    assert window['lat'] == slice(63, 72)
+
+    subset = opendap.fetch_subset(nc, 'tas', bbox=[10, 40, 20, 50], time_range=time_range,
+                                  dir_output=str(tmpdir))
+    with Dataset(subset) as ds:
+        assert ds.variables['tas'].shape == (31, 9, 9)
+        assert ds.variables['lon'][0] < 10 < 20 < ds.variables['lon'][-1]
+        np.testing.assert_array_equal(ds.variables['tas'][:, 0, 0], np.arange(365, 396))
+    opendap.close_pool()
@@ -0,0 +1,39 @@
+import pytest
+
+from netCDF4 import Dataset
+
+from flyingpigeon import output_profiles
+
+
+def test_chunksizes():
+    dims, shape = ('time', 'lat', 'lon'), (36500, 100, 200)
+    assert output_profiles.chunksizes('timeseries', dims, shape) == (2048, 16, 16)
+    assert output_profiles.chunksizes('maps', dims, shape) == (1, 100, 200)
+    assert output_profiles.chunksizes('archive', dims, shape) is None
+    assert output_profiles.chunksizes('timeseries', ('time', 'bnds'), (12, 2)) == (12, 2)
+
+    with pytest.raises(Exception):
+        output_profiles.get_profile('unknown')
+
+
+def test_output_format_options():
+    options = output_profiles.output_format_options('timeseries')
+    assert options['variable_kwargs'] == {}
+    assert options['unlimited_to_fixedsize']
+    assert 'unlimited_to_fixedsize' not in output_profiles.output_format_options('maps')
+    assert output_profiles.output_format_options('archive')['variable_kwargs']['zlib']
+
+
+def test_variable_kwargs(tmpdir):
+    nc = str(tmpdir.join('tas.nc'))
+    dims, shape = ('time', 'lat', 'lon'), (30, 40, 50)
+    with Dataset(nc, 'w', format='NETCDF4_CLASSIC') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('lat', 40)
+        ds.createDimension('lon', 50)
+        ds.createVariable('tas', 'f4', dims, **output_profiles.variable_kwargs('timeseries', dims, shape))
+        ds.createVariable('tasmax', 'f4', dims, **output_profiles.variable_kwargs('archive', dims, shape))
+
+    with Dataset(nc) as ds:
+        assert ds.variables['tas'].chunking() == [30, 16, 16]
+        assert ds.variables['tasmax'].filters()['zlib']
@@ -0,0 +1,89 @@
+import pytest
+
+import numpy as np
+from netCDF4 import Dataset
+
+from flyingpigeon import points
+
+
+def _write(filename, time, curvilinear=False):
+    lats, lons = np.arange(40., 50.), np.arange(0., 20.)
+    with Dataset(filename, 'w') as ds:
+        ds.createDimension('time', None)
+        t = ds.createVariable('time', 'f8', ('time',))
+        t[:] = time
+        if curvilinear:
+            ds.createDimension('y', len(lats))
+            ds.createDimension('x', len(lons))
+            la, lo = np.meshgrid(lats, lons, indexing='ij')
+            lat = ds.createVariable('lat', 'f8', ('y', 'x'))
+            lat.units = 'degrees_north'
+            lat[:] = la
+            lon = ds.createVariable('lon', 'f8', ('y', 'x'))
+            lon.units = 'degrees_east'
+            lon[:] = lo
+            tas = ds.createVariable('tas', 'f4', ('time', 'y', 'x'))
+            tas.coordinates = 'lat lon'
+        else:
+            ds.createDimension('lat', len(lats))
+            ds.createDimension('lon', len(lons))
+            lat = ds.createVariable('lat', 'f8', ('lat',))
+            lat.units = 'degrees_north'
+            lat[:] = lats
+            lon = ds.createVariable('lon', 'f8', ('lon',))
+            lon.units = 'degrees_east'
+            lon[:] = lons
+            tas = ds.createVariable('tas', 'f4', ('time', 'lat', 'lon'))
+        # value = time * 1000 + row * 100 + column
+        tas[:] = np.asarray(time)[:, None, None] * 1000 + \
+            np.arange(len(lats))[:, None] * 100 + np.arange(len(lons))
+    return filename
+
+
+@pytest.mark.parametrize('curvilinear', [False, True])
+def test_extract_points(tmpdir, curvilinear):
+    ncs = [_write(str(tmpdir.join('tas_%d.nc' % i)), range(3 * i, 3 * i + 3), curvilinear)
+           for i in range(2)]
+    coords = [(2.2, 48.3), (13.4, 42.4), (359.9, 40.1)]
+
+    vals = points.extract_points(ncs, coords, variable='tas')
+    assert vals.shape == (6, 3)
+    np.testing.assert_array_equal(vals[0], [802, 213, 0])
+    np.testing.assert_array_equal(vals[:, 1], np.arange(6) * 1000 + 213)
+
+
+def test_extract_points_levels(tmpdir):
+    nc = str(tmpdir.join('ta.nc'))
+    with Dataset(nc, 'w') as ds:
+        for name, size in [('time', None), ('plev', 2), ('lat', 3), ('lon', 4)]:
+            ds.createDimension(name, size)
+        lat = ds.createVariable('lat', 'f8', ('lat',))
+        lat.units = 'degrees_north'
+        lat[:] = [40, 41, 42]
+        lon = ds.createVariable('lon', 'f8', ('lon',))
+        lon.units = 'degrees_east'
+        lon[:] = [0, 1, 2, 3]
+        ds.createVariable('ta', 'f4', ('time', 'plev', 'lat', 'lon'))[:] = np.arange(48).reshape(2, 2, 3, 4)
+
+    coords = [(1, 40), (3, 42)]
+    vals = points.extract_points(nc, coords, variable='ta')
+    assert vals.shape == (2, 2, 2)
+    np.testing.assert_array_equal(vals[1], [[25, 35], [37, 47]])
+
+    vals = points.extract_points(nc, coords, variable='ta', level=1)
+    np.testing.assert_array_equal(vals, [[13, 23], [37, 47]])
+
+
+def test_get_point_grid_unrotated(tmpdir, monkeypatch):
+    from flyingpigeon import utils
+
+    def get_grid(ds, variable):
+        raise Exception('no latitude and longitude')
+
+    # the grid of the unrotated pole may be given as 1D coordinates
+    monkeypatch.setattr(points, 'get_grid', get_grid)
+    monkeypatch.setattr(utils, 'unrotate_pole', lambda resource: (np.arange(40., 50.), np.arange(0., 20.)))
+    lats, lons = points.get_point_grid(_write(str(tmpdir.join('tas.nc')), range(3)), 'tas')
+    assert lats.shape == lons.shape == (10, 20)
+    rows, cols = points.nearest_cells(lats, lons, [(13.4, 42.4)])
+    assert (rows.tolist(), cols.tolist()) == ([2], [13])
@@ -0,0 +1,60 @@
+import pytest
+
+import os
+import tempfile
+
+from .common import TESTDATA
+
+from flyingpigeon import config
+from flyingpigeon import subset
+from flyingpigeon.utils import local_path
+
+
+def test_polygon_index():
+    records = subset.get_polygon_index('countries')
+    assert len(set(r['properties']['ADM0_A3'] for r in records)) == len(subset.countries())
+    assert os.path.isfile(os.path.join(config.cache_path(), 'polygons', 'countries.json'))
+
+    deu = [r for r in records if r['properties']['ADM0_A3'] == 'DEU'][0]
+    minx, miny, maxx, maxy = deu['bbox']
+    assert minx < 10 < maxx
+    assert miny < 50 < maxy
+
+
+def test_regions_europe():
+    regions = subset.regions_europe()
+    assert regions == sorted(set(regions))
+    assert 'DE.HH' in regions
+
+
+def test_get_geom():
+    assert subset.get_geom('DEU') == 'countries'
+    assert subset.get_geom('DE.HH') == 'extremoscope'
+    assert subset.get_geom('Africa') == 'continents'
+
+
+def test_get_ugid():
+    ugids = subset.get_ugid(polygons=['FRA', 'DEU'], geom='countries')
+    assert len(ugids) == 2
+    assert ugids == sorted(ugids)
+    assert subset.get_ugid(polygons='XXX', geom='countries') == []
+
+
+def test_get_geometries():
+    ugids = subset.get_ugid(polygons='DEU', geom='countries')
+    geoms = subset.get_geometries('countries', ugids)
+    assert geoms[0]['properties']['UGID'] == ugids[0]
+    assert geoms[0]['geom'].contains(geoms[0]['geom'].representative_point())
+    # the same geometry object is reused
+    assert subset.get_geometries('countries', ugids)[0]['geom'] is geoms[0]['geom']
+
+
+def test_clipping_processes():
+    ncs = [local_path(TESTDATA['cmip5_tasmax_2006_nc'])]
+    polygons = ['FRA', 'DEU', 'ITA']
+    serial = subset.clipping(resource=ncs, polygons=polygons, processes=1,
+                             dir_output=tempfile.mkdtemp())
+    parallel = subset.clipping(resource=ncs, polygons=polygons, processes=3,
+                               dir_output=tempfile.mkdtemp())
+    assert len(serial) == 3
+    assert [os.path.basename(f) for f in parallel] == [os.path.basename(f) for f in serial]
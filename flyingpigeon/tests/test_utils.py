@@ -6,7 +6,8 @@ import os.path
 import tempfile
 import tarfile
 import zipfile
-from netCDF4 import Dataset
+from datetime import datetime as dt
+from netCDF4 import Dataset, date2num
 
 from flyingpigeon import utils
 from flyingpigeon.utils import local_path
@@ -69,6 +70,24 @@ def test_get_time():
     assert 23 == len(values)
 
 
+def test_get_time_360_day(tmpdir):
+    nc = str(tmpdir.join('tas_360_day.nc'))
+    with Dataset(nc, 'w') as ds:
+        ds.createDimension('time', None)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 2000-01-01 00:00:00'
+        time.calendar = '360_day'
+        # 2000-02-28, 2000-02-29, 2000-02-30, 2000-03-01
+        time[:] = [57, 58, 59, 60]
+
+    timestamps = utils.get_time(nc)
+    assert timestamps[:2] == [dt(2000, 2, 28), dt(2000, 2, 29)]
+    assert type(timestamps[0]) == dt
+    assert type(timestamps[2]) != dt
+    assert (timestamps[2].year, timestamps[2].month, timestamps[2].day) == (2000, 2, 30)
+    assert timestamps[3] == dt(2000, 3, 1)
+
+
 def test_unrotate_pole():
     ncs = [local_path(TESTDATA['cordex_tasmax_2006_nc']),
            local_path(TESTDATA['cordex_tasmax_2007_nc'])]
@@ -113,6 +132,57 @@ def test_sort_by_time():
     assert '200601' in result[0]
     assert '200701' in result[1]
 
+
+def test_sort_by_filename():
+    result = utils.sort_by_filename([local_path(TESTDATA['cmip5_tasmax_2007_nc']),
+                                     local_path(TESTDATA['cmip5_tasmax_2006_nc'])])
+    assert list(result.keys()) == ['tasmax_Amon_MPI-ESM-MR_rcp45_r1i1p1_20060116-20071216']
+    files = result['tasmax_Amon_MPI-ESM-MR_rcp45_r1i1p1_20060116-20071216']
+    assert '200601' in files[0]
+    assert '200701' in files[1]
+
+
+def test_sort_by_filename_historical(tmpdir):
+    ncs = []
+    for name in ['tas_day_MOD_historical_r1i1p1_20040101-20051231.nc',
+                 'tas_day_MOD_rcp60_r1i1p1_20060101-20101231.nc',
+                 'tas_day_MOD_rcp85_r1i1p1_20060101-20101231.nc',
+                 'tas_day_MOD_rcp85_r1i1p1_20110101-20151231.nc',
+                 'tas_day_MOD_rcp85_r2i1p1_20060101-20101231.nc']:
+        ncs.append(str(tmpdir.join(name)))
+        with Dataset(ncs[-1], 'w') as ds:
+            ds.createDimension('time', None)
+            time = ds.createVariable('time', 'f8', ('time',))
+            time.units = 'days since 2000-01-01'
+            time[:] = date2num([dt.strptime(d, '%Y%m%d') for d in name[-20:-3].split('-')], time.units)
+            ds.createVariable('tas', 'f4', ('time',))
+
+    result = utils.sort_by_filename(ncs)
+    assert len(result) == 4
+    assert len(result['tas_day_MOD_rcp85_r1i1p1_20060101-20151231']) == 2
+
+    result = utils.sort_by_filename(ncs, historical_concatination=True)
+    assert sorted(result.keys()) == ['tas_day_MOD_rcp60_r1i1p1_20040101-20101231',
+                                     'tas_day_MOD_rcp85_r1i1p1_20040101-20151231',
+                                     'tas_day_MOD_rcp85_r2i1p1_20060101-20101231']
+    files = result['tas_day_MOD_rcp85_r1i1p1_20040101-20151231']
+    assert len(files) == 3
+    assert 'historical' in files[0]
+
+
+def test_sort_by_filename_without_time(tmpdir):
+    ncs = []
+    for name in ['tas_day_MOD_rcp85_r1i1p1_20060101-20101231.nc',
+                 'tas_day_MOD_rcp85_r1i1p1_20110101-20151231.nc']:
+        ncs.append(str(tmpdir.join(name)))
+        with Dataset(ncs[-1], 'w') as ds:
+            ds.createDimension('time', None)
+            ds.createVariable('tas', 'f4', ('time',))
+
+    # no time axis in the headers, the time range is the one of the file names
+    result = utils.sort_by_filename(ncs)
+    assert list(result.keys()) == ['tas_day_MOD_rcp85_r1i1p1_20060101-20151231']
+
 # def test_get_timestamps():
 #     start,end = utils.get_timestamps(local_path(TESTDATA['cmip5_tasmax_2006_nc']))
 #     assert "20060116" == start
@@ -121,7 +121,7 @@ class TestDissimilarity(TestBase):
                                                                         p4]]
         candidate = ocgis.MultiRequestDataset(can)
 
-        fig, axes = plt.subplots(2, 3)
+        fig, axes = plt.subplots(2, 4)
         for i, dist in enumerate(dissimilarity.__all__):
 
             calc = [{'func': 'dissimilarity',
@@ -1,18 +1,20 @@
 import six
 import urlparse
 import os
+import re
 import requests
 import shutil
 from datetime import datetime as dt
 import time
-from ocgis import RequestDataset  # does not support NETCDF4
 from netCDF4 import Dataset, num2date
-from netCDF4 import MFDataset  # does not support NETCDF4
 
 from pyesgf.search.connection import SearchConnection
 from pyesgf.search import TYPE_FILE
 
 from flyingpigeon import config
+from flyingpigeon import calendars
+from flyingpigeon.aggregation import Aggregation
+from flyingpigeon.catalog import get_header, get_headers
 
 import logging
 LOGGER = logging.getLogger("PYWPS")
@@ -20,6 +22,9 @@ LOGGER = logging.getLogger("PYWPS")
 GROUPING = ["day", "mon", "sem", "yr", "ONDJFM", "AMJJAS", "DJF", "MAM", "JJA", "SON",
             "Jan", 'Feb', "Mar", "Apr", "May", "Jun", 'Jul', "Aug", 'Sep', 'Oct', 'Nov', 'Dec']
 
+# Decoded time axes, by (path, size, mtime), see get_time_axis.
+_TIME_AXES_ = {}
+
 ATTRIBUTE_TO_FACETS_MAP = dict(
     project_id='project',
     experiment='experiment',
@@ -355,7 +360,7 @@ def drs_filename(resource, skip_timestamp=False, skip_format=False,
     from os import path, rename
 
     try:
-        ds = Dataset(resource)
+        attrs = get_header(resource)['attributes']
         if variable is None:
             variable = get_variable(resource)
         # CORDEX example: EUR-11_ICHEC-EC-EARTH_historical_r3i1p1_DMI-HIRHAM5_v1_day
@@ -363,27 +368,26 @@ def drs_filename(resource, skip_timestamp=False, skip_format=False,
         # CMIP5 example: tas_MPI-ESM-LR_historical_r1i1p1
         cmip5_pattern = "{variable}_{model}_{experiment}_{ensemble}"
         filename = resource
-        if ds.project_id == 'CORDEX' or ds.project_id == 'EOBS':
+        if attrs['project_id'] == 'CORDEX' or attrs['project_id'] == 'EOBS':
             filename = cordex_pattern.format(
                 variable=variable,
-                domain=ds.CORDEX_domain,
-                driving_model=ds.driving_model_id,
-                experiment=ds.experiment_id,
-                ensemble=ds.driving_model_ensemble_member,
-                model=ds.model_id,
-                version=ds.rcm_version_id,
-                frequency=ds.frequency)
-        elif ds.project_id == 'CMIP5':
+                domain=attrs['CORDEX_domain'],
+                driving_model=attrs['driving_model_id'],
+                experiment=attrs['experiment_id'],
+                ensemble=attrs['driving_model_ensemble_member'],
+                model=attrs['model_id'],
+                version=attrs['rcm_version_id'],
+                frequency=attrs['frequency'])
+        elif attrs['project_id'] == 'CMIP5':
             # TODO: attributes missing in netcdf file for name generation?
             filename = cmip5_pattern.format(
                 variable=variable,
-                model=ds.model_id,
-                experiment=ds.experiment,
-                ensemble=ds.parent_experiment_rip
+                model=attrs['model_id'],
+                experiment=attrs['experiment'],
+                ensemble=attrs['parent_experiment_rip']
             )
         else:
-            raise Exception('unknown project %s' % ds.project_id)
-        ds.close()
+            raise Exception('unknown project %s' % attrs['project_id'])
     except Exception:
         LOGGER.exception('Could not read metadata %s', resource)
     try:
@@ -416,8 +420,7 @@ def drs_filename(resource, skip_timestamp=False, skip_format=False,
 def has_variable(resource, variable):
     success = False
     try:
-        rd = RequestDataset(uri=resource)
-        success = rd.variable == variable
+        success = get_variable(resource) == variable
     except Exception:
         LOGGER.exception('has_variable failed.')
         raise
@@ -460,27 +463,12 @@ def get_calendar(resource, variable=None):
     if type(resource) != list:
         resource = [resource]
 
-    try:
-        if len(resource) > 1:
-            ds = MFDataset(resource)
-        else:
-            ds = Dataset(resource[0])
-        time = ds.variables['time']
-    except:
+    time = get_header(resource[0])['time']
+    if time is None:
         msg = 'failed to get time'
-        LOGGER.exception(msg)
+        LOGGER.error(msg)
         raise Exception(msg)
-
-    if hasattr(time, 'units') is True:
-        unit = time.units
-    else:
-        unit = None
-
-    if hasattr(time, 'calendar') is True:
-        calendar = time.calendar
-    else:
-        calendar = None
-    return str(calendar), str(unit)
+    return str(time['calendar']), str(time['units'])
 
 
 def get_coordinates(resource, variable=None, unrotate=False):
@@ -501,18 +489,13 @@ def get_coordinates(resource, variable=None, unrotate=False):
 
     if unrotate is False:
         try:
-            if len(resource) > 1:
-                ds = MFDataset(resource)
-            else:
-                ds = Dataset(resource[0])
-
-            var = ds.variables[variable]
-            dims = list(var.dimensions)
-            if 'time' in dims: dims.remove('time')
-            # TODO: find position of lat and long in list and replace dims[0] dims[1]
-            lats = ds.variables[dims[0]][:]
-            lons = ds.variables[dims[1]][:]
-            ds.close()
+            with Aggregation(resource) as ds:
+                var = ds.variables[variable]
+                dims = list(var.dimensions)
+                if 'time' in dims: dims.remove('time')
+                # TODO: find position of lat and long in list and replace dims[0] dims[1]
+                lats = ds.variables[dims[0]][:]
+                lons = ds.variables[dims[1]][:]
             LOGGER.info('got coordinates without pole rotation')
         except Exception:
             msg = 'failed to extract coordinates'
@@ -555,17 +538,13 @@ def get_frequency(resource):
 
     :return str: frequency
     """
-    ds = Dataset(resource)
-
     try:
-        frequency = ds.frequency
+        frequency = get_header(resource)['attributes']['frequency']
         LOGGER.info('frequency written in the meta data:  %s', frequency)
     except Exception as e:
         msg = "Could not specify frequency for %s" % (resource)
         LOGGER.exception(msg)
         raise Exception(msg)
-    else:
-        ds.close()
     return frequency
 
 
@@ -581,15 +560,9 @@ def get_index_lat(resource, variable=None):
 
     if variable is None:
         variable = get_variable(resource)
-    if type(resource) != list:
-        resource = [resource]
-    if len(resource) == 1:
-        ds = Dataset(resource[0])
-    else:
-        ds = MFDataset(resource)
-
-    var = ds.variables[variable]
-    dims = list(var.dimensions)
+    # the dimensions are read from the catalog, no file is opened
+    with Aggregation(resource) as ds:
+        dims = list(ds.variables[variable].dimensions)
 
     if 'rlat' in dims:
         index = dims.index('rlat')
@@ -618,97 +591,109 @@ def get_timerange(resource):
     LOGGER.debug('length of recources: %s files' % len(resource))
 
     try:
-        if len(resource) > 1:
-            ds = MFDataset(resource)
-            LOGGER.debug('MFDataset loaded for %s of files in resource:' % len(resource))
-        else:
-            ds = Dataset(resource[0])
-            LOGGER.debug('Dataset loaded for %s file in resource:' % len(resource))
-        time = ds.variables['time']
-
-        if (hasattr(time, 'units') and hasattr(time, 'calendar')) is True:
-            s = num2date(time[0], time.units, time.calendar)
-            e = num2date(time[-1], time.units, time.calendar)
-        elif hasattr(time, 'units'):
-            s = num2date(time[0], time.units)
-            e = num2date(time[-1], time.units)
-        else:
-            s = num2date(time[0])
-            e = num2date(time[-1])
+        times = [header['time'] for header in get_headers(resource)]
+        s = min(time['start'] for time in times)
+        e = max(time['end'] for time in times)
 
         # TODO: include frequency
-        start = '%s%s%s' % (s.year, str(s.month).zfill(2), str(s.day).zfill(2))
-        end = '%s%s%s' % (e.year, str(e.month).zfill(2), str(e.day).zfill(2))
-        ds.close()
+        start = '%s%s%s' % (s[0], str(s[1]).zfill(2), str(s[2]).zfill(2))
+        end = '%s%s%s' % (e[0], str(e[1]).zfill(2), str(e[2]).zfill(2))
     except Exception:
         msg = 'failed to get time range'
         LOGGER.exception(msg)
-        ds.close()
         raise Exception(msg)
     return start, end
 
 
-def get_time(resource):
+def _time_variable(ds):
+    for name in ['time', 'time_counter']:
+        if name in ds.variables:
+            return ds.variables[name]
+    raise Exception('no time variable found')
+
+
+def get_time_axis(resource):
     """
-    returns all timestamps of given netcdf file as datetime list.
+    returns the time axis of netCDF files as ordinals: seconds since 0001-01-01 00:00:00
+    in the calendar of the files (see flyingpigeon.calendars).
+    The time axis of each file is decoded once and kept in memory.
 
-    :param resource: NetCDF file(s)
+    :param resource: NetCDF file(s) of one dataset, sorted in time
 
-    :return : list of timesteps
+    :return: numpy.array of int64 ordinals, calendar name
     """
-    # :param format: if a format is provided (e.g format='%Y%d%m'), values will be converted to string
+    import numpy as np
 
     if type(resource) != list:
         resource = [resource]
 
+    axes = []
+    for nc in resource:
+        try:
+            stat = os.stat(nc)
+            key = (os.path.abspath(nc), stat.st_size, stat.st_mtime)
+        except OSError:
+            key = (nc, None, None)
+
+        if key not in _TIME_AXES_:
+            with Dataset(nc) as ds:
+                time = _time_variable(ds)
+                units = time.units
+                calendar = calendars.get_calendar_name(getattr(time, 'calendar', None))
+                values = time[:]
+            try:
+                ordinals = calendars.decode(values, units, calendar)
+            except Exception as e:
+                # e.g. months since ..., decoded with netCDF4
+                LOGGER.debug('time axis of %s decoded with num2date: %s' % (nc, e))
+                ordinals = np.array([calendars.date_to_ordinal((d.year, d.month, d.day, d.hour, d.minute, d.second),
+                                                               calendar)
+                                     for d in num2date(values, units, calendar)], dtype=np.int64)
+            _TIME_AXES_[key] = (ordinals, calendar)
+        axes.append(_TIME_AXES_[key])
+
+    if len(set(calendar for _, calendar in axes)) > 1:
+        raise Exception('files with different calendars: %s' % resource)
+    return np.concatenate([ordinals for ordinals, _ in axes]), axes[0][1]
+
+
+def get_time(resource):
+    """
+    returns all timestamps of given netcdf file as datetime list.
+    Dates which do not exist in the gregorian calendar (e.g 30 February in the 360_day
+    calendar) are returned as netcdftime datetime objects.
+
+    :param resource: NetCDF file(s)
+
+    :return : list of timesteps
+    """
     try:
-        if len(resource) > 1:
-            ds = MFDataset(resource)
-        else:
-            ds = Dataset(resource[0])
-        time = ds.variables['time']
-    except:
+        ordinals, calendar = get_time_axis(resource)
+    except Exception:
         msg = 'failed to get time'
         LOGGER.exception(msg)
         raise Exception(msg)
 
-    try:
-        if (hasattr(time, 'units') and hasattr(time, 'calendar')) is True:
-            timestamps = num2date(time[:], time.units, time.calendar)
-        elif hasattr(time, 'units'):
-            timestamps = num2date(time[:], time.units)
-        else:
-            timestamps = num2date(time[:])
-        ds.close()
+    if calendar in calendars.REAL_CALENDARS:
+        return list(calendars.to_datetime64(ordinals, calendar).astype(object))
+
+    dates = calendars.components(ordinals, calendar).tolist()
+    ts = []
+    invalid = []
+    for i, date in enumerate(dates):
         try:
-            ts = [dt.strptime(str(i), '%Y-%m-%d %H:%M:%S') for i in timestamps]
-
-            # if date_format is not None:
-            #     ts = [t.strftime(format=date_format) for t in timestamps]
-            # else:
-            #    ts = [dt.strptime(str(i), '%Y-%m-%d %H:%M:%S') for i in timestamps]
-
-            # TODO give out dateformat by frequency
-            # ERROR: ValueError: unconverted data remains: 12:00:00
-            # from flyingpigeon.metadata import get_frequency
-
-            # frq = get_frequency(resource)
-            # if frq is 'day':
-            #     ts = [dt.strptime(str(i), '%Y-%m-%d') for i in timestamps]
-            # elif frq is 'mon':
-            #     ts = [dt.strptime(str(i), '%Y-%m') for i in timestamps]
-            # elif frq is 'sem':
-            #     ts = [dt.strptime(str(i), '%Y-%m') for i in timestamps]
-            # elif frq is 'yr':
-            #     ts = [dt.strptime(str(i), '%Y') for i in timestamps]
-            # else:
-            #     ts = [dt.strptime(str(i), '%Y-%m-%d %H:%M:%S') for i in timestamps]
-        except:
-            msg = 'failed to convert times to string'
-            LOGGER.exception(msg)
-    except:
-        msg = 'failed to convert time'
-        LOGGER.exception(msg)
+            ts.append(dt(*date))
+        except ValueError:
+            ts.append(None)
+            invalid.append(i)
+
+    if invalid:
+        # only the dates which do not exist in the gregorian calendar are converted with num2date
+        year = dates[invalid[0]][0]
+        reference = calendars.date_to_ordinal((year, 1, 1, 0, 0, 0), calendar)
+        units = 'seconds since %04d-01-01 00:00:00' % year
+        for i, date in zip(invalid, num2date(ordinals[invalid] - reference, units, calendar)):
+            ts[i] = date
     return ts
 
 
@@ -720,30 +705,36 @@ def get_variable(resource):
 
     :returns str: variable name
     """
-    rds = RequestDataset(resource)
-    return rds.variable
+    if type(resource) != list:
+        resource = [resource]
+    variable = get_header(resource[0])['variable']
+    if variable is None:
+        raise Exception('no variable detected in %s' % resource[0])
+    if type(variable) == list:
+        # several data variables
+        variable = tuple(variable)
+    return variable
 
 
-def get_values(resource, variable=None):
+def get_values(resource, variable=None, time_index=None):
     """
     returns the values for a list of files of files belonging to one dataset
 
     :param resource: list of files
     :param variable: variable to be picked from the files (if not set, variable will be detected)
+    :param time_index: index, slice or indices of the time steps to be read (default= all time steps)
 
     :returs numpy.array: values
     """
     from numpy import squeeze
     if variable is None:
         variable = get_variable(resource)
+    if time_index is None:
+        time_index = slice(None)
 
-    if isinstance(resource, basestring):
-        ds = Dataset(resource)
-    elif len(resource) == 1:
-        ds = Dataset(resource)
-    else:
-        ds = MFDataset(resource)
-    vals = squeeze(ds.variables[variable][:])
+    # only the files of the requested time steps are read
+    with Aggregation(resource) as ds:
+        vals = squeeze(ds.variables[variable][time_index])
     return vals
 
 
@@ -785,10 +776,9 @@ def rename_variable(resource, oldname=None, newname='newname'):
 
 
 def sort_by_time(resource):
-    from ocgis.util.helpers import get_sorted_uris_by_time_dimension
-
     if type(resource) == list and len(resource) > 1:
-        sorted_list = get_sorted_uris_by_time_dimension(resource)
+        starts = [header['time']['start'] for header in get_headers(resource)]
+        sorted_list = [nc for _, nc in sorted(zip(starts, resource))]
     elif type(resource) == str:
         sorted_list = [resource]
     else:
@@ -796,6 +786,25 @@ def sort_by_time(resource):
     return sorted_list
 
 
+def drs_facets(resource):
+    """
+    splits a DRS filename into its facets (see drs_filename)
+
+    :param resource: netCDF file
+
+    :return: tuple of facets without the timestamp, timestamp (e.g. '200601-200612')
+    """
+    name = os.path.basename(resource)
+    if name.endswith('.nc'):
+        name = name[:-3]
+    tokens = name.split('_')
+    return tuple(tokens[:-1]), tokens[-1]
+
+
+def _is_rcp(facet):
+    return re.match(r'^rcp\d+$', facet) is not None
+
+
 def sort_by_filename(resource, historical_concatination=False):
     """
     Sort a list of files with CORDEX-conformant file names.
@@ -809,79 +818,62 @@ def sort_by_filename(resource, historical_concatination=False):
     if type(resource) == str:
         resource = [resource]
 
-    ndic = {}
     tmp_dic = {}
 
     try:
         if len(resource) > 1:
             LOGGER.debug('sort_by_filename module start sorting %s files' % len(resource))
-            # LOGGER.debug('resource is list with %s files' % len(resource))
-            try:  # if len(resource) > 1:
-                # collect the different experiment names
-                for nc in resource:
-                    # LOGGER.info('file: %s' % nc)
-                    p, f = path.split(path.abspath(nc))
-                    n = f.split('_')
-                    bn = '_'.join(n[0:-1])  # skipping the date information in the filename
-                    ndic[bn] = []  # dictionary containing all datasets names
-                LOGGER.info('found %s datasets', len(ndic.keys()))
-            except Exception:
-                LOGGER.exception('failed to find names of datasets!')
+            # group the files by the facets of their names
+            groups = {}
+            for nc in resource:
+                facets, _ = drs_facets(nc)
+                groups.setdefault(facets, []).append(path.abspath(nc))
+            LOGGER.info('found %s datasets', len(groups))
+
             LOGGER.info('check for historical/RCP datasets')
+            if historical_concatination is True:
+                rcps = [facets for facets in groups if any(_is_rcp(f) for f in facets)]
+                if rcps:
+                    # the historical run of a RCP dataset has the same facets but the experiment
+                    for facets in rcps:
+                        hist = tuple('historical' if _is_rcp(f) else f for f in facets)
+                        groups[facets] = groups[facets] + groups.get(hist, [])
+                    for facets in list(groups.keys()):
+                        if any('historical' in f for f in facets):
+                            groups.pop(facets)
+                    LOGGER.info('historical data set names removed from dictionary')
+                else:
+                    LOGGER.info('no RCP dataset names found in dictionary')
+
+            # time ranges of the catalog, the headers of all files are looked up at once
             try:
-                if historical_concatination is True:
-                    # select only necessary names
-                    if any("_rcp" in s for s in ndic.keys()):
-                        for key in ndic.keys():
-                            if 'historical' in key:
-                                ndic.pop(key)
-                        LOGGER.info('historical data set names removed from dictionary')
-                    else:
-                        LOGGER.info('no RCP dataset names found in dictionary')
+                get_headers(sorted(set(nc for files in groups.values() for nc in files)))
+                catalog = True
             except Exception:
-                LOGGER.exception('failed to pop historical data set names!')
-            LOGGER.info('start sorting the files')
-            try:
-                for key in ndic:
+                LOGGER.exception('failed to read the file headers, time ranges taken from the file names')
+                catalog = False
+
+            for facets, files in groups.items():
+                key = '_'.join(facets)
+                files.sort()
+                start = end = None
+                if catalog is True:
                     try:
-                        if historical_concatination is False:
-                            for n in resource:
-                                if '%s_' % key in n:
-                                    ndic[key].append(path.abspath(n))  # path.join(p, n))
-
-                        elif historical_concatination is True:
-                            key_hist = key.replace('rcp26', 'historical').\
-                                replace('rcp45', 'historical').\
-                                replace('rcp65', 'historical').\
-                                replace('rcp85', 'historical')
-                            for n in resource:
-                                if '%s_' % key in n or '%s_' % key_hist in n:
-                                    ndic[key].append(path.abspath(n))  # path.join(p, n))
-                        else:
-                            LOGGER.error('append file paths to dictionary for key %s failed' % key)
-                        ndic[key].sort()
+                        start, end = get_timerange(files)
                     except Exception:
-                        LOGGER.exception('failed for %s ' % key)
-            except Exception:
-                LOGGER.exception('failed to populate the dictionary with appropriate files')
-            for key in ndic.keys():
-                try:
-                    ndic[key].sort()
-                    start, end = get_timerange(ndic[key])
-                    newkey = key + '_' + start + '-' + end
-                    tmp_dic[newkey] = ndic[key]
-                except Exception:
-                    msg = 'failed to sort the list of resources and add dates to keyname: %s' % key
-                    LOGGER.exception(msg)
-                    tmp_dic[key] = ndic[key]
-                    # raise Exception(msg)
+                        LOGGER.exception('failed to get the time range of %s from the catalog' % key)
+                if start is None:
+                    # time range of the file names
+                    start = drs_facets(files[0])[1].split('-')[0]
+                    end = drs_facets(files[-1])[1].split('-')[-1]
+                tmp_dic[key + '_' + start + '-' + end] = files
         elif len(resource) == 1:
             p, f = path.split(path.abspath(resource[0]))
             tmp_dic[f.replace('.nc', '')] = path.abspath(resource[0])
             LOGGER.debug('only one file! Nothing to sort, resource is passed into dictionary')
         else:
             LOGGER.debug('sort_by_filename module failed: resource is not 1 or >1')
-        LOGGER.info('sort_by_filename module done: %s datasets found' % len(ndic))
+        LOGGER.info('sort_by_filename module done: %s datasets found' % len(tmp_dic))
     except Exception:
         msg = 'failed to sort files by filename'
         LOGGER.exception(msg)
@@ -954,65 +946,57 @@ def unrotate_pole(resource, write_to_file=False):
     from numpy import reshape, repeat
     from iris.analysis import cartography as ct
 
-    if len(resource) == 1:
-        ds = Dataset(resource[0])
-    else:
-        ds = MFDataset(resource)
-
-    # ds = MFDataset(resource)
-
-    if 'lat' in ds.variables.keys():
-        LOGGER.info('file include unrotated coordinate values')
-        lats = ds.variables['lat'][:]
-        lons = ds.variables['lon'][:]
-    else:
-        try:
-            if 'rotated_latitude_longitude' in ds.variables:
-                rp = ds.variables['rotated_latitude_longitude']
-            elif 'rotated_pole' in ds.variables:
-                rp = ds.variables['rotated_pole']
-            else:
-                LOGGER.debug('rotated pole variable not found')
-            pole_lat = rp.grid_north_pole_latitude
-            pole_lon = rp.grid_north_pole_longitude
-        except:
-            LOGGER.exception('failed to find rotated_pole coordinates')
-        try:
-            if 'rlat' in ds.variables:
-                rlats = ds.variables['rlat']
-                rlons = ds.variables['rlon']
+    with Aggregation(resource) as ds:
+        if 'lat' in ds.variables.keys():
+            LOGGER.info('file include unrotated coordinate values')
+            lats = ds.variables['lat'][:]
+            lons = ds.variables['lon'][:]
+        else:
+            try:
+                if 'rotated_latitude_longitude' in ds.variables:
+                    rp = ds.variables['rotated_latitude_longitude']
+                elif 'rotated_pole' in ds.variables:
+                    rp = ds.variables['rotated_pole']
+                else:
+                    LOGGER.debug('rotated pole variable not found')
+                pole_lat = rp.grid_north_pole_latitude
+                pole_lon = rp.grid_north_pole_longitude
+            except:
+                LOGGER.exception('failed to find rotated_pole coordinates')
+            try:
+                if 'rlat' in ds.variables:
+                    rlats = ds.variables['rlat']
+                    rlons = ds.variables['rlon']
 
-            if 'x' in ds.variables:
-                rlats = ds.variables['y']
-                rlons = ds.variables['x']
-        except:
-            LOGGER.exception('failed to read in rotated coordiates')
+                if 'x' in ds.variables:
+                    rlats = ds.variables['y']
+                    rlons = ds.variables['x']
+            except:
+                LOGGER.exception('failed to read in rotated coordiates')
 
-        try:
-            rlons_i = reshape(rlons, (1, len(rlons)))
-            rlats_i = reshape(rlats, (len(rlats), 1))
-            grid_rlats = repeat(rlats_i, (len(rlons)), axis=1)
-            grid_rlons = repeat(rlons_i, (len(rlats)), axis=0)
-        except:
-            LOGGER.execption('failed to repeat coordinates')
-
-        lons, lats = ct.unrotate_pole(grid_rlons, grid_rlats, pole_lon, pole_lat)
-
-    if write_to_file is True:
-        lat = ds.createVariable('lat', 'f8', ('rlat', 'rlon'))
-        lon = ds.createVariable('lon', 'f8', ('rlat', 'rlon'))
-
-        lon.standard_name = "longitude"
-        lon.long_name = "longitude coordinate"
-        lon.units = 'degrees_east'
-        lat.standard_name = "latitude"
-        lat.long_name = "latitude coordinate"
-        lat.units = 'degrees_north'
-
-        lat[:] = lats
-        lon[:] = lons
-
-    ds.close()
+            try:
+                rlons_i = reshape(rlons, (1, len(rlons)))
+                rlats_i = reshape(rlats, (len(rlats), 1))
+                grid_rlats = repeat(rlats_i, (len(rlons)), axis=1)
+                grid_rlons = repeat(rlons_i, (len(rlats)), axis=0)
+            except:
+                LOGGER.execption('failed to repeat coordinates')
+
+            lons, lats = ct.unrotate_pole(grid_rlons, grid_rlats, pole_lon, pole_lat)
+
+        if write_to_file is True:
+            lat = ds.createVariable('lat', 'f8', ('rlat', 'rlon'))
+            lon = ds.createVariable('lon', 'f8', ('rlat', 'rlon'))
+
+            lon.standard_name = "longitude"
+            lon.long_name = "longitude coordinate"
+            lon.units = 'degrees_east'
+            lat.standard_name = "latitude"
+            lat.long_name = "latitude coordinate"
+            lat.units = 'degrees_north'
+
+            lat[:] = lats
+            lon[:] = lons
 
     return lats, lons
 
@@ -637,8 +637,10 @@ def map_PAmask(PAmask, file_extension='png'):
     return png_PA_mask
 
 
-def map_spatial_analog(ncfile, variable='dissimilarity', cmap='viridis', title='Spatial analog'):
+def map_spatial_analog(ncfile, variable='dissimilarity', cmap='viridis', title='Spatial analog', target=0):
     """Return a matplotlib Figure instance showing a map of the dissimilarity measure.
+
+    :param target: index of the target to show if the file holds the analogs of multiple targets
     """
     import netCDF4 as nc
     from flyingpigeon import utils
@@ -647,6 +649,8 @@ def map_spatial_analog(ncfile, variable='dissimilarity', cmap='viridis', title='
 
     try:
         var = utils.get_values(ncfile, variable)
+        if var.ndim == 3:
+            var = var[target]
         LOGGER.info('Data loaded')
 
         lats, lons = utils.get_coordinates(ncfile, variable=variable, unrotate=False)
@@ -659,7 +663,8 @@ def map_spatial_analog(ncfile, variable='dissimilarity', cmap='viridis', title='
 
         with nc.Dataset(ncfile) as D:
             V = D.variables[variable]
-            lon, lat = map(float, V.target_location.split(','))
+            location = V.target_location.split(';')[target]
+            lon, lat = map(float, location.split(','))
 
         LOGGER.info('Lat and lon loaded')
 
@@ -67,7 +67,6 @@ def get_anomalies(nc_file, frac=0.2, reference=None, method='ocgis', sseas='seri
             cdo = Cdo()
             #ip, nc_anual_cycle_tmp = mkstemp(dir='.', suffix='.nc')
             # TODO: if reference is none, use utils.get_time for nc_file to set the ref range
-            #       But will need to fix 360_day issue (use get_time_nc from analogs)
 
             # com = 'seldate'
             # comcdo = 'cdo %s,%s-%s-%s,%s-%s-%s %s %s' % (com, reference[0].year, reference[0].month, reference[0].day,